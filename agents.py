@@ -1,9 +1,22 @@
 from typing import List, Dict, Any, Callable
 import json
+import queue
+import hashlib
+import os
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from tools import MedicalTools
+from tool_cache import ToolCache, CACHE_DIR
+from image_pipeline import ImagePipeline
+from llm_cache import PersistentLLMCache
+from llm_scheduler import get_scheduler, PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from telemetry import Telemetry, traced
 
 SPECIALIST_POOL = [
     "General Internal Medicine Doctor",
@@ -17,21 +30,62 @@ SPECIALIST_POOL = [
 ]
 
 
+class _TokenForwarder(BaseCallbackHandler):
+    """Relays streamed tokens of one specialist call to a (role, token) callback."""
+
+    def __init__(self, role, on_token):
+        self.role = role
+        self.on_token = on_token
+        self.streamed = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.streamed = True
+            if self.on_token: self.on_token(self.role, token)
+
+
 class MDTAgents:
-    def __init__(self, api_key, base_url, text_model, vl_model, enable_tools=True):
+    def __init__(self, api_key, base_url, text_model, vl_model, enable_tools=True,
+                 parallel_specialists=True, max_workers=6, tool_cache_only=False, tool_cache_ttl_hours=168,
+                 tool_timeout=8.0, llm_cache_mode="deterministic", image_max_side=1024, image_quality=85,
+                 shared_image_findings=False, http_client=None, llm_rpm=0, llm_tpm=0, llm_max_concurrency=8,
+                 llm_max_retries=4):
+        # Per-consultation spans (wall time, TTFT, tokens) for every LLM call, tool call and node
+        self.telemetry = Telemetry()
+
+        # Shared keep-alive connection pool (see client_pool); None lets each client open its own
+        self.http_client = http_client
+
+        # Per-model rate limits, concurrency cap and retries, shared by every MDTAgents in the process
+        self.scheduler_limits = {"rpm": llm_rpm, "tpm": llm_tpm, "max_concurrency": llm_max_concurrency,
+                                 "max_retries": llm_max_retries}
+
+        # Response cache: temperature-0 calls by default; every call in record/replay mode
+        self.llm_cache = PersistentLLMCache(mode=llm_cache_mode) if llm_cache_mode != "off" else None
+        replay_all = self.llm_cache if llm_cache_mode in ("record", "replay") else False
+
         self.llm = ChatOpenAI(
             model=text_model,
             api_key=api_key,
             base_url=base_url,
             temperature=0.7,
-            streaming=True
+            streaming=True,
+            stream_usage=True,
+            cache=replay_all,
+            callbacks=[self.telemetry.handler],
+            http_client=http_client,
+            max_retries=0
         )
         self.critic_llm = ChatOpenAI(
             model=text_model,
             api_key=api_key,
             base_url=base_url,
             temperature=0.0,
-            streaming=False
+            streaming=False,
+            cache=self.llm_cache or False,
+            callbacks=[self.telemetry.handler],
+            http_client=http_client,
+            max_retries=0
         )
         self.vl_llm = ChatOpenAI(
             model=vl_model,
@@ -39,14 +93,41 @@ class MDTAgents:
             base_url=base_url,
             temperature=0.1,
             max_tokens=2048,
-            streaming=True
+            streaming=True,
+            stream_usage=True,
+            cache=replay_all,
+            callbacks=[self.telemetry.handler],
+            http_client=http_client,
+            max_retries=0
         )
 
-        self.tools = MedicalTools(enable=enable_tools)
+        # A replayed consultation must not depend on live search results either
+        self.tools = MedicalTools(enable=enable_tools, cache_only=tool_cache_only or llm_cache_mode == "replay",
+                                  cache_ttl_hours=tool_cache_ttl_hours, timeout=tool_timeout)
+        self.tools.telemetry = self.telemetry
+        self.parallel_specialists = parallel_specialists
+        self.max_workers = max_workers
+        # (case hash, role) -> search query / [query, tool result, shown via on_tool]; reused across
+        # the rounds of one consultation, cleared by reset_consultation
+        self._planned_queries = OrderedDict()
+        self._tool_results = OrderedDict()
+        # Downsized, correctly labeled image payloads, built once per image
+        self.images = ImagePipeline(max_side=image_max_side, quality=image_quality)
+        # Optional: one vision call per image, whose findings every specialist reads as text
+        self.shared_image_findings = shared_image_findings
+        self._image_findings = ToolCache(path=os.path.join(CACHE_DIR, "image_findings.sqlite"), ttl=0) \
+            if shared_image_findings else None
+        self._findings_lock = threading.Lock()
         # Callbacks
         self.stream_callback = None
         self.tool_callback = None
 
+    def _scheduled(self, llm, fn, priority=PRIORITY_NORMAL, prompt_text="", can_retry=None):
+        """Run one call of `llm` through its model's scheduler (the clients themselves never retry)."""
+        scheduler = get_scheduler(llm.openai_api_base, llm.model_name, **self.scheduler_limits)
+        est_tokens = len(prompt_text) // 4 + (llm.max_tokens or 1024)
+        return scheduler.run(fn, priority, est_tokens, self.telemetry, can_retry)
+
     def set_stream_callback(self, callback: Callable[[str, str], None]):
         self.stream_callback = callback
 
@@ -54,6 +135,7 @@ class MDTAgents:
         self.tool_callback = callback
 
     # 1. Primary Care (Triage)
+    @traced("primary_care")
     def primary_care_doctor(self, case_info: str) -> Dict[str, Any]:
         prompt = ChatPromptTemplate.from_template(
             """You are a Primary Care Doctor at the Triage Desk.
@@ -76,7 +158,8 @@ class MDTAgents:
             """
         )
         chain = prompt | self.llm
-        result = chain.invoke({"pool": ", ".join(SPECIALIST_POOL), "case": case_info})
+        inputs = {"pool": ", ".join(SPECIALIST_POOL), "case": case_info}
+        result = self._scheduled(self.llm, lambda: chain.invoke(inputs), PRIORITY_CRITICAL, case_info)
 
         content = result.content.strip()
         if content.startswith("```json"): content = content[7:]
@@ -96,25 +179,133 @@ class MDTAgents:
                 "selected_roles": ["General Internal Medicine Doctor", "General Surgeon", "Radiologist"]
             }
 
+    # 1b. Research Planner (one call for all selected roles)
+    @traced("query_planner")
+    def plan_tool_queries(self, case_info: str, roles: List[str]) -> Dict[str, str]:
+        if not self.tools.enable or not roles:
+            return {}
+
+        prompt = ChatPromptTemplate.from_template(
+            """For each specialist below, extract 1 specific medical query string they should research regarding the case.
+
+            Specialists: {roles}
+
+            Case: {case}
+
+            OUTPUT JSON FORMAT (one entry per specialist, query only):
+            {{
+                "Role A": "query",
+                "Role B": "query"
+            }}
+            """
+        )
+        chain = prompt | self.critic_llm
+        try:
+            inputs = {"case": case_info[:300], "roles": ", ".join(roles)}
+            content = self._scheduled(self.critic_llm, lambda: chain.invoke(inputs), PRIORITY_CRITICAL,
+                                      str(inputs)).content.strip()
+            if content.startswith("```json"): content = content[7:]
+            if content.endswith("```"): content = content[:-3]
+            data = json.loads(content)
+        except Exception as e:
+            print(f"Query planning failed: {e}")
+            return {}
+
+        case_key = self._case_key(case_info)
+        planned = {}
+        for role in roles:
+            query = data.get(role)
+            if isinstance(query, str) and query.strip():
+                planned[role] = query.strip()
+                self._remember(self._planned_queries, (case_key, role), planned[role])
+        return planned
+
+    @staticmethod
+    def _case_key(case_info: str) -> str:
+        return hashlib.sha1(case_info.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _remember(memo: OrderedDict, key, value, limit=512):
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > limit:
+            memo.popitem(last=False)
+
+    def reset_consultation(self):
+        """Forget per-consultation memos, so a re-run of the same case plans and searches afresh."""
+        self._planned_queries.clear()
+        self._tool_results.clear()
+
+    @traced("research")
+    def _research(self, role: str, case_info: str, on_tool=None) -> str:
+        """Tool context for (case, role): searched once per consultation, reused in later rounds."""
+        key = (self._case_key(case_info), role)
+        memo = self._tool_results.get(key)
+        if memo is not None:
+            kw, tool_res, shown = memo
+            if tool_res and on_tool and not shown:
+                # Searched without a listener (e.g. before the UI attached): show it once now
+                on_tool(role, kw, tool_res)
+                memo[2] = True
+            return tool_res
+
+        kw = self._planned_queries.get(key)
+        if kw is None:
+            # Fallback when the planner did not run or skipped this role
+            kw_prompt = ChatPromptTemplate.from_template(
+                "Extract 1 specific medical query string for {role} to research regarding: {case}. Return ONLY the query.")
+            kw_chain = kw_prompt | self.critic_llm
+            inputs = {"case": case_info[:300], "role": role}
+            kw = self._scheduled(self.critic_llm, lambda: kw_chain.invoke(inputs), PRIORITY_BACKGROUND,
+                                 str(inputs)).content
+
+        tool_res = ""
+        if kw and "no query" not in kw.lower():
+            tool_res = self.tools.run_tools(kw)
+            if tool_res and on_tool:
+                on_tool(role, kw, tool_res)
+        self._remember(self._tool_results, key, [kw, tool_res, bool(on_tool)])
+        return tool_res
+
+    # 1c. Shared image findings (optional)
+    @traced("image_findings")
+    def extract_image_findings(self, image_data: str) -> str:
+        """Objective findings for an image, extracted once per content hash and persisted across runs."""
+        prepared = self.images.prepare(image_data)
+        # Specialists of one round ask concurrently; only the first one pays for the call
+        with self._findings_lock:
+            findings = self._image_findings.get(self.vl_llm.model_name, prepared.digest)
+            if findings is not None:
+                return findings
+
+            messages = [
+                SystemMessage(content="You are a Radiologist preparing an image report for a multidisciplinary team."),
+                HumanMessage(content=[
+                    {"type": "text", "text": "Describe the objective findings in this medical image: modality, "
+                                             "anatomy, abnormalities and pertinent negatives. Do not give a "
+                                             "final diagnosis."},
+                    {"type": "image_url", "image_url": {"url": prepared.data_url}}
+                ])
+            ]
+            findings = self._scheduled(self.vl_llm, lambda: self.vl_llm.invoke(messages), PRIORITY_NORMAL).content
+            if findings:
+                self._image_findings.put(self.vl_llm.model_name, prepared.digest, findings)
+            return findings
+
     #2. Specialists (Consultation)
+    @traced("specialist")
     def specialist_consult(self, role: str, case_info: str, residual_context: str,
-                           image_data=None, round_num=1):
+                           image_data=None, round_num=1, on_token=None, on_tool=None):
+        on_token = on_token or self.stream_callback
+        on_tool = on_tool or self.tool_callback
 
         #Tool Usage Logic
         tool_context = ""
         if self.tools.enable:
             try:
-                kw_prompt = ChatPromptTemplate.from_template(
-                    "Extract 1 specific medical query string for {role} to research regarding: {case}. Return ONLY the query.")
-                kw_chain = kw_prompt | self.critic_llm
-                kw = kw_chain.invoke({"case": case_info[:300], "role": role}).content
-
-                if kw and "no query" not in kw.lower():
-                    tool_res = self.tools.run_tools(kw)
-                    if tool_res:
-                        if self.tool_callback:
-                            self.tool_callback(role, kw, tool_res)
-                        tool_context = f"\n[External Tools Data]:\n{tool_res}\n"
+                tool_res = self._research(role, case_info, on_tool)
+                if tool_res:
+                    tool_context = f"\n[External Tools Data]:\n{tool_res}\n"
             except Exception as e:
                 print(f"Tool error: {e}")
 
@@ -135,6 +326,13 @@ class MDTAgents:
              (State your clear medical opinion or diagnosis.)
         """
 
+        image_findings = ""
+        if round_num == 1 and image_data and self.shared_image_findings:
+            try:
+                image_findings = self.extract_image_findings(image_data)
+            except Exception as e:
+                print(f"Image findings error: {e}")
+
         system_prompt = f"You are a {role}. Provide expert medical opinion.\n{structure_instruction}"
 
         user_text = f"Patient Case: {case_info}\n{tool_context}\n"
@@ -142,7 +340,9 @@ class MDTAgents:
         if round_num == 1:
             user_text += "\n[Status]: Round 1. Analyze independently."
             user_text += f"\n*** PRIOR KNOWLEDGE / CONTEXT ***\n{residual_context}\n"
-            if image_data:
+            if image_findings:
+                user_text += f" [Image Findings (shared report)]:\n{image_findings}\nIntegrate them with the diagnosis."
+            elif image_data:
                 user_text += " [Image Provided]. Describe findings and integrate with diagnosis."
             else:
                 user_text += " No image provided."
@@ -154,28 +354,75 @@ class MDTAgents:
         messages = [SystemMessage(content=system_prompt)]
 
         target_llm = self.llm
-        if round_num == 1 and image_data:
+        if round_num == 1 and image_data and not image_findings:
             target_llm = self.vl_llm
-            img_url = f"data:image/jpeg;base64,{image_data}"
             content_payload = [
                 {"type": "text", "text": user_text},
-                {"type": "image_url", "image_url": {"url": img_url}}
+                {"type": "image_url", "image_url": {"url": self.images.prepare(image_data).data_url}}
             ]
             messages.append(HumanMessage(content=content_payload))
         else:
             messages.append(HumanMessage(content=user_text))
 
         try:
-            full_res = ""
-            for chunk in target_llm.stream(messages):
-                token = chunk.content
-                full_res += token
-                if self.stream_callback: self.stream_callback(role, token)
+            # invoke() on a streaming model still streams token-by-token through the
+            # callback, but also goes through the response cache (stream() bypasses it)
+            forwarder = _TokenForwarder(role, on_token)
+            full_res = self._scheduled(
+                target_llm, lambda: target_llm.invoke(messages, config={"callbacks": [forwarder]}),
+                PRIORITY_NORMAL, user_text,
+                # Once tokens reached the UI a retry would duplicate them
+                can_retry=lambda: not forwarder.streamed
+            ).content
+            if not forwarder.streamed and full_res and on_token:
+                on_token(role, full_res)
             return full_res
         except Exception as e:
             return f"Error: {e}"
 
+    def consult_round(self, roles: List[str], case_info: str, residual_context: str,
+                      image_data=None, round_num=1, role_contexts=None) -> List[str]:
+        """
+        Run every specialist of one round, concurrently if enabled. Results keep the triage order.
+        `role_contexts` (role -> context) replaces `residual_context` for the roles it covers.
+        """
+        role_contexts = role_contexts or {}
+        if not self.parallel_specialists or len(roles) < 2:
+            return [self.specialist_consult(role, case_info, role_contexts.get(role, residual_context),
+                                            image_data, round_num)
+                    for role in roles]
+
+        # Workers only enqueue events; callbacks are replayed on the calling thread,
+        # so UI handlers never see tokens from two threads at once.
+        events = queue.Queue()
+
+        def run(role):
+            try:
+                return self.specialist_consult(
+                    role, case_info, role_contexts.get(role, residual_context), image_data, round_num,
+                    on_token=lambda r, t: events.put(("token", r, t)),
+                    on_tool=lambda r, q, res: events.put(("tool", r, q, res))
+                )
+            finally:
+                events.put(("done", role))
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(roles))) as pool:
+            # Each worker runs in a copy of the caller's context so spans and callbacks nest correctly
+            futures = [pool.submit(contextvars.copy_context().run, run, role) for role in roles]
+            pending = len(futures)
+            while pending:
+                kind, *payload = events.get()
+                if kind == "done":
+                    pending -= 1
+                elif kind == "token" and self.stream_callback:
+                    self.stream_callback(*payload)
+                elif kind == "tool" and self.tool_callback:
+                    self.tool_callback(*payload)
+
+        return [f.result() for f in futures]
+
     #3. Lead Physician
+    @traced("lead_physician")
     def lead_physician_synthesis(self, round_dialogues: List[str], round_num: int):
         # Lead Physician DOES see all dialogues from the current round (to synthesize them),
         # but DOES NOT see Ground Truth.
@@ -200,10 +447,11 @@ class MDTAgents:
             """
         )
         chain = prompt | self.llm
-        res = chain.invoke({
+        inputs = {
             "rnd": round_num,
             "dialogues": "\n\n".join(round_dialogues)
-        })
+        }
+        res = self._scheduled(self.llm, lambda: chain.invoke(inputs), PRIORITY_CRITICAL, inputs["dialogues"])
 
         content = res.content.strip()
         if content.startswith("```json"): content = content[7:]
@@ -211,6 +459,7 @@ class MDTAgents:
         return content.strip()
 
     #4. Safety Reviewer
+    @traced("safety_reviewer")
     def safety_reviewer(self, current_bullet: str, round_num: int):
         prompt = ChatPromptTemplate.from_template(
             """You are the Safety and Ethics Reviewer.
@@ -229,10 +478,12 @@ class MDTAgents:
             """
         )
         chain = prompt | self.critic_llm
-        res = chain.invoke({"bullet": current_bullet})
+        res = self._scheduled(self.critic_llm, lambda: chain.invoke({"bullet": current_bullet}),
+                              PRIORITY_CRITICAL, current_bullet)
         return res.content
 
     # 5. CoT Reviewer
+    @traced("cot_reviewer")
     def cot_reviewer(self, case_info, final_answer, ground_truth):
         # Only this agent sees the Ground Truth
         prompt = ChatPromptTemplate.from_template(
@@ -263,11 +514,12 @@ class MDTAgents:
         )
         chain = prompt | self.critic_llm
         try:
-            res = chain.invoke({
+            inputs = {
                 "case": case_info[:500],
                 "answer": final_answer,
                 "truth": ground_truth
-            })
+            }
+            res = self._scheduled(self.critic_llm, lambda: chain.invoke(inputs), PRIORITY_BACKGROUND, str(inputs))
             content = res.content.strip()
             if content.startswith("```json"): content = content[7:]
             if content.endswith("```"): content = content[:-3]
@@ -1,10 +1,13 @@
 import streamlit as st
 import base64
 import json
-from agents import MDTAgents
-from workflow import create_workflow
+import threading
+import time
+import checkpoints
+import client_pool
 from utils import load_config, save_config
-from knowledge_base import kb_system
+from knowledge_base import kb_system, write_status
+from llm_cache import CACHE_MODES
 
 #Updated Page Config & Title
 st.set_page_config(page_title="MDTeamGPT System", layout="wide", page_icon="🏥")
@@ -23,6 +26,13 @@ st.markdown("""
 
 if "config" not in st.session_state:
     st.session_state.config = load_config()
+    kb_system.configure_index(st.session_state.config.get("kb_index_type", "hnsw"),
+                              st.session_state.config.get("kb_promote_at", 20000))
+    kb_system.configure_retention(st.session_state.config.get("kb_max_docs", 50000),
+                                  st.session_state.config.get("kb_dedup_similarity", 0.97),
+                                  st.session_state.config.get("kb_dedup_policy", "skip"))
+    kb_system.configure_retrieval(st.session_state.config.get("kb_retrieval_mode", "hybrid"),
+                                  st.session_state.config.get("kb_embed_timeout", 5.0))
 
 #Sidebar
 with st.sidebar:
@@ -38,19 +48,48 @@ with st.sidebar:
             vl_model = st.text_input("Vision Model ID", value=st.session_state.config.get("vl_model", "qwen-vl-plus"))
             enable_tools = st.checkbox("Enable Internet/PubMed",
                                        value=st.session_state.config.get("enable_tools", True))
+            tool_cache_only = st.checkbox("Tools: Cache Only (Offline)",
+                                          value=st.session_state.config.get("tool_cache_only", False))
+            parallel_specialists = st.checkbox("Run Specialists in Parallel",
+                                               value=st.session_state.config.get("parallel_specialists", True))
+            shared_image_findings = st.checkbox("Shared Image Findings (one vision call per image)",
+                                                value=st.session_state.config.get("shared_image_findings", False))
+            llm_cache_mode = st.selectbox("LLM Response Cache", CACHE_MODES,
+                                          index=CACHE_MODES.index(
+                                              st.session_state.config.get("llm_cache_mode", "deterministic")))
             if st.form_submit_button("Save Configuration"):
-                new_conf = {"api_key": api_key, "base_url": base_url, "text_model": text_model, "vl_model": vl_model,
-                            "enable_tools": enable_tools}
+                new_conf = {**st.session_state.config,
+                            "api_key": api_key, "base_url": base_url, "text_model": text_model, "vl_model": vl_model,
+                            "enable_tools": enable_tools, "tool_cache_only": tool_cache_only,
+                            "parallel_specialists": parallel_specialists, "llm_cache_mode": llm_cache_mode,
+                            "shared_image_findings": shared_image_findings}
                 save_config(new_conf)
                 st.session_state.config = new_conf
                 st.success("Configuration Saved!")
 
     max_rounds = st.slider("Max Discussion Rounds", 3, 15, 6)
 
+    resume_id = None
+    unfinished = checkpoints.get_runs().unfinished()
+    if unfinished:
+        with st.expander(f"⏯️ Unfinished Consultations ({len(unfinished)})", expanded=False):
+            picked = st.selectbox("Consultation", unfinished,
+                                  format_func=lambda r: f"{r['status']} · {r['case_snippet'][:50]}")
+            if picked["error"]:
+                st.caption(f"Last error: {picked['error']}")
+            if st.button("Resume from Last Round"):
+                if checkpoints.get_runs().start(picked["thread_id"]):
+                    resume_id = picked["thread_id"]
+                else:
+                    st.warning("This consultation was already resumed in another session.")
+
     st.divider()
     st.subheader("🧠 Context History")
     context_container = st.container()
 
+    st.subheader("⏱️ Timing")
+    timing_container = st.container()
+
 #Main Interface
 st.title("MDTeamGPT - Multi-Agent Multidisciplinary Consultation System")
 st.markdown("---")
@@ -64,7 +103,7 @@ with col1:
     st.markdown("### 🎓 Training Mode")
     ground_truth = st.text_input("Ground Truth (Correct Answer)")
 
-    img_file = st.file_uploader("Medical Image (Round 1 Only)", type=['jpg', 'png', 'jpeg'])
+    img_file = st.file_uploader("Medical Image (Round 1 Only)", type=['jpg', 'png', 'jpeg', 'webp', 'bmp'])
     img_base64 = None
     if img_file:
         # Explicitly display the uploaded image
@@ -76,178 +115,301 @@ with col1:
 
 #UI Handler
 class UIHandler:
-    def __init__(self, container):
+    """
+    Streams specialist tokens into one panel per role. Tokens are buffered and a panel is
+    re-rendered once a frame (1/`fps` s) has passed or `flush_chars` are pending, but never
+    before the pending text reaches `growth` x what is already shown, so rendering stays
+    linear in the answer length. Tokens from other threads are only buffered; Streamlit
+    elements are touched from the script thread alone.
+    """
+
+    def __init__(self, container, fps=8, flush_chars=400, growth=0.15):
         self.root_container = container
-        self.current_role = None
-        self.role_expander = None
-        self.text_placeholder = None
-        self.full_text = ""
+        self.interval = 1.0 / fps if fps else 0.0
+        self.flush_chars = flush_chars
+        self.growth = growth
+        # role -> {"expander", "placeholder", "parts", "pending", "shown", "flushed_at"}; reset every round
+        self.panels = {}
+        # role -> tokens received off the script thread, not yet in a panel
+        self._backlog = {}
+        self._lock = threading.RLock()
+        self._script_thread = threading.get_ident()
 
     def _ensure_expander(self, role):
-        if role != self.current_role:
-            self.current_role = role
-            self.full_text = ""
-            self.role_expander = self.root_container.expander(f"🗣️ {role} is speaking...", expanded=True)
-            self.text_placeholder = self.role_expander.empty()
+        if role not in self.panels:
+            expander = self.root_container.expander(f"🗣️ {role} is speaking...", expanded=True)
+            self.panels[role] = {"expander": expander, "placeholder": expander.empty(), "parts": [],
+                                 "pending": 0, "shown": 0, "flushed_at": 0.0}
+        return self.panels[role]
+
+    def _flush(self, panel, final=False):
+        text = "".join(panel["parts"])
+        panel["parts"] = [text]
+        panel["placeholder"].markdown(text if final else text + "▌")
+        panel["shown"] = len(text)
+        panel["pending"] = 0
+        panel["flushed_at"] = time.monotonic()
 
     def on_token(self, role, token):
-        self._ensure_expander(role)
-        self.full_text += token
-        self.text_placeholder.markdown(self.full_text + "▌")
+        with self._lock:
+            if threading.get_ident() != self._script_thread:
+                # Off the script thread: keep the text, render on the next script-thread call
+                self._backlog.setdefault(role, []).append(token)
+                return
+            panel = self._ensure_expander(role)
+            backlog = self._backlog.pop(role, [])
+            backlog.append(token)
+            panel["parts"].extend(backlog)
+            panel["pending"] += sum(len(t) for t in backlog)
+
+            min_pending = self.growth * panel["shown"]
+            due = time.monotonic() - panel["flushed_at"] >= self.interval
+            if panel["pending"] >= max(self.flush_chars, min_pending) or (due and panel["pending"] >= min_pending):
+                self._flush(panel)
 
     def finish_turn(self):
-        if self.text_placeholder:
-            self.text_placeholder.markdown(self.full_text)
+        with self._lock:
+            for role, backlog in self._backlog.items():
+                self._ensure_expander(role)["parts"].extend(backlog)
+            self._backlog = {}
+            for panel in self.panels.values():
+                self._flush(panel, final=True)
+            self.panels = {}
 
     def on_tool_output(self, role, query, result):
-        self._ensure_expander(role)
-        with self.role_expander:
+        panel = self._ensure_expander(role)
+        with panel["expander"]:
             with st.expander(f"🛠️ Tool Usage: {query}", expanded=False):
                 st.markdown(f"<div class='tool-box'>{result}</div>", unsafe_allow_html=True)
 
 
+def save_badge(placeholder, status, kb_name):
+    """Badge for a `write_status` result: only a write that landed is shown as saved."""
+    if status == "saved":
+        placeholder.markdown(f"<span class='saved-badge'>✅ Saved to: {kb_name}</span>", unsafe_allow_html=True)
+    elif status == "queued":
+        placeholder.markdown(f"<span class='saved-badge'>⏳ Queued for: {kb_name} (the background writer is still busy)"
+                             f"</span>", unsafe_allow_html=True)
+    else:
+        placeholder.markdown(f"<span class='not-saved-badge'>❌ Save to {kb_name} {status}</span>",
+                             unsafe_allow_html=True)
+
+
+def render_round_timing(container, rnd, spans):
+    """Per-round breakdown: each specialist's wall time, time-to-first-token, tools and tokens."""
+    llm = [s for s in spans if s["name"] == "llm"]
+    rows = ["| Step | Wall (s) | TTFT (s) | Tools (s) | Tokens in/out |", "|---|---|---|---|---|"]
+    for sp in (s for s in spans if s["name"] == "specialist"):
+        calls = [c for c in llm if c.get("parent") == "specialist" and c.get("role") == sp.get("role")]
+        ttft = next((c["ttft_s"] for c in calls if "ttft_s" in c), None)
+        tools = sum(t["wall_s"] for t in spans if t["name"] == "tool" and t.get("role") == sp.get("role"))
+        rows.append(f"| {sp.get('role')} | {sp['wall_s']:.2f} | {f'{ttft:.2f}' if ttft is not None else '-'} | "
+                    f"{tools:.2f} | {sum(c.get('prompt_tokens', 0) for c in calls)}/"
+                    f"{sum(c.get('completion_tokens', 0) for c in calls)} |")
+    for name, label in (("lead_physician", "Lead Physician"), ("node.consultation", "**Round total**")):
+        sp = next((s for s in spans if s["name"] == name), None)
+        if sp:
+            rows.append(f"| {label} | {sp['wall_s']:.2f} | - | - | - |")
+    with container:
+        with st.expander(f"⏱️ Round {rnd} Timing", expanded=False):
+            st.markdown("\n".join(rows))
+
+
 # Execution
-if start_btn:
+if start_btn or resume_id:
     cfg = st.session_state.config
-    if not cfg.get("api_key"): st.stop()
-
-    agents = MDTAgents(cfg["api_key"], cfg["base_url"], cfg["text_model"], cfg["vl_model"], cfg["enable_tools"])
-    app = create_workflow(agents)
-
-    with col2:
-        st.subheader("Consultation Process")
-        status_log = st.status("Initializing Workflow...", expanded=True)
-        chat_box = st.container()
-
-        ui = UIHandler(chat_box)
-        agents.set_stream_callback(ui.on_token)
-        agents.set_tool_callback(ui.on_tool_output)
-
-        state = {
-            "case_info": case_input, "image_base64": img_base64, "ground_truth": ground_truth,
-            "selected_roles": [], "triage_reason": "", "current_round": 1, "max_rounds": max_rounds,
-            "context_bullets": [], "final_answer": "", "is_converged": False,
-            "kb_context_text": "", "kb_context_docs": []
-        }
-
-        try:
-            for event in app.stream(state):
-
-                if "triage" in event:
-                    data = event["triage"]
-                    status_log.write(f"✅ Triage Complete")
-
-                    docs = data.get('kb_context_docs', [])
-                    if docs:
-                        with chat_box.expander(f"📚 Knowledge Retrieval ({len(docs)} Matches)", expanded=False):
-                            for doc in docs:
-                                source = doc.metadata.get("source_kb", "Unknown")
-                                st.markdown(
-                                    f"<div class='retrieval-box'><b>Source:</b> {source}<br>{doc.page_content}</div>",
-                                    unsafe_allow_html=True)
-                    else:
-                        chat_box.caption("ℹ️ No relevant long-term experience found.")
-
-                    chat_box.info(f"**📋 Triage Reasoning:** {data['triage_reason']}")
-                    chat_box.success(f"**Selected Specialists:** {', '.join(data['selected_roles'])}")
-                    chat_box.markdown("---")
-
-                if "consultation_layer" in event:
-                    ui.finish_turn()
-                    data = event["consultation_layer"]
-                    rnd = data["current_round"]
-                    status_log.update(label=f"Round {rnd}: Consultation...", state="running")
-
-                    # --- Update Sidebar with 6-Part Context ---
-                    latest_bullet = data["context_bullets"][-1]
-                    with context_container:
-                        with st.expander(f"📝 Round {rnd} Context", expanded=False):
-                            try:
-                                ctx_data = json.loads(latest_bullet)
-                                # 6-Part Display
-                                st.markdown(
-                                    f"<span class='context-label'>Consistency:</span> {ctx_data.get('Consistency', '-')}",
-                                    unsafe_allow_html=True)
-                                st.markdown(
-                                    f"<span class='context-label'>Conflict:</span> {ctx_data.get('Conflict', '-')}",
-                                    unsafe_allow_html=True)
-                                st.markdown(
-                                    f"<span class='context-label'>Independence:</span> {ctx_data.get('Independence', '-')}",
-                                    unsafe_allow_html=True)
-                                st.markdown(
-                                    f"<span class='context-label'>Integration:</span> {ctx_data.get('Integration', '-')}",
-                                    unsafe_allow_html=True)
-                                st.markdown(
-                                    f"<span class='context-label'>Tools Usage:</span> {ctx_data.get('Tools_Usage', '-')}",
-                                    unsafe_allow_html=True)
-                                st.markdown(
-                                    f"<span class='context-label'>Long-Term Exp:</span> {ctx_data.get('Long_Term_Experience', '-')}",
-                                    unsafe_allow_html=True)
-                            except:
-                                st.text(latest_bullet)
-
-                if "safety_layer" in event:
-                    data = event["safety_layer"]
-                    if data["is_converged"]:
-                        status_log.update(label="✅ Converged", state="complete", expanded=False)
-                        st.balloons()
-                        st.markdown("### 🏁 Final Medical Conclusion")
-                        st.success(data["final_answer"])
-
-                        # Training Logic
-                        if ground_truth:
-                            st.markdown("---")
-                            st.markdown("### 🧪 Chain-of-Thought Review")
-                            with st.spinner("Grading and saving experience..."):
-                                result = agents.cot_reviewer(case_input, data["final_answer"], ground_truth)
-
-                                st.markdown(f"<div class='cot-box'>", unsafe_allow_html=True)
-
-                                if result.get("is_correct"):
-                                    st.markdown("#### ✅ Answer is Correct")
-                                    summary_s4 = result.get("summary_s4", "No summary provided.")
-                                    st.write(f"**S4 Summary:** {summary_s4}")
-
-                                    # Formulate Record for CorrectKB
-                                    record = {
-                                        "Question": case_input,
-                                        "Answer": data["final_answer"],
-                                        "Summary of S4_final": summary_s4
-                                    }
-                                    kb_system.save_correct_experience(record)
-
-                                    st.markdown("---")
-                                    st.markdown(f"<span class='saved-badge'>✅ Saved to: CorrectKB</span>",
-                                                unsafe_allow_html=True)
+    if not cfg.get("api_key"):
+        if resume_id:
+            checkpoints.get_runs().finish(resume_id, "No API key configured", resumable=True)
+        st.stop()
+
+    # Agents and the compiled graph are reused across consultations with the same config
+    with client_pool.checkout(cfg) as runtime:
+        agents, app = runtime.agents, runtime.app
+
+        with col2:
+            st.subheader("Consultation Process")
+            status_log = st.status("Initializing Workflow...", expanded=True)
+            chat_box = st.container()
+
+            ui = UIHandler(chat_box, fps=cfg.get("ui_fps", 8), flush_chars=cfg.get("ui_flush_chars", 400))
+            agents.set_stream_callback(ui.on_token)
+            agents.set_tool_callback(ui.on_tool_output)
+
+            if resume_id:
+                # Continue a checkpointed run: case, ground truth and round limit come from its saved state
+                thread_id, state = resume_id, None
+                saved = checkpoints.saved_state(app, thread_id)
+                case_input = saved.get("case_info", "")
+                ground_truth = saved.get("ground_truth", "")
+                max_rounds = saved.get("max_rounds", max_rounds)
+                selected_roles = saved.get("selected_roles", [])
+                status_log.write(f"⏯️ Resuming from round {saved.get('current_round', 1)}")
+            else:
+                thread_id = checkpoints.new_thread_id()
+                selected_roles = []
+                state = {
+                    "case_info": case_input, "image_base64": img_base64, "ground_truth": ground_truth,
+                    "selected_roles": [], "triage_reason": "", "current_round": 1, "max_rounds": max_rounds,
+                    "context_bullets": [], "final_answer": "", "is_converged": False,
+                    "kb_context_text": "", "kb_context_docs": [], "role_kb_docs": {}, "timings": {},
+                    "telemetry": []
+                }
+
+            run_error = None
+            pending_saves = []  # (badge placeholder, save future, store name)
+            try:
+                graph_input = checkpoints.begin(app, thread_id, state)
+                for event in app.stream(graph_input, checkpoints.run_config(thread_id, max_rounds)):
+
+                    if "triage" in event:
+                        data = event["triage"]
+                        status_log.write(f"✅ Triage Complete")
+
+                        docs = data.get('kb_context_docs', [])
+                        if docs:
+                            with chat_box.expander(f"📚 Knowledge Retrieval ({len(docs)} Matches)", expanded=False):
+                                for doc in docs:
+                                    source = doc.metadata.get("source_kb", "Unknown")
                                     st.markdown(
-                                        f"<span class='not-saved-badge'>❌ NOT Saved to: ChainKB (Reason: Answer was correct)</span>",
+                                        f"<div class='retrieval-box'><b>Source:</b> {source}<br>{doc.page_content}</div>",
                                         unsafe_allow_html=True)
-
-                                else:
-                                    st.markdown("#### ❌ Answer is Incorrect")
-                                    st.write(f"**Error Reflection:** {result.get('error_reflection', '-')}")
-
-                                    # Formulate Record for ChainKB
-                                    record = {
-                                        "Question": case_input,
-                                        "Correct Answer": ground_truth,
-                                        "Initial Hypothesis": result.get("initial_hypothesis", "-"),
-                                        "Analysis Process": result.get("analysis_process", "-"),
-                                        "Final Conclusion": result.get("final_conclusion", "-"),
-                                        "Error Reflection": result.get("error_reflection", "-")
-                                    }
-                                    kb_system.save_reflection_experience(record)
-
-                                    st.markdown("---")
-                                    st.markdown(f"<span class='saved-badge'>✅ Saved to: ChainKB</span>",
-                                                unsafe_allow_html=True)
+                        else:
+                            chat_box.caption("ℹ️ No relevant long-term experience found.")
+                        role_docs = data.get("role_kb_docs") or {}
+                        if any(role_docs.values()):
+                            chat_box.caption("🎯 Prior knowledge per specialist: " + " · ".join(
+                                f"{role} {len(docs)}" for role, docs in role_docs.items()))
+
+                        chat_box.info(f"**📋 Triage Reasoning:** {data['triage_reason']}")
+                        selected_roles = data["selected_roles"]
+                        chat_box.success(f"**Selected Specialists:** {', '.join(selected_roles)}")
+                        timings = data.get("timings", {})
+                        if timings:
+                            chat_box.caption(f"⏱️ Retrieval {timings.get('triage.retrieval_s', 0):.2f}s · "
+                                             f"Triage {timings.get('triage.primary_care_s', 0):.2f}s "
+                                             f"(run concurrently, {timings.get('triage.total_s', 0):.2f}s total)")
+                        chat_box.markdown("---")
+
+                    if "consultation_layer" in event:
+                        ui.finish_turn()
+                        data = event["consultation_layer"]
+                        rnd = data["current_round"]
+                        status_log.update(label=f"Round {rnd}: Consultation...", state="running")
+
+                        # --- Update Sidebar with 6-Part Context ---
+                        latest_bullet = data["context_bullets"][-1]
+                        with context_container:
+                            with st.expander(f"📝 Round {rnd} Context", expanded=False):
+                                try:
+                                    ctx_data = json.loads(latest_bullet)
+                                    # 6-Part Display
                                     st.markdown(
-                                        f"<span class='not-saved-badge'>❌ NOT Saved to: CorrectKB (Reason: Answer was incorrect)</span>",
+                                        f"<span class='context-label'>Consistency:</span> {ctx_data.get('Consistency', '-')}",
                                         unsafe_allow_html=True)
-
-                                st.markdown("</div>", unsafe_allow_html=True)
-                    else:
-                        chat_box.warning("⚠️ Divergence detected. Continuing...")
-
-        except Exception as e:
-            st.error(f"Error: {e}")
\ No newline at end of file
+                                    st.markdown(
+                                        f"<span class='context-label'>Conflict:</span> {ctx_data.get('Conflict', '-')}",
+                                        unsafe_allow_html=True)
+                                    st.markdown(
+                                        f"<span class='context-label'>Independence:</span> {ctx_data.get('Independence', '-')}",
+                                        unsafe_allow_html=True)
+                                    st.markdown(
+                                        f"<span class='context-label'>Integration:</span> {ctx_data.get('Integration', '-')}",
+                                        unsafe_allow_html=True)
+                                    st.markdown(
+                                        f"<span class='context-label'>Tools Usage:</span> {ctx_data.get('Tools_Usage', '-')}",
+                                        unsafe_allow_html=True)
+                                    st.markdown(
+                                        f"<span class='context-label'>Long-Term Exp:</span> {ctx_data.get('Long_Term_Experience', '-')}",
+                                        unsafe_allow_html=True)
+                                except:
+                                    st.text(latest_bullet)
+
+                        render_round_timing(timing_container, rnd, data.get("telemetry", []))
+
+                    if "safety_layer" in event:
+                        data = event["safety_layer"]
+                        if data["is_converged"]:
+                            status_log.update(label="✅ Converged", state="complete", expanded=False)
+                            st.balloons()
+                            st.markdown("### 🏁 Final Medical Conclusion")
+                            st.success(data["final_answer"])
+
+                            # Training Logic
+                            if ground_truth:
+                                st.markdown("---")
+                                st.markdown("### 🧪 Chain-of-Thought Review")
+                                with st.spinner("Grading and saving experience..."):
+                                    result = agents.cot_reviewer(case_input, data["final_answer"], ground_truth)
+
+                                    st.markdown(f"<div class='cot-box'>", unsafe_allow_html=True)
+
+                                    if result.get("is_correct"):
+                                        st.markdown("#### ✅ Answer is Correct")
+                                        summary_s4 = result.get("summary_s4", "No summary provided.")
+                                        st.write(f"**S4 Summary:** {summary_s4}")
+
+                                        # Formulate Record for CorrectKB
+                                        record = {
+                                            "Question": case_input,
+                                            "Answer": data["final_answer"],
+                                            "Summary of S4_final": summary_s4
+                                        }
+                                        with agents.telemetry.span("kb.save", store="correct"):
+                                            saved = kb_system.save_correct_experience(record, selected_roles)
+
+                                        st.markdown("---")
+                                        pending_saves.append((st.empty(), saved, "CorrectKB"))
+                                        save_badge(pending_saves[-1][0], write_status(saved, timeout=0), "CorrectKB")
+                                        st.markdown(
+                                            f"<span class='not-saved-badge'>❌ NOT Saved to: ChainKB (Reason: Answer was correct)</span>",
+                                            unsafe_allow_html=True)
+
+                                    else:
+                                        st.markdown("#### ❌ Answer is Incorrect")
+                                        st.write(f"**Error Reflection:** {result.get('error_reflection', '-')}")
+
+                                        # Formulate Record for ChainKB
+                                        record = {
+                                            "Question": case_input,
+                                            "Correct Answer": ground_truth,
+                                            "Initial Hypothesis": result.get("initial_hypothesis", "-"),
+                                            "Analysis Process": result.get("analysis_process", "-"),
+                                            "Final Conclusion": result.get("final_conclusion", "-"),
+                                            "Error Reflection": result.get("error_reflection", "-")
+                                        }
+                                        with agents.telemetry.span("kb.save", store="cot"):
+                                            saved = kb_system.save_reflection_experience(record, selected_roles)
+
+                                        st.markdown("---")
+                                        pending_saves.append((st.empty(), saved, "ChainKB"))
+                                        save_badge(pending_saves[-1][0], write_status(saved, timeout=0), "ChainKB")
+                                        st.markdown(
+                                            f"<span class='not-saved-badge'>❌ NOT Saved to: CorrectKB (Reason: Answer was incorrect)</span>",
+                                            unsafe_allow_html=True)
+
+                                    st.markdown("</div>", unsafe_allow_html=True)
+                        else:
+                            chat_box.warning("⚠️ Divergence detected. Continuing...")
+
+            except Exception as e:
+                run_error = str(e)
+                ui.finish_turn()
+                st.error(f"Error: {e}")
+                st.caption("Progress up to the last completed round is saved; resume it from the sidebar.")
+            checkpoints.end(app, thread_id, run_error)
+
+            with timing_container:
+                totals = agents.telemetry.totals()
+                st.caption(f"{totals['llm_calls']} LLM calls · {totals['prompt_tokens']} prompt / "
+                           f"{totals['completion_tokens']} completion tokens")
+                st.download_button("Export spans (JSONL)", agents.telemetry.to_jsonl(), file_name="spans.jsonl")
+                st.download_button("Export metrics (Prometheus)", agents.telemetry.to_prometheus(),
+                                   file_name="metrics.prom")
+                pool = client_pool.pool_stats()
+                st.caption(f"♻️ Runtime pool: {pool['built']} built · {pool['reused']} reused · "
+                           f"{pool['http_connections']} open connections")
+
+            # Save badges showed "queued" straight away; settle them once the rest of the page is rendered
+            for placeholder, saved, kb_name in pending_saves:
+                save_badge(placeholder, write_status(saved), kb_name)
\ No newline at end of file
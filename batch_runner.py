@@ -0,0 +1,300 @@
+"""
+Headless batch training / evaluation over a JSONL dataset.
+
+Each input line is one case:
+    {"id": "q1", "case": "...", "image": "<path or base64>", "ground_truth": "..."}
+
+Usage:
+    python batch_runner.py --input medqa.jsonl --output results.jsonl --concurrency 4
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import checkpoints
+import client_pool
+from knowledge_base import kb_system, write_status
+from llm_cache import CACHE_MODES
+from llm_scheduler import scheduler_stats
+from utils import load_config
+
+
+def load_cases(path):
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", f"case-{i}")
+            cases.append(item)
+    return cases
+
+
+def load_done_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            # Failed cases run again and pick up from their last checkpointed round
+            if "id" in entry and "error" not in entry:
+                done.add(entry["id"])
+    return done
+
+
+def load_unsaved_experiences(path):
+    """
+    Experiences of finished cases that no "kb_saved" marker covers, i.e. that were still
+    buffered when an earlier run stopped. Re-saving one that did land is a near-duplicate
+    and skipped by the KB.
+    """
+    experiences, saved = {}, set()
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "kb_saved" in entry:
+                saved.update(entry["kb_saved"])
+            elif "experience" in entry and "error" not in entry:
+                experiences[entry["id"]] = entry["experience"]
+    return [(case_id, exp) for case_id, exp in experiences.items() if case_id not in saved]
+
+
+def load_image(image):
+    if not image:
+        return None
+    if os.path.exists(image):
+        with open(image, "rb") as f:
+            return base64.b64encode(f.read()).decode("utf-8")
+    return image
+
+
+class BatchRunner:
+    def __init__(self, cfg, max_rounds=6, train=True, kb_batch_size=16, spans_path=None):
+        self.cfg = cfg
+        self.spans_path = spans_path
+        self.max_rounds = max_rounds
+        self.train = train
+        self.kb_batch_size = kb_batch_size
+
+        self._local = threading.local()
+        self._spans_lock = threading.Lock()
+        # (case id, experience) written to the results but not yet confirmed saved to the KB
+        self._pending = []
+
+    def _worker(self):
+        """One MDTAgents + compiled graph per worker thread, so telemetry is per case."""
+        if not hasattr(self._local, "agents"):
+            cfg = self.cfg
+            # Per-thread agents (separate telemetry), one shared keep-alive connection pool
+            agents, app = client_pool.build_runtime(cfg, client_pool.get_http_client())
+            self._local.agents = agents
+            self._local.app = app
+        return self._local.agents, self._local.app
+
+    def run_case(self, item):
+        agents, app = self._worker()
+        agents.telemetry.reset()
+        case = item.get("case") or item.get("question", "")
+        ground_truth = item.get("ground_truth") or item.get("answer", "")
+
+        state = {
+            "case_info": case, "image_base64": load_image(item.get("image")), "ground_truth": ground_truth,
+            "selected_roles": [], "triage_reason": "", "current_round": 1, "max_rounds": self.max_rounds,
+            "context_bullets": [], "final_answer": "", "is_converged": False,
+            "kb_context_text": "", "kb_context_docs": [], "role_kb_docs": {}, "timings": {},
+            "telemetry": []
+        }
+
+        result = {"id": item["id"]}
+        thread_id = self.thread_id(item["id"], case)
+        started = time.perf_counter()
+        try:
+            graph_input = checkpoints.begin(app, thread_id, state)
+            if graph_input is None:
+                print(f"{item['id']}: resuming from checkpoint")
+            final = app.invoke(graph_input, checkpoints.run_config(thread_id, self.max_rounds))
+            result["final_answer"] = final["final_answer"]
+            result["rounds"] = len(final["context_bullets"])
+            result["selected_roles"] = final["selected_roles"]
+            result["timings"] = final.get("timings", {})
+
+            if ground_truth:
+                review = agents.cot_reviewer(case, final["final_answer"], ground_truth)
+                result["is_correct"] = bool(review.get("is_correct"))
+                if self.train:
+                    # Stored with the result line, so a crash before the KB write cannot lose it
+                    result["experience"] = self._experience(case, final["final_answer"], ground_truth, review,
+                                                            final["selected_roles"])
+        except Exception as e:
+            result["error"] = str(e)
+        checkpoints.end(app, thread_id, result.get("error"))
+
+        result["latency_s"] = round(time.perf_counter() - started, 3)
+        result.update(agents.telemetry.totals())
+        if self.spans_path:
+            self._write_spans(item["id"], agents.telemetry.since(0))
+        return result
+
+    @staticmethod
+    def thread_id(case_id, case):
+        # Case ids repeat across datasets ("case-0"), so the text is part of the key
+        return f"batch:{case_id}:{hashlib.sha1(case.encode('utf-8')).hexdigest()[:10]}"
+
+    def _write_spans(self, case_id, spans):
+        with self._spans_lock, open(self.spans_path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps({"case_id": case_id, **span}, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _experience(case, final_answer, ground_truth, review, roles):
+        # Same records as the Streamlit training mode
+        if review.get("is_correct"):
+            return {"store": "correct", "roles": roles, "record": {
+                "Question": case,
+                "Answer": final_answer,
+                "Summary of S4_final": review.get("summary_s4", "No summary provided.")
+            }}
+        return {"store": "cot", "roles": roles, "record": {
+            "Question": case,
+            "Correct Answer": ground_truth,
+            "Initial Hypothesis": review.get("initial_hypothesis", "-"),
+            "Analysis Process": review.get("analysis_process", "-"),
+            "Final Conclusion": review.get("final_conclusion", "-"),
+            "Error Reflection": review.get("error_reflection", "-")
+        }}
+
+    def _flush_experiences(self, out):
+        """Save buffered experiences in one batch, then mark their cases as saved in the results file."""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        correct = [exp for _, exp in pending if exp["store"] == "correct"]
+        reflection = [exp for _, exp in pending if exp["store"] == "cot"]
+        futures = kb_system.save_experiences([e["record"] for e in correct], [e["record"] for e in reflection],
+                                             correct_roles=[e["roles"] for e in correct],
+                                             reflection_roles=[e["roles"] for e in reflection])
+        statuses = [write_status(f, timeout=None) for f in futures]
+        if any(status != "saved" for status in statuses):
+            # Left unmarked: the next run of this output file saves them again
+            print(f"KB batch of {len(pending)} experiences not saved: {statuses}")
+            return
+        out.write(json.dumps({"kb_saved": [case_id for case_id, _ in pending]}) + "\n")
+        out.flush()
+
+    def run(self, cases, output_path, concurrency=1):
+        done = load_done_ids(output_path)
+        todo = [c for c in cases if c["id"] not in done]
+        print(f"{len(cases)} cases, {len(done)} already done, {len(todo)} to run.")
+
+        kb_system.configure_index(self.cfg.get("kb_index_type", "hnsw"), self.cfg.get("kb_promote_at", 20000))
+        kb_system.configure_retention(self.cfg.get("kb_max_docs", 50000), self.cfg.get("kb_dedup_similarity", 0.97),
+                                      self.cfg.get("kb_dedup_policy", "skip"))
+        kb_system.configure_retrieval(self.cfg.get("kb_retrieval_mode", "hybrid"),
+                                      self.cfg.get("kb_embed_timeout", 5.0))
+        kb_system.init_embeddings(api_key=self.cfg["api_key"], base_url=self.cfg["base_url"],
+                                  http_client=client_pool.get_http_client())
+
+        if self.train:
+            self._pending = load_unsaved_experiences(output_path)
+            if self._pending:
+                print(f"{len(self._pending)} experiences from an earlier run were not saved yet; saving them.")
+
+        with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(self.run_case, c) for c in todo]
+            for n, future in enumerate(as_completed(futures), 1):
+                res = future.result()
+                # One line per finished case doubles as the resume checkpoint (results are written
+                # only from this thread)
+                out.write(json.dumps(res, ensure_ascii=False) + "\n")
+                out.flush()
+                status = res.get("error") or ("correct" if res.get("is_correct") else "done")
+                print(f"[{n}/{len(todo)}] {res['id']}: {status} ({res['latency_s']}s)")
+                if "experience" in res:
+                    self._pending.append((res["id"], res["experience"]))
+                if len(self._pending) >= self.kb_batch_size:
+                    self._flush_experiences(out)
+            self._flush_experiences(out)
+        kb_system.flush()
+
+        summary = summarize(output_path)
+        summary["scheduler"] = scheduler_stats()
+        with open(output_path + ".summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4)
+        return summary
+
+
+def summarize(output_path):
+    by_id = {}
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                # A retried case appears once per attempt; the latest one counts ("kb_saved" markers have no id)
+                if "id" in entry:
+                    by_id[entry["id"]] = entry
+    results = list(by_id.values())
+
+    ok = [r for r in results if "error" not in r]
+    graded = [r for r in ok if "is_correct" in r]
+    latencies = sorted(r["latency_s"] for r in ok)
+    return {
+        "cases": len(results),
+        "errors": len(results) - len(ok),
+        "accuracy": sum(r["is_correct"] for r in graded) / len(graded) if graded else None,
+        "mean_rounds": statistics.mean(r["rounds"] for r in ok) if ok else None,
+        "latency_p50_s": latencies[len(latencies) // 2] if latencies else None,
+        "latency_p95_s": latencies[int(len(latencies) * 0.95)] if latencies else None,
+        "prompt_tokens": sum(r.get("prompt_tokens", 0) for r in results),
+        "completion_tokens": sum(r.get("completion_tokens", 0) for r in results),
+        "llm_retries": sum(r.get("retries", 0) for r in results)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run MDTeamGPT over a JSONL dataset.")
+    parser.add_argument("--input", required=True, help="JSONL file with case / image / ground_truth per line")
+    parser.add_argument("--output", default="results.jsonl", help="Per-case results (also the resume checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Cases run in parallel")
+    parser.add_argument("--max-rounds", type=int, default=6)
+    parser.add_argument("--rps", type=float, default=None,
+                        help="Max LLM requests per second per model across all cases (sets llm_rpm)")
+    parser.add_argument("--kb-batch", type=int, default=16, help="Experiences buffered per KB write")
+    parser.add_argument("--no-train", action="store_true", help="Evaluate only; do not write to the KBs")
+    parser.add_argument("--spans", default=None, help="Append per-case telemetry spans to this JSONL file")
+    parser.add_argument("--llm-cache", choices=CACHE_MODES, default=None,
+                        help="Override llm_cache_mode (record a run, or replay it offline)")
+    args = parser.parse_args()
+
+    cfg = load_config()
+    if args.llm_cache:
+        cfg = {**cfg, "llm_cache_mode": args.llm_cache}
+    if args.rps:
+        # One rate limiter: the per-model scheduler every LLM call already goes through
+        cfg = {**cfg, "llm_rpm": max(1, round(args.rps * 60))}
+    if not cfg.get("api_key"):
+        parser.error("api_key missing in config.json")
+
+    runner = BatchRunner(cfg, max_rounds=args.max_rounds, train=not args.no_train,
+                         kb_batch_size=args.kb_batch, spans_path=args.spans)
+    summary = runner.run(load_cases(args.input), args.output, concurrency=args.concurrency)
+    print(json.dumps(summary, indent=4))
+
+
+if __name__ == "__main__":
+    main()
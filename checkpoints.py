@@ -0,0 +1,271 @@
+"""
+Consultation checkpointing: every graph step is saved under the consultation's thread id,
+so a run that died in round 5 resumes from its last completed node instead of starting over.
+
+    config = run_config(thread_id, max_rounds)
+    app.stream(state, config)   # new consultation
+    app.stream(None, config)    # resume it after a failure
+"""
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:
+    SqliteSaver = None
+
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_PATH = os.path.join(CHECKPOINT_DIR, "consultations.sqlite")
+
+# Running consultations refresh their heartbeat this often; one silent for STALE_AFTER_S
+# (or whose owner process is gone) is treated as orphaned and offered for resume
+HEARTBEAT_S = 30
+STALE_AFTER_S = 120
+
+_lock = threading.Lock()
+_checkpointer = None
+_runs = None
+
+
+if SqliteSaver is not None:
+    class _SqliteSaver(SqliteSaver):
+        """SqliteSaver whose async methods run the sync ones in a thread, so `app.astream` works too."""
+
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before,
+                                                                         limit=limit))):
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def _owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # Exists but belongs to another user (or the platform cannot tell): trust the heartbeat
+        return True
+    return True
+
+
+def _connect(path):
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+def get_checkpointer(path=CHECKPOINT_PATH):
+    """Process-wide saver: SQLite when langgraph-checkpoint-sqlite is installed, else in-memory."""
+    global _checkpointer
+    with _lock:
+        if _checkpointer is None:
+            if SqliteSaver is not None:
+                _checkpointer = _SqliteSaver(_connect(path))
+            else:
+                print("langgraph-checkpoint-sqlite not installed: checkpoints are kept in memory only.")
+                _checkpointer = InMemorySaver()
+        return _checkpointer
+
+
+def new_thread_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def run_config(thread_id, max_rounds=6) -> dict:
+    # LangGraph's default limit of 25 steps would cut off consultations longer than ~12 rounds
+    return {"configurable": {"thread_id": thread_id}, "recursion_limit": 4 * max_rounds + 10}
+
+
+_COLUMNS = ("thread_id", "case_snippet", "max_rounds", "status", "error", "created", "updated", "owner", "heartbeat")
+
+
+class ConsultationRuns:
+    """
+    Index of consultations (thread id, case snippet, status) so unfinished ones can be listed
+    and resumed. A running consultation records its owner (host:pid) and keeps a heartbeat
+    fresh, so runs still active in another process or session are not offered for resume.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH, heartbeat_s=HEARTBEAT_S, stale_after_s=STALE_AFTER_S):
+        self._lock = threading.Lock()
+        self.heartbeat_s = heartbeat_s
+        self.stale_after_s = stale_after_s
+        self._active = set()    # thread ids this process is running
+        self._beat = None
+        self._conn = _connect(path)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS consultation_runs (
+                   thread_id TEXT PRIMARY KEY,
+                   case_snippet TEXT NOT NULL,
+                   max_rounds INTEGER NOT NULL,
+                   status TEXT NOT NULL,
+                   error TEXT,
+                   created REAL NOT NULL,
+                   updated REAL NOT NULL,
+                   owner TEXT,
+                   heartbeat REAL
+               )"""
+        )
+        self._conn.commit()
+
+    def start(self, thread_id, case_info=None, max_rounds=None) -> bool:
+        """
+        Record a new run, or (without `case_info`) claim an existing one to run it again.
+        Returns False when the run is unknown or still active here or in another process.
+        """
+        now, owner = time.time(), _owner_id()
+        with self._lock:
+            if case_info is None:
+                row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM consultation_runs WHERE thread_id = ?",
+                                         (thread_id,)).fetchone()
+                if row is None or self.is_active(self._as_dict(row)):
+                    return False
+                run = self._as_dict(row)
+                # Compare-and-set against the row just read: of two concurrent claims only one matches
+                claimed = self._conn.execute(
+                    """UPDATE consultation_runs SET status = 'running', error = NULL, updated = ?, owner = ?,
+                                                    heartbeat = ?
+                       WHERE thread_id = ? AND status = ? AND updated = ? AND owner IS ? AND heartbeat IS ?""",
+                    (now, owner, now, thread_id, run["status"], run["updated"], run["owner"], run["heartbeat"])
+                ).rowcount == 1
+                self._conn.commit()
+                if not claimed:
+                    return False
+            else:
+                self._conn.execute(
+                    """INSERT INTO consultation_runs (thread_id, case_snippet, max_rounds, status, created, updated,
+                                                      owner, heartbeat)
+                       VALUES (?, ?, ?, 'running', ?, ?, ?, ?)
+                       ON CONFLICT(thread_id) DO UPDATE SET status = 'running', error = NULL,
+                                                            updated = excluded.updated, owner = excluded.owner,
+                                                            heartbeat = excluded.heartbeat""",
+                    (thread_id, case_info[:120], max_rounds, now, now, owner, now)
+                )
+            self._conn.commit()
+            self._active.add(thread_id)
+            if self._beat is None or not self._beat.is_alive():
+                self._beat = threading.Thread(target=self._heartbeat_loop, daemon=True, name="runs-heartbeat")
+                self._beat.start()
+            return True
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_s)
+            with self._lock:
+                if self._active:
+                    now = time.time()
+                    self._conn.executemany("UPDATE consultation_runs SET heartbeat = ? WHERE thread_id = ?",
+                                           [(now, thread_id) for thread_id in self._active])
+                    self._conn.commit()
+
+    def finish(self, thread_id, error=None, resumable=False):
+        """'failed' runs can be resumed; anything else (including errors with nothing to resume) is 'done'."""
+        with self._lock:
+            self._conn.execute("UPDATE consultation_runs SET status = ?, error = ?, updated = ? WHERE thread_id = ?",
+                               ("failed" if resumable else "done", error, time.time(), thread_id))
+            self._conn.commit()
+            self._active.discard(thread_id)
+
+    def get(self, thread_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM consultation_runs WHERE thread_id = ?",
+                                     (thread_id,)).fetchone()
+        return self._as_dict(row) if row else None
+
+    def is_active(self, run) -> bool:
+        """A 'running' run whose owner process is alive and whose heartbeat is fresh."""
+        if run["status"] != "running":
+            return False
+        if run["thread_id"] in self._active:
+            return True
+        if not run["owner"] or not run["heartbeat"] or time.time() - run["heartbeat"] > self.stale_after_s:
+            return False
+        host, _, pid = run["owner"].rpartition(":")
+        # Only a local owner can be checked directly; a remote one is judged by its heartbeat
+        return host != socket.gethostname() or _pid_alive(int(pid))
+
+    def unfinished(self, limit=50):
+        """Failed runs plus runs still marked running whose owner died or went silent."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM consultation_runs "
+                                      "WHERE status != 'done' ORDER BY updated DESC").fetchall()
+        runs = [self._as_dict(r) for r in rows]
+        return [run for run in runs if not self.is_active(run)][:limit]
+
+    @staticmethod
+    def _as_dict(row):
+        return dict(zip(_COLUMNS, row))
+
+
+def get_runs() -> ConsultationRuns:
+    global _runs
+    with _lock:
+        if _runs is None:
+            _runs = ConsultationRuns()
+        return _runs
+
+
+def pending_nodes(app, thread_id):
+    """Nodes a checkpointed consultation would run next (empty when it finished or never started)."""
+    if app.checkpointer is None:
+        return []
+    return list(app.get_state({"configurable": {"thread_id": thread_id}}).next)
+
+
+def saved_state(app, thread_id) -> dict:
+    """State at the consultation's last checkpoint ({} if there is none)."""
+    if app.checkpointer is None:
+        return {}
+    return dict(app.get_state({"configurable": {"thread_id": thread_id}}).values)
+
+
+def begin(app, thread_id, state=None):
+    """
+    Graph input for this run of `thread_id`: `None` (continue from the checkpoint) when it
+    has unfinished nodes, otherwise `state` as a fresh start. Without `state` the thread
+    must be resumable and already claimed with `get_runs().start(thread_id)`.
+    """
+    resumable = bool(pending_nodes(app, thread_id))
+    if state is None:
+        if not resumable:
+            raise ValueError(f"No unfinished consultation to resume for thread {thread_id}")
+        return None
+    get_runs().start(thread_id, state["case_info"], state["max_rounds"])
+    if resumable:
+        return None
+    if app.checkpointer is not None:
+        # A thread whose graph completed (but whose caller failed afterwards) starts over clean,
+        # otherwise the reducer channels would append to the old run's bullets
+        app.checkpointer.delete_thread(thread_id)
+    return state
+
+
+def end(app, thread_id, error=None):
+    """Record how the run ended; checkpoints are only kept while there are unfinished nodes to resume."""
+    resumable = error is not None and bool(pending_nodes(app, thread_id))
+    get_runs().finish(thread_id, error, resumable=resumable)
+    if not resumable and app.checkpointer is not None:
+        app.checkpointer.delete_thread(thread_id)
@@ -0,0 +1,133 @@
+"""
+Process-wide pool of ready-to-run consultations.
+
+Building an `MDTAgents` (three chat clients, tool wrappers, SQLite caches) and compiling
+the LangGraph app costs more than a short consultation's first token, and every fresh
+client opens new TLS connections. Runtimes are therefore built once per configuration and
+checked out per consultation; all of them share one keep-alive `httpx.Client`, as does the
+KB embedding client.
+"""
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+import httpx
+
+from agents import MDTAgents
+from checkpoints import get_checkpointer
+from context_builder import ContextBuilder
+from convergence import ConvergenceDetector
+from workflow import create_workflow
+
+_lock = threading.Lock()
+_http_client = None
+_idle = {}    # config key -> [Runtime, ...] ready to be checked out
+_stats = {"built": 0, "reused": 0, "in_use": 0}
+
+
+class Runtime:
+    def __init__(self, key, agents, app):
+        self.key = key
+        self.agents = agents
+        self.app = app
+        self.runs = 0
+
+
+def get_http_client(max_connections=64, max_keepalive=32, timeout=120.0) -> httpx.Client:
+    """The shared client; limits only apply to the first call in the process."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+                timeout=timeout
+            )
+        return _http_client
+
+
+def config_key(cfg: dict) -> str:
+    # Hashed so the key (which covers the API key) is safe to show in stats
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+
+def build_runtime(cfg: dict, http_client=None):
+    """A new (agents, compiled app) pair for `cfg`, without pooling."""
+    agents = MDTAgents(cfg["api_key"], cfg["base_url"], cfg["text_model"], cfg["vl_model"],
+                       cfg.get("enable_tools", True),
+                       parallel_specialists=cfg.get("parallel_specialists", True),
+                       tool_cache_only=cfg.get("tool_cache_only", False),
+                       tool_cache_ttl_hours=cfg.get("tool_cache_ttl_hours", 168),
+                       tool_timeout=cfg.get("tool_timeout", 8.0),
+                       llm_cache_mode=cfg.get("llm_cache_mode", "deterministic"),
+                       image_max_side=cfg.get("image_max_side", 1024),
+                       image_quality=cfg.get("image_quality", 85),
+                       shared_image_findings=cfg.get("shared_image_findings", False),
+                       http_client=http_client,
+                       llm_rpm=cfg.get("llm_rpm", 0),
+                       llm_tpm=cfg.get("llm_tpm", 0),
+                       llm_max_concurrency=cfg.get("llm_max_concurrency", 8),
+                       llm_max_retries=cfg.get("llm_max_retries", 4))
+    app = create_workflow(agents,
+                          ContextBuilder(kb_tokens=cfg.get("context_kb_tokens", 600),
+                                         round_tokens=cfg.get("context_round_tokens", 350),
+                                         role_kb_tokens=cfg.get("context_role_kb_tokens", 300)),
+                          ConvergenceDetector(skip_similarity=cfg.get("convergence_skip_similarity", 0.95),
+                                              stall_similarity=cfg.get("convergence_stall_similarity", 0.985)),
+                          checkpointer=get_checkpointer() if cfg.get("checkpointing", True) else None,
+                          role_kb_k=cfg.get("kb_role_k", 1))
+    return agents, app
+
+
+@contextmanager
+def checkout(cfg: dict):
+    """
+    Borrow an idle runtime for `cfg` (building one if every runtime is busy) for one
+    consultation. Concurrent consultations never share callbacks or telemetry.
+    """
+    key = config_key(cfg)
+    with _lock:
+        idle = _idle.get(key)
+        runtime = idle.pop() if idle else None
+        if runtime is not None:
+            _stats["reused"] += 1
+        _stats["in_use"] += 1
+
+    try:
+        if runtime is None:
+            runtime = Runtime(key, *build_runtime(cfg, get_http_client()))
+            with _lock:
+                _stats["built"] += 1
+    except Exception:
+        with _lock:
+            _stats["in_use"] -= 1
+        raise
+
+    runtime.agents.telemetry.reset()
+    runtime.agents.reset_consultation()
+    try:
+        yield runtime
+    finally:
+        runtime.runs += 1
+        runtime.agents.set_stream_callback(None)
+        runtime.agents.set_tool_callback(None)
+        with _lock:
+            _stats["in_use"] -= 1
+            _idle.setdefault(key, []).append(runtime)
+
+
+def _open_connections(client):
+    # httpcore keeps its pool on the transport; not part of the public API, so best effort
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    return len(connections) if connections is not None else None
+
+
+def pool_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["configs"] = len(_idle)
+        stats["idle"] = sum(len(v) for v in _idle.values())
+        client = _http_client
+    stats["http_connections"] = _open_connections(client) if client is not None else 0
+    return stats
@@ -0,0 +1,154 @@
+import json
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+
+# Lead Physician fields in the order they are worth keeping when the budget is tight
+BULLET_FIELDS = ["Integration", "Conflict", "Consistency", "Independence"]
+
+# KB record fields kept in prompts; the verbose reasoning fields stay in the KB only
+KB_FIELDS = ["Question", "Answer", "Correct Answer", "Summary of S4_final", "Error Reflection"]
+
+KB_HEADERS = {
+    "CorrectKB": "--- [CorrectKB] SUCCESSFUL EXPERIENCES ---",
+    "ChainKB": "--- [ChainKB] ERROR REFLECTIONS ---",
+}
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # BPE files unavailable (offline): fall back to the character heuristic for good
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoding()
+    if enc:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if budget <= 0:
+        return ""
+    enc = _get_encoding()
+    if enc:
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) <= budget:
+            return text
+        return enc.decode(tokens[:budget]).rstrip() + " …"
+    if len(text) <= budget * 4:
+        return text
+    return text[:budget * 4].rstrip() + " …"
+
+
+def _parse_json(text):
+    content = text.strip()
+    if content.startswith("```json"): content = content[7:]
+    if content.endswith("```"): content = content[:-3]
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _fit_fields(data: dict, fields, budget: int) -> str:
+    """Single-line `Field: value` pairs in priority order, truncating the field that crosses the budget."""
+    parts = []
+    used = 0
+    for field in fields:
+        value = data.get(field)
+        if value in (None, "", [], {}):
+            if field == "Conflict":
+                # An empty conflict is itself a signal of convergence
+                value = "none"
+            else:
+                continue
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        line = f"{field}: {' '.join(value.split())}"
+        cost = count_tokens(line)
+        if used + cost > budget:
+            line = truncate_to_tokens(line, budget - used)
+            if line:
+                parts.append(line)
+            break
+        parts.append(line)
+        used += cost
+    return "\n".join(parts)
+
+
+def compact_kb_record(page_content: str, budget: int) -> str:
+    data = _parse_json(page_content)
+    if data is None:
+        return truncate_to_tokens(" ".join(page_content.split()), budget)
+
+    # Answers / lessons first; the (often long) question gets what is left, at least a third
+    question = " ".join(str(data.get("Question", "")).split())
+    question_line = f"Question: {question}" if question else ""
+    reserved = min(count_tokens(question_line), budget // 3) if question_line else 0
+    rest = _fit_fields(data, [f for f in KB_FIELDS if f != "Question"], budget - reserved)
+    if question_line:
+        question_line = truncate_to_tokens(question_line, budget - count_tokens(rest))
+    return "\n".join(part for part in (question_line, rest) if part)
+
+
+def compact_bullet(bullet: str, budget: int) -> str:
+    data = _parse_json(bullet)
+    if data is None:
+        return truncate_to_tokens(" ".join(bullet.split()), budget)
+    return _fit_fields(data, BULLET_FIELDS, budget)
+
+
+class ContextBuilder:
+    """
+    Builds the residual context handed to every specialist, within a token budget:
+    `kb_tokens` for the round-1 prior knowledge, `round_tokens` per previous-round summary.
+    """
+
+    def __init__(self, kb_tokens=600, round_tokens=350, history_rounds=2, role_kb_tokens=300):
+        self.kb_tokens = kb_tokens
+        self.role_kb_tokens = role_kb_tokens
+        self.round_tokens = round_tokens
+        self.history_rounds = history_rounds
+
+    def prior_knowledge(self, kb_docs, kb_text: str, budget=None) -> str:
+        budget = budget or self.kb_tokens
+        if not kb_docs:
+            return truncate_to_tokens(kb_text, budget)
+
+        per_doc = max(1, budget // len(kb_docs))
+        parts = []
+        current_source = None
+        for doc in kb_docs:
+            source = doc.metadata.get("source_kb", "Unknown")
+            if source != current_source:
+                parts.append(KB_HEADERS.get(source, f"--- [{source}] ---"))
+                current_source = source
+            parts.append(compact_kb_record(doc.page_content, per_doc))
+        return "\n".join(parts)
+
+    def role_prior_knowledge(self, kb_docs, kb_text: str = "") -> str:
+        """Round-1 context for one specialist: the few experiences retrieved for its role, on `role_kb_tokens`."""
+        return f"PRIOR KNOWLEDGE FROM DB:\n{self.prior_knowledge(kb_docs, kb_text, self.role_kb_tokens)}"
+
+    def build(self, rnd: int, bullets, kb_docs=None, kb_text: str = "") -> str:
+        if rnd == 1:
+            return f"PRIOR KNOWLEDGE FROM DB:\n{self.prior_knowledge(kb_docs, kb_text)}"
+
+        residual_context = ""
+        recent_bullets = bullets[-self.history_rounds:]
+        for i, b in enumerate(recent_bullets):
+            bullet_rnd = rnd - len(recent_bullets) + i
+            residual_context += f"--- Round {bullet_rnd} Summary ---\n{compact_bullet(b, self.round_tokens)}\n"
+        return residual_context
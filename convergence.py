@@ -0,0 +1,83 @@
+import numpy as np
+
+from context_builder import _parse_json
+
+# Decisions returned by ConvergenceDetector.assess
+REVIEW = "review"          # not obviously stable: ask the Safety Reviewer
+CONVERGED = "converged"    # stable and conflict-free: skip the reviewer and stop
+STALLED = "stalled"        # summaries stopped changing: stop unless the reviewer says diverged
+
+
+def _cosine(a, b) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / denom if denom else 0.0
+
+
+class ConvergenceDetector:
+    """
+    Local convergence check between consecutive Lead Physician summaries: cosine similarity
+    of their `Integration` fields plus whether the latest `Conflict` field is empty.
+    A threshold above 1.0 disables the corresponding shortcut.
+    """
+
+    def __init__(self, skip_similarity=0.95, stall_similarity=0.985):
+        self.skip_similarity = skip_similarity
+        self.stall_similarity = stall_similarity
+
+    @staticmethod
+    def integration(bullet: str) -> str:
+        data = _parse_json(bullet) or {}
+        return " ".join(str(data.get("Integration") or "").split())
+
+    @staticmethod
+    def conflict_empty(bullet: str) -> bool:
+        data = _parse_json(bullet)
+        if data is None:
+            return False
+        conflict = data.get("Conflict")
+        if isinstance(conflict, str):
+            return conflict.strip().lower() in ("", "none", "n/a", "no conflict", "no conflicts")
+        return not conflict
+
+    def assess(self, bullets, embeddings) -> dict:
+        """Compare the last two summaries; `embeddings` is any LangChain Embeddings (None disables)."""
+        result = {"decision": REVIEW, "similarity": None, "conflict_empty": None}
+        if len(bullets) < 2 or embeddings is None:
+            return result
+
+        previous, current = self.integration(bullets[-2]), self.integration(bullets[-1])
+        result["conflict_empty"] = self.conflict_empty(bullets[-1])
+        if not previous or not current:
+            return result
+
+        try:
+            vec_prev, vec_curr = embeddings.embed_documents([previous, current])
+        except Exception as e:
+            print(f"Convergence embedding failed: {e}")
+            return result
+
+        similarity = _cosine(vec_prev, vec_curr)
+        result["similarity"] = round(similarity, 4)
+        if result["conflict_empty"] and similarity >= self.skip_similarity:
+            result["decision"] = CONVERGED
+        elif similarity >= self.stall_similarity:
+            result["decision"] = STALLED
+        return result
+
+    def resolve(self, check: dict, review: str, last_bullet: str):
+        """
+        (is_converged, final_answer) for a round the Safety Reviewer was asked about. A stalled
+        discussion settles an inconclusive review, but never overrides an explicit DIVERGED.
+        """
+        is_converged = "STATUS: CONVERGED" in review
+        final_answer = ""
+        if "FINAL_ANSWER:" in review:
+            final_answer = review.split("FINAL_ANSWER:")[1].strip()
+
+        if not is_converged and check["decision"] == STALLED and "STATUS: DIVERGED" not in review:
+            # Another round would only restate the same synthesis
+            is_converged = True
+            final_answer = self.integration(last_bullet)
+        return is_converged, final_answer
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from tool_cache import CACHE_DIR
+
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-hash keyed, persistent cache in front of any LangChain `Embeddings`.
+    Vectors are stored as float32 blobs in SQLite, with a small in-memory LRU on top,
+    so identical texts are embedded through the remote endpoint only once.
+    """
+
+    def __init__(self, underlying: Embeddings, namespace: str, path=EMBEDDING_CACHE_PATH, memory_size=2048):
+        self.underlying = underlying
+        self.namespace = namespace
+        self.path = path
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+            # SQLite caps bound parameters, so look up in chunks
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._remember(key, np.frombuffer(blob, dtype=np.float32).tolist())
+        return found
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+        return vec
+
+    def _store(self, pairs):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in pairs]
+            )
+            self._conn.commit()
+            for key, vec in pairs:
+                self._remember(key, list(vec))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(keys)
+
+        # Embed each distinct missing text once, in a single request
+        todo = OrderedDict((k, t) for k, t in zip(keys, texts) if k not in found)
+        self.hits += len(texts) - len(todo)
+        self.misses += len(todo)
+        if todo:
+            vectors = self.underlying.embed_documents(list(todo.values()))
+            pairs = list(zip(todo.keys(), vectors))
+            self._store(pairs)
+            found.update((k, list(v)) for k, v in pairs)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            self.hits += 1
+            return found[key]
+        self.misses += 1
+        vec = self.underlying.embed_query(text)
+        self._store([(key, vec)])
+        return list(vec)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# (magic prefix, MIME type); WebP is checked separately (RIFF....WEBP)
+MIME_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+EXIF_ORIENTATION = 0x0112
+
+# Prepared payloads shared by every MDTAgents in the process (batch workers, Streamlit reruns)
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def detect_mime(data: bytes) -> str:
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, mime in MIME_SIGNATURES:
+        if data.startswith(magic):
+            return mime
+    return "image/jpeg"
+
+
+class PreparedImage:
+    def __init__(self, digest, mime, data_b64, original_bytes, size_bytes, dimensions=None):
+        self.digest = digest
+        self.mime = mime
+        self.data_b64 = data_b64
+        self.original_bytes = original_bytes
+        self.size_bytes = size_bytes
+        self.dimensions = dimensions
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.data_b64}"
+
+
+class ImagePipeline:
+    """
+    Turns an uploaded image (base64) into the payload sent to the vision model: downsized so
+    the longest side is at most `max_side`, turned upright per its EXIF orientation, re-encoded
+    (JPEG at `quality`, PNG when there is transparency) and labeled with its real MIME type. Results are cached by content hash,
+    so a case's image is processed once no matter how many specialists look at it.
+    Without Pillow the original bytes are sent unchanged, with the detected MIME type.
+    """
+
+    def __init__(self, max_side=1024, quality=85, cache_size=32):
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(raw: bytes) -> str:
+        return hashlib.sha256(raw).hexdigest()
+
+    def prepare(self, image_b64: str) -> PreparedImage:
+        raw = base64.b64decode(image_b64)
+        digest = self.digest(raw)
+        key = (digest, self.max_side, self.quality)
+        with _prepared_lock:
+            if key in _prepared:
+                _prepared.move_to_end(key)
+                self.hits += 1
+                return _prepared[key]
+        self.misses += 1
+
+        data, mime, dimensions = self._process(raw)
+        prepared = PreparedImage(digest, mime, base64.b64encode(data).decode("ascii"), len(raw), len(data),
+                                 dimensions)
+        with _prepared_lock:
+            _prepared[key] = prepared
+            while len(_prepared) > self.cache_size:
+                _prepared.popitem(last=False)
+        return prepared
+
+    def _process(self, raw: bytes):
+        mime = detect_mime(raw)
+        if Image is None:
+            return raw, mime, None
+        try:
+            img = Image.open(io.BytesIO(raw))
+            img.load()
+        except Exception as e:
+            print(f"Image decode failed, sending original: {e}")
+            return raw, mime, None
+
+        # Phone photos are often stored sideways with an EXIF rotation the vision API ignores:
+        # bake it into the pixels (re-encoding drops the tag)
+        rotated = img.getexif().get(EXIF_ORIENTATION, 1) != 1
+        if rotated:
+            img = ImageOps.exif_transpose(img)
+
+        resized = max(img.size) > self.max_side
+        if resized:
+            img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img.save(out, format="PNG", optimize=True)
+            new_mime = "image/png"
+        else:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.save(out, format="JPEG", quality=self.quality, optimize=True)
+            new_mime = "image/jpeg"
+
+        data = out.getvalue()
+        if not resized and not rotated and len(data) >= len(raw):
+            # Already small: re-encoding would only cost quality
+            return raw, mime, img.size
+        return data, new_mime, img.size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(_prepared)
+        }
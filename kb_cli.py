@@ -0,0 +1,95 @@
+"""
+Knowledge base maintenance commands.
+
+Usage:
+    python kb_cli.py ingest --input corpus.jsonl --store correct --batch-size 64 --workers 4
+    python kb_cli.py bench --store correct --k 5
+    python kb_cli.py rebuild --store correct --index hnsw
+    python kb_cli.py stats
+"""
+import argparse
+import json
+
+from kb_index import INDEX_TYPES, build_index, extract_vectors, index_kind, measure
+from knowledge_base import STORES, kb_system
+from utils import load_config
+
+
+def cmd_ingest(args):
+    if kb_system.embeddings is None:
+        raise SystemExit("Embeddings are unavailable; cannot ingest.")
+    result = kb_system.bulk_ingest(args.input, store=args.store, batch_size=args.batch_size, workers=args.workers)
+    print(json.dumps(result, indent=4))
+
+
+def cmd_bench(args):
+    """recall@k vs latency of every index type over the store's current vectors."""
+    store = getattr(kb_system, STORES[args.store][0])
+    if store is None:
+        print(f"Store '{args.store}' is empty.")
+        return
+    print(f"Current index: {index_kind(store.index)} ({store.index.ntotal} vectors)")
+    vectors = extract_vectors(store.index)
+    print(f"{'index':<8}{'recall@' + str(args.k):>10}{'ms/query':>12}{'exact ms':>12}")
+    for kind in args.index.split(","):
+        report = measure(build_index(kind, vectors, kb_system.index_params), vectors,
+                         n_queries=args.queries, k=args.k)
+        print(f"{kind:<8}{report['recall_at_k']:>10}{report['ms_per_query']:>12}{report['exact_ms_per_query']:>12}")
+
+
+def cmd_rebuild(args):
+    print(f"Rebuilt '{args.store}' as: {kb_system.rebuild_index(args.store, args.index)}")
+
+
+def cmd_stats(args):
+    """Live documents, tombstones and the most retrieved documents per store."""
+    for name, stats in kb_system.stats().items():
+        print(f"{name}: {stats['documents']} documents, {stats['tombstones']} tombstones, index {stats['index']}")
+        usage = sorted(kb_system.usage.all(name).items(), key=lambda item: -item[1][0])[:args.top]
+        for doc_id, (hits, duplicates, _) in usage:
+            print(f"    {doc_id}  hits={hits} duplicates={duplicates}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MDTeamGPT knowledge base tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="Bulk-load KB records from JSONL")
+    ingest.add_argument("--input", required=True, help="JSONL file, one KB record per line")
+    ingest.add_argument("--store", choices=["correct", "cot"], default="correct",
+                        help="correct = CorrectKB, cot = ChainKB")
+    ingest.add_argument("--batch-size", type=int, default=64, help="Texts per embedding request")
+    ingest.add_argument("--workers", type=int, default=4, help="Concurrent embedding requests")
+    ingest.set_defaults(func=cmd_ingest)
+
+    bench = sub.add_parser("bench", help="Report recall@k vs latency for each index type")
+    bench.add_argument("--store", choices=["correct", "cot"], default="correct")
+    bench.add_argument("--index", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    bench.add_argument("--k", type=int, default=5)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.set_defaults(func=cmd_bench)
+
+    rebuild = sub.add_parser("rebuild", help="Rebuild a store's index as another type")
+    rebuild.add_argument("--store", choices=["correct", "cot"], default="correct")
+    rebuild.add_argument("--index", choices=INDEX_TYPES, required=True)
+    rebuild.set_defaults(func=cmd_rebuild)
+
+    stats = sub.add_parser("stats", help="Store sizes and the most retrieved documents")
+    stats.add_argument("--top", type=int, default=5)
+    stats.set_defaults(func=cmd_stats)
+
+    args = parser.parse_args()
+
+    cfg = load_config()
+    kb_system.configure_index(cfg.get("kb_index_type", "hnsw"), cfg.get("kb_promote_at", 20000))
+    kb_system.configure_retention(cfg.get("kb_max_docs", 50000), cfg.get("kb_dedup_similarity", 0.97),
+                                  cfg.get("kb_dedup_policy", "skip"))
+    kb_system.configure_retrieval(cfg.get("kb_retrieval_mode", "hybrid"), cfg.get("kb_embed_timeout", 5.0))
+    kb_system.init_embeddings(api_key=cfg["api_key"], base_url=cfg["base_url"])
+    if not kb_system.initialized:
+        parser.error("Knowledge base initialization failed; check config.json")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import math
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+
+DEFAULT_PARAMS = {
+    "hnsw_m": 32,
+    "ef_search": 64,
+    "nprobe": 16,
+    "pq_m": None,  # sub-quantizers; picked from the dimension when None
+}
+
+
+def index_kind(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def extract_vectors(index, start=0) -> np.ndarray:
+    """Vectors from position `start` to the end, in index order (lossy for IVF-PQ)."""
+    # A separate name keeps `index` (possibly the only owner of the C++ object) alive
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    return inner.reconstruct_n(start, inner.ntotal - start)
+
+
+def nearest(index, vector, k=1):
+    """Up to `k` (position, cosine similarity) pairs closest to `vector`, nearest first."""
+    if index.ntotal == 0:
+        return []
+    query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+    _, found = index.search(query, min(k, index.ntotal))
+    positions = [int(p) for p in found[0] if p >= 0]
+    if not positions:
+        return []
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIVF) and inner.direct_map.type == faiss.DirectMap.NoMap:
+        inner.make_direct_map()
+    # L2 scores depend on the vectors' norms; cosine on the stored vectors does not
+    stored = np.vstack([inner.reconstruct(p) for p in positions])
+    sims = stored @ query[0] / (np.linalg.norm(stored, axis=1) * np.linalg.norm(query[0]) + 1e-12)
+    return list(zip(positions, sims.tolist()))
+
+
+def _nlist(n):
+    # ~4*sqrt(n) lists, while keeping enough training points per list
+    return int(max(1, min(4 * math.sqrt(n), n // 39, 65536)))
+
+
+def _pq_m(dim, requested):
+    if requested:
+        return requested
+    for m in (64, 48, 32, 16, 8, 4, 2, 1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(kind, vectors: np.ndarray, params=None):
+    """Build (and train, if needed) a FAISS L2 index of `kind` containing `vectors` in order."""
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+    elif kind == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, _nlist(n))
+    elif kind == "ivfpq":
+        # 8-bit codes need ~10k training points; use fewer bits on smaller stores
+        nbits = int(max(1, min(8, math.log2(max(2, n // 39)))))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, _nlist(n), _pq_m(dim, params["pq_m"]), nbits)
+    else:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {INDEX_TYPES}")
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, params)
+    return index
+
+
+def refill(index, vectors: np.ndarray):
+    """
+    Empty copy of `index` (same kind, same trained quantizer and codebooks) holding `vectors`.
+    Nothing is retrained, so re-adding IVF-PQ reconstructions reproduces their codes instead
+    of training new codebooks on lossy data.
+    """
+    copy = faiss.clone_index(faiss.downcast_index(index))
+    copy.reset()
+    copy.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return copy
+
+
+def apply_search_params(index, params=None):
+    """Search-time knobs are not always serialized, so they are re-applied after every load."""
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["ef_search"]
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = params["nprobe"]
+
+
+def measure(index, vectors: np.ndarray, n_queries=200, k=5, noise=0.01, seed=0):
+    """
+    recall@k of `index` against exact search over `vectors`, plus mean latency per query.
+    Queries are stored vectors with small Gaussian noise, i.e. near-duplicate lookups.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + rng.normal(0, noise, size=(len(picks), vectors.shape[1])).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    started = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    approx_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return {
+        "index": index_kind(index),
+        "vectors": len(vectors),
+        "recall_at_k": round(hits / (len(queries) * k), 4),
+        "k": k,
+        "ms_per_query": round(approx_ms, 4),
+        "exact_ms_per_query": round(exact_ms, 4)
+    }
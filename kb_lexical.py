@@ -0,0 +1,87 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# Words with their internal dots/dashes/slashes kept (drug names, "hba1c", "7.4", "140/90"),
+# plus single CJK characters
+_TOKEN = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*|[\u4e00-\u9fff]")
+
+RRF_K = 60
+
+
+def tokenize(text: str):
+    return _TOKEN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over one KB store, keyed by docstore id. It needs no
+    embedding endpoint, so it is rebuilt from the store's texts on load and kept in step
+    with every insert and purge (callers hold the store's write lock while mutating it).
+    """
+
+    def __init__(self, k1=1.5, b=0.75, max_df=0.5):
+        self.k1 = k1
+        self.b = b
+        # Terms in more than this share of the documents (JSON keys, "the", "patient")
+        # carry almost no BM25 weight and are skipped at query time
+        self.max_df = max_df
+        self._postings = {}   # term -> {doc_id: term frequency}
+        self._terms = {}      # doc_id -> its distinct terms, for removal
+        self._lengths = {}    # doc_id -> token count
+        self._total = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    @property
+    def terms(self) -> int:
+        return len(self._postings)
+
+    def add(self, doc_id, text):
+        if doc_id in self._lengths:
+            self.remove([doc_id])
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        self._terms[doc_id] = list(counts)
+        self._lengths[doc_id] = len(tokens)
+        self._total += len(tokens)
+
+    def remove(self, doc_ids):
+        for doc_id in doc_ids:
+            for term in self._terms.pop(doc_id, ()):
+                posting = self._postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self._postings[term]
+            self._total -= self._lengths.pop(doc_id, 0)
+
+    def search(self, query: str, k, exclude=()):
+        """Top-k (doc_id, BM25 score), best first."""
+        n = len(self._lengths)
+        if not n:
+            return []
+        avg_len = self._total / n
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting or (n > 2 and len(posting) > self.max_df * n):
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, ((doc_id, s) for doc_id, s in scores.items() if doc_id not in exclude),
+                              key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
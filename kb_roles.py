@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+
+from kb_index import extract_vectors
+
+
+def role_key(role: str) -> str:
+    return role.strip().lower()
+
+
+class RolePartitions:
+    """
+    Role-tagged slice of one store, kept in memory for filtered search: unit-normalized
+    vectors of every document whose metadata lists `roles`, plus the rows of each role.
+    It tracks the store incrementally (new positions are appended) and is rebuilt when
+    the store's positions change (reload, purge), i.e. when its generation moves.
+    Untagged documents (older experiences, bulk-ingested corpora) are not held here.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._seen = 0            # store positions scanned so far
+        self._vectors = None      # (rows, dim) float32, unit norm
+        self._ids = []            # row -> docstore id
+        self._rows = {}           # role key -> [row, ...]
+
+    def sync(self, store, generation):
+        """Called with the store's read lock held."""
+        with self._lock:
+            total = store.index.ntotal if store is not None else 0
+            if generation != self._generation or total < self._seen:
+                self._generation, self._seen, self._vectors, self._ids, self._rows = generation, 0, None, [], {}
+            if total == self._seen:
+                return
+
+            tagged = []
+            for pos in range(self._seen, total):
+                doc_id = store.index_to_docstore_id.get(pos)
+                roles = store.docstore.search(doc_id).metadata.get("roles") if doc_id is not None else None
+                if roles:
+                    tagged.append((pos, doc_id, roles))
+            if tagged:
+                new = extract_vectors(store.index, start=self._seen)[[pos - self._seen for pos, _, _ in tagged]]
+                new = new / (np.linalg.norm(new, axis=1, keepdims=True) + 1e-12)
+                start = len(self._ids)
+                for row, (_, doc_id, roles) in enumerate(tagged, start):
+                    self._ids.append(doc_id)
+                    for role in roles:
+                        self._rows.setdefault(role_key(role), []).append(row)
+                self._vectors = new if self._vectors is None else np.vstack([self._vectors, new])
+            self._seen = total
+
+    def search(self, query, roles, k, exclude=()):
+        """
+        Top-k (doc_id, cosine) for each of `roles`. The query is scored once against every
+        tagged row and the scores are split by role tag, so adding roles costs no extra search.
+        """
+        with self._lock:
+            vectors, ids, rows = self._vectors, self._ids, self._rows
+        results = [[] for _ in roles]
+        if vectors is None:
+            return results
+
+        query = np.asarray(query, dtype=np.float32)
+        scores = vectors @ (query / (np.linalg.norm(query) + 1e-12))
+        for i, role in enumerate(roles):
+            role_rows = [row for row in rows.get(role_key(role), []) if ids[row] not in exclude]
+            if not role_rows:
+                continue
+            role_scores = scores[role_rows]
+            top = np.argsort(-role_scores)[:k]
+            results[i] = [(ids[role_rows[j]], float(role_scores[j])) for j in top]
+        return results
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {role: len(rows) for role, rows in self._rows.items()}
@@ -0,0 +1,186 @@
+import base64
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): FileLock only excludes threads of this process
+    fcntl = None
+
+SNAPSHOT_META = "snapshot.json"
+
+
+def encode_vector(vec) -> str:
+    return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(blob: str):
+    return np.frombuffer(base64.b64decode(blob), dtype=np.float32).tolist()
+
+
+class SegmentLog:
+    """
+    Append-only delta log for one FAISS store (`<store>.wal`, one JSON entry per line).
+    Each entry carries its own vector, so replaying it never re-embeds. Entries are
+    fsync'ed on append; a torn last line from a crash is ignored on read and cut off
+    before the next append, so new entries never land behind it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def read(self, after_seq=0):
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        with self._lock, open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if entry["seq"] > after_seq:
+                    entries.append(entry)
+        return entries
+
+    def append(self, entries):
+        with self._lock:
+            self._truncate_torn_tail()
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _truncate_torn_tail(self):
+        """Cut the file back to its last complete line (a crash mid-append leaves one without a newline)."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Walk back in blocks to the last newline; entries are a few KB at most
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            print(f"KB log {self.path}: dropping {size - end} bytes of a torn entry.")
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def drop_through(self, seq):
+        """Remove entries already folded into a snapshot (seq <= `seq`)."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                keep = [line for line in f if _line_seq(line) > seq]
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(keep)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+
+class FileLock:
+    """
+    Advisory inter-process lock (flock on `path`), re-entrant within a thread. Every
+    process that writes a store, compacts it or reloads it from disk holds this lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+def read_version(path) -> int:
+    """Last WAL sequence number appended by any process (0 if nothing was ever logged)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_version(path, seq):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(seq))
+    os.replace(tmp, path)
+
+
+def _line_seq(line):
+    try:
+        return json.loads(line)["seq"]
+    except ValueError:
+        return -1
+
+
+def recover_snapshot(folder):
+    """Undo a compaction interrupted between the two renames in `write_snapshot`."""
+    if not os.path.exists(folder) and os.path.exists(folder + ".old"):
+        os.rename(folder + ".old", folder)
+    for leftover in (folder + ".tmp", folder + ".old"):
+        if os.path.exists(leftover):
+            shutil.rmtree(leftover, ignore_errors=True)
+
+
+def read_snapshot_seq(folder) -> int:
+    meta_path = os.path.join(folder, SNAPSHOT_META)
+    if not os.path.exists(meta_path):
+        return 0
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("seq", 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_snapshot(store, folder, seq):
+    """Save `store` as the new base index covering WAL entries up to `seq`, swapping it in atomically."""
+    tmp = folder + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    store.save_local(tmp)
+    with open(os.path.join(tmp, SNAPSHOT_META), "w", encoding="utf-8") as f:
+        json.dump({"seq": seq}, f)
+
+    if os.path.exists(folder):
+        os.rename(folder, folder + ".old")
+    os.rename(tmp, folder)
+    shutil.rmtree(folder + ".old", ignore_errors=True)
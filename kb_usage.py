@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class UsageStats:
+    """
+    Per-document usefulness signals for the KB stores, in SQLite so every process sharing
+    the knowledge base folder counts into the same rows:
+
+      hits        times the document was returned by a retrieval
+      duplicates  times a near-identical experience was saved and folded into it
+      last_used   last hit / duplicate (epoch seconds); 0 until the first one
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS usage (
+                   store TEXT NOT NULL,
+                   doc_id TEXT NOT NULL,
+                   hits INTEGER NOT NULL DEFAULT 0,
+                   duplicates INTEGER NOT NULL DEFAULT 0,
+                   last_used REAL NOT NULL DEFAULT 0,
+                   PRIMARY KEY (store, doc_id)
+               )"""
+        )
+        self._conn.commit()
+
+    def _bump(self, store, doc_ids, column):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"""INSERT INTO usage (store, doc_id, {column}, last_used) VALUES (?, ?, 1, ?)
+                    ON CONFLICT(store, doc_id) DO UPDATE SET {column} = {column} + 1, last_used = excluded.last_used""",
+                [(store, doc_id, now) for doc_id in doc_ids]
+            )
+            self._conn.commit()
+
+    def record_hits(self, store, doc_ids):
+        if doc_ids:
+            self._bump(store, doc_ids, "hits")
+
+    def record_duplicate(self, store, doc_id):
+        self._bump(store, [doc_id], "duplicates")
+
+    def transfer(self, store, old_id, new_id):
+        """A merged document replaces `old_id`: it inherits its counters, plus the duplicate that caused the merge."""
+        with self._lock:
+            row = self._conn.execute("SELECT hits, duplicates FROM usage WHERE store = ? AND doc_id = ?",
+                                     (store, old_id)).fetchone()
+            hits, duplicates = row or (0, 0)
+            self._conn.execute("DELETE FROM usage WHERE store = ? AND doc_id = ?", (store, old_id))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO usage (store, doc_id, hits, duplicates, last_used) VALUES (?, ?, ?, ?, ?)",
+                (store, new_id, hits, duplicates + 1, time.time())
+            )
+            self._conn.commit()
+
+    def all(self, store) -> dict:
+        """doc_id -> (hits, duplicates, last_used) for every document with recorded usage."""
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_id, hits, duplicates, last_used FROM usage WHERE store = ?",
+                                      (store,)).fetchall()
+        return {doc_id: (hits, duplicates, last_used) for doc_id, hits, duplicates, last_used in rows}
+
+    def forget(self, store, doc_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM usage WHERE store = ? AND doc_id = ?",
+                                   [(store, doc_id) for doc_id in doc_ids])
+            self._conn.commit()
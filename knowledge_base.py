@@ -1,53 +1,653 @@
+import atexit
 import os
 import json
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import contextvars
+from contextlib import contextmanager
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
+from embedding_cache import CachedEmbeddings
+from kb_storage import (FileLock, SegmentLog, encode_vector, decode_vector, read_version, recover_snapshot,
+                        read_snapshot_seq, write_snapshot, write_version)
+from kb_index import INDEX_TYPES, apply_search_params, build_index, extract_vectors, index_kind, nearest, refill
+from kb_lexical import LexicalIndex, reciprocal_rank_fusion
+from kb_roles import RolePartitions, role_key
+from kb_usage import UsageStats
+from tools import CircuitBreaker
 
 KB_DIR = "knowledge_bases"
 CORRECT_KB_PATH = os.path.join(KB_DIR, "correct_kb")
 COT_KB_PATH = os.path.join(KB_DIR, "cot_kb")
 
+# store name -> (attribute, base index folder)
+STORES = {
+    "correct": ("correct_store", CORRECT_KB_PATH),
+    "cot": ("cot_store", COT_KB_PATH),
+}
+
+
+
+def write_status(future, timeout=10.0) -> str:
+    """'saved', 'queued' (still in the writer queue after `timeout` s) or 'failed: <error>' for a save_* future."""
+    try:
+        future.result(timeout=timeout)
+    except FutureTimeout:
+        return "queued"
+    except Exception as e:
+        return f"failed: {e}"
+    return "saved"
+
+
+# "hybrid" fuses vector and BM25 rankings; "vector" / "lexical" use one of them alone
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+# What happens to a new experience that is a near-duplicate of a stored one:
+# "skip" keeps the stored document, "merge" replaces it with the new text (keeping its usage counters)
+DEDUP_POLICIES = ("skip", "merge")
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers block new readers so saves are not starved."""
 
-class DualKnowledgeBase:
     def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class DualKnowledgeBase:
+    def __init__(self, compact_every=64, index_type="hnsw", promote_at=20000, index_params=None,
+                 async_writes=True, max_docs=0, dedup_similarity=0.97, dedup_policy="skip",
+                 usage_half_life_days=30.0):
         self.correct_store = None
         self.cot_store = None
         self.embeddings = None
         self.initialized = False
 
+        # Stores start as exact flat indexes and are rebuilt in the background as
+        # `index_type` once they reach `promote_at` vectors.
+        self.index_type = index_type
+        self.promote_at = promote_at
+        self.index_params = index_params or {}
+        self._rebuilds = {}
+
+        # Inserts go to an append-only log per store; the full index is only
+        # rewritten by a background compaction every `compact_every` inserts.
+        self.compact_every = compact_every
+        self._logs = {name: SegmentLog(path + ".wal") for name, (_, path) in STORES.items()}
+        self._seq = {name: 0 for name in STORES}
+        self._pending = {name: 0 for name in STORES}
+        self._compactions = {}
+        # Searches share the stores; inserts, index swaps and loads are exclusive
+        self._lock = ReadWriteLock()
+        self._init_lock = threading.Lock()
+
+        # Several processes (Streamlit workers, batch jobs, the service) may share the folder:
+        # appends, compactions and reloads of a store hold its file lock, and `<store>.version`
+        # holds the last logged seq so readers notice other writers and replay just the new tail.
+        self._files = {name: FileLock(path + ".lock") for name, (_, path) in STORES.items()}
+        self._versions = {name: path + ".version" for name, (_, path) in STORES.items()}
+
+        # Saves are queued to one writer thread so embedding + fsync stay off the request path
+        self.async_writes = async_writes
+        self._queue = None
+        self._writer = None
+        self._write_failures = 0
+
+        # Retention: near-duplicate saves are skipped or merged, and a store holding more than
+        # `max_docs` (0 = unbounded) learned documents evicts its least useful ones; pinned
+        # (bulk-ingested) documents neither count against the cap nor get evicted. Deletions are
+        # logged as tombstones, filtered out of searches and purged from the index at the next compaction.
+        self.max_docs = max_docs
+        self.dedup_similarity = dedup_similarity
+        self.dedup_policy = dedup_policy
+        self.usage_half_life_days = usage_half_life_days
+        self._deleted = {name: set() for name in STORES}
+        self._pinned = {name: set() for name in STORES}
+        self._generation = {name: 0 for name in STORES}
+        # Set when the in-memory index changed without a log entry (index swap, purge), so the
+        # next compaction writes a snapshot even if one already covers the current seq
+        self._dirty = {name: False for name in STORES}
+
+        # Experiences are tagged with the specialists that produced them; per-role rows of
+        # each store are cached for `retrieve_for_roles`
+        self._partitions = {name: RolePartitions() for name in STORES}
+
+        # A BM25 index next to each store: exact terms (drug names, lab values) rank well, and
+        # retrieval keeps working lexically when the embedding endpoint is down or slower than
+        # `embed_timeout` seconds
+        self.retrieval_mode = "hybrid"
+        self.embed_timeout = 5.0
+        self._lexical = {name: LexicalIndex() for name in STORES}
+        self._embed_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kb-embed")
+        # One failed or timed-out query embedding skips the endpoint for a cool-down, so a dead
+        # endpoint costs a single `embed_timeout` wait rather than one per retrieval
+        self._embed_breaker = CircuitBreaker(threshold=1, cooldown=30)
+
         if not os.path.exists(KB_DIR):
             os.makedirs(KB_DIR)
+        self.usage = UsageStats(os.path.join(KB_DIR, "usage.sqlite"))
 
-    def init_embeddings(self, api_key, base_url):
-        if self.initialized: return
+    def init_embeddings(self, api_key, base_url, model="text-embedding-v3", http_client=None):
+        if self.initialized and self.embeddings is not None: return
+        with self._init_lock:
+            # Concurrent consultations may all arrive here before the first one finishes loading
+            if not self.initialized or self.embeddings is None:
+                self._init_embeddings(api_key, base_url, model, http_client)
+
+    def _init_embeddings(self, api_key, base_url, model, http_client):
         try:
-            self.embeddings = OpenAIEmbeddings(
-                model="text-embedding-v3",
+            remote = OpenAIEmbeddings(
+                model=model,
                 api_key=api_key,
                 base_url=base_url,
-                check_embedding_ctx_length=False
+                check_embedding_ctx_length=False,
+                http_client=http_client
             )
+            # Identical texts (re-run cases, re-saved records) are embedded only once
+            self.embeddings = CachedEmbeddings(remote, namespace=model)
+        except Exception as e:
+            # Stores still load: retrieval runs on the lexical index until a later call succeeds
+            print(f"Embedding init failed, knowledge base is lexical-only: {e}")
+        if self.initialized:
+            return
+        try:
             self._load_stores()
             self.initialized = True
         except Exception as e:
-            print(f"Embedding init failed: {e}")
+            print(f"Knowledge base load failed: {e}")
+
+    def configure_index(self, index_type="hnsw", promote_at=20000, index_params=None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        self.index_type = index_type
+        self.promote_at = promote_at
+        self.index_params = index_params or {}
+
+    def configure_retrieval(self, mode="hybrid", embed_timeout=5.0):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        self.retrieval_mode = mode
+        self.embed_timeout = embed_timeout
+
+    def configure_retention(self, max_docs=0, dedup_similarity=0.97, dedup_policy="skip"):
+        if dedup_policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy '{dedup_policy}', expected one of {DEDUP_POLICIES}")
+        self.max_docs = max_docs
+        self.dedup_similarity = dedup_similarity
+        self.dedup_policy = dedup_policy
 
     def _load_stores(self):
-        if os.path.exists(CORRECT_KB_PATH):
+        for name in STORES:
+            self._load_store(name)
+
+    def _load_store(self, name):
+        with self._files[name], self._lock.write():
+            self._reload_store(name)
+
+    def _reload_store(self, name):
+        """Base snapshot + replay of every logged delta newer than it. Called with both locks held."""
+        attr, path = STORES[name]
+        recover_snapshot(path)
+
+        store = None
+        base_seq = 0
+        if os.path.exists(path):
             try:
-                self.correct_store = FAISS.load_local(CORRECT_KB_PATH, self.embeddings,
-                                                      allow_dangerous_deserialization=True)
+                store = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+                base_seq = read_snapshot_seq(path)
             except:
-                self.correct_store = None
+                store = None
+
+        entries = self._logs[name].read(after_seq=base_seq)
+        self._deleted[name] = set()
+        self._pinned[name] = set()
+        self._generation[name] += 1
+        self._lexical[name] = LexicalIndex()
+        if store is not None:
+            for doc_id in store.index_to_docstore_id.values():
+                doc = store.docstore.search(doc_id)
+                self._lexical[name].add(doc_id, doc.page_content)
+                if doc.metadata.get("pinned"):
+                    self._pinned[name].add(doc_id)
+        if entries:
+            store = self._apply_entries(name, store, entries)
+
+        if store is not None:
+            apply_search_params(store.index, self.index_params)
+        setattr(self, attr, store)
+        self._seq[name] = entries[-1]["seq"] if entries else base_seq
+        self._pending[name] = len(entries)
+        self._maybe_promote(name)
+
+    def _catch_up(self, name):
+        """Apply what other processes logged since our last seq. Called with both locks held."""
+        attr, path = STORES[name]
+        entries = self._logs[name].read(after_seq=self._seq[name])
+        if read_snapshot_seq(path) > self._seq[name] and (not entries or entries[0]["seq"] > self._seq[name] + 1):
+            # Another process compacted past us: the entries we miss now only exist in its snapshot.
+            # Reloading loses nothing: every document we hold was logged first, and index swaps and
+            # purges are snapshotted before the file lock is released.
+            print(f"KB store '{name}' changed on disk, reloading it.")
+            self._reload_store(name)
+            return
+        if entries:
+            setattr(self, attr, self._apply_entries(name, getattr(self, attr), entries))
+            self._seq[name] = entries[-1]["seq"]
+            self._pending[name] += len(entries)
+
+    def refresh(self):
+        """Hot-reload stores whose on-disk version moved (writes from other processes); cheap when none did."""
+        for name in STORES:
+            if read_version(self._versions[name]) > self._seq[name]:
+                with self._files[name], self._lock.write():
+                    self._catch_up(name)
+
+    def _apply_entries(self, name, store, entries):
+        """Replay log entries in order: runs of adds are indexed together, deletes become tombstones."""
+        adds = []
+        for entry in entries:
+            if entry.get("op") == "delete":
+                store = self._index_entries(name, store, adds)
+                adds = []
+                # Ids purged by an earlier snapshot are already gone
+                self._deleted[name].update(i for i in entry["ids"] if store is not None and self._has(store, i))
+            else:
+                adds.append(entry)
+        return self._index_entries(name, store, adds)
+
+    @staticmethod
+    def _has(store, doc_id):
+        return isinstance(store.docstore.search(doc_id), Document)
+
+    def _index_entries(self, name, store, entries):
+        if not entries:
+            return store
+        text_embeddings = [(e["text"], decode_vector(e["vector"])) for e in entries]
+        metadatas = [e["metadata"] for e in entries]
+        ids = [e["id"] for e in entries]
+        for entry in entries:
+            self._lexical[name].add(entry["id"], entry["text"])
+            if entry["metadata"].get("pinned"):
+                self._pinned[name].add(entry["id"])
+        if store is None:
+            return FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+        store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        return store
+
+    def _add_documents(self, name, docs):
+        """Embed, dedupe, log and index `docs`, then enforce the size cap; cost is independent of the store size."""
+        if self.embeddings is None:
+            raise RuntimeError("embeddings unavailable (lexical-only mode)")
+        vectors = self.embeddings.embed_documents([d.page_content for d in docs])
+        duplicates, merges = [], []
+        with self._files[name], self._lock.write():
+            # Sequence numbers are global across processes: replay their entries before adding ours
+            self._catch_up(name)
+            self._seq[name] = max(self._seq[name], read_version(self._versions[name]))
+            attr, _ = STORES[name]
+            store = getattr(self, attr)
+            now = time.time()
+            entries, batch = [], []    # batch: (id, vector) of this call's accepted docs
+            for doc, vec in zip(docs, vectors):
+                dup_id = self._find_duplicate(name, store, vec, batch)
+                if dup_id is not None and self.dedup_policy == "skip":
+                    duplicates.append(dup_id)
+                    continue
+                doc_id = uuid.uuid4().hex
+                if dup_id is not None:
+                    merges.append((dup_id, doc_id))
+                    if any(b_id == dup_id for b_id, _ in batch):
+                        # Merged into a doc from this same call: just drop the earlier one
+                        entries = [e for e in entries if e.get("id") != dup_id]
+                        batch = [b for b in batch if b[0] != dup_id]
+                    else:
+                        entries.append({"op": "delete", "ids": [dup_id]})
+                entries.append({
+                    "id": doc_id,
+                    "text": doc.page_content,
+                    "metadata": {**doc.metadata, "created": now},
+                    "vector": encode_vector(vec)
+                })
+                batch.append((doc_id, vec))
+
+            if entries:
+                self._log(name, entries)
+            # An eviction batch is compacted out right away; merge tombstones wait for the regular cadence
+            if self._evict(name) or self._pending[name] >= self.compact_every:
+                self._start_compaction(name)
+            self._maybe_promote(name)
+
+        for doc_id in duplicates:
+            self.usage.record_duplicate(name, doc_id)
+        for old_id, new_id in merges:
+            self.usage.transfer(name, old_id, new_id)
+        if duplicates or merges:
+            print(f"KB '{name}': {len(duplicates)} near-duplicate(s) skipped, {len(merges)} merged.")
+
+    def _log(self, name, entries):
+        """Number, persist and apply `entries`. Called with both locks held, after `_catch_up`."""
+        for entry in entries:
+            self._seq[name] += 1
+            entry["seq"] = self._seq[name]
+        self._logs[name].append(entries)
+        write_version(self._versions[name], self._seq[name])
+        attr, _ = STORES[name]
+        setattr(self, attr, self._apply_entries(name, getattr(self, attr), entries))
+        self._pending[name] += len(entries)
+
+    def _find_duplicate(self, name, store, vec, batch):
+        """Id of a live document (stored, or earlier in this batch) at least `dedup_similarity` similar, else None."""
+        if not self.dedup_similarity:
+            return None
+        best_id, best_sim = None, self.dedup_similarity
+        if store is not None:
+            deleted = self._deleted[name]
+            # Over-fetch by the tombstone count so a deleted neighbour cannot hide a live one
+            for pos, sim in nearest(store.index, vec, k=1 + len(deleted)):
+                doc_id = store.index_to_docstore_id.get(pos)
+                if doc_id in deleted:
+                    continue
+                if sim >= best_sim:
+                    best_id, best_sim = doc_id, sim
+                break
+        if batch:
+            vec = np.asarray(vec, dtype=np.float32)
+            others = np.asarray([v for _, v in batch], dtype=np.float32)
+            sims = others @ vec / (np.linalg.norm(others, axis=1) * np.linalg.norm(vec) + 1e-12)
+            i = int(np.argmax(sims))
+            if sims[i] >= best_sim:
+                best_id = batch[i][0]
+        return best_id
+
+    def _usefulness(self, usage, metadata, now):
+        """(1 + hits + duplicates), halved for every `usage_half_life_days` since the doc was last used or saved."""
+        hits, duplicates, last_used = usage or (0, 0, 0.0)
+        last_used = max(last_used, metadata.get("created", 0.0))
+        age_days = max(0.0, now - last_used) / 86400
+        return (1 + hits + duplicates) * 0.5 ** (age_days / self.usage_half_life_days)
+
+    def _evict(self, name):
+        """
+        Called with both locks held: tombstone the least useful documents once the store holds
+        more than `max_docs` live learned ones. Evicts ~5% below the cap so this runs in batches,
+        not on every save. Bulk-ingested (pinned) documents are neither counted nor evicted.
+        """
+        store = getattr(self, STORES[name][0])
+        if not self.max_docs or store is None:
+            return 0
+        deleted, pinned = self._deleted[name], self._pinned[name]
+        live = store.index.ntotal - len(deleted) - (len(pinned) - len(deleted & pinned))
+        if live <= self.max_docs:
+            return 0
+
+        usage = self.usage.all(name)
+        now = time.time()
+        candidates = []
+        for doc_id in store.index_to_docstore_id.values():
+            if doc_id in deleted:
+                continue
+            metadata = store.docstore.search(doc_id).metadata
+            if not metadata.get("pinned"):
+                candidates.append((self._usefulness(usage.get(doc_id), metadata, now), doc_id))
+        candidates.sort()
+        victims = [doc_id for _, doc_id in candidates[:live - self.max_docs + self.max_docs // 20]]
+        if not victims:
+            return 0
+
+        self._log(name, [{"op": "delete", "ids": victims}])
+        self.usage.forget(name, victims)
+        print(f"KB '{name}': evicted {len(victims)} least useful documents (cap {self.max_docs}).")
+        return len(victims)
+
+    def _purge(self, name):
+        """
+        Called with the store's file lock held (so no other writer touches it): physically drop
+        tombstoned documents. A flat index deletes in place; an approximate one is refilled with
+        the survivors outside the write lock, so searches keep running on the old index (its
+        tombstones filtered) meanwhile, and keeps its trained quantizer rather than retraining.
+        """
+        attr, _ = STORES[name]
+        with self._lock.write():
+            store = getattr(self, attr)
+            deleted = set(self._deleted[name])
+            if store is None or not deleted:
+                return
+            keep = [(pos, doc_id) for pos, doc_id in sorted(store.index_to_docstore_id.items())
+                    if doc_id not in deleted]
+            if not keep or index_kind(store.index) == "flat":
+                if keep:
+                    store.delete([doc_id for doc_id in store.index_to_docstore_id.values() if doc_id in deleted])
+                self._forget_purged(name, deleted)
+                setattr(self, attr, store if keep else None)
+                return
+            old_index = store.index
+            vectors = extract_vectors(old_index)[[pos for pos, _ in keep]]
+
+        # HNSW cannot remove vectors and IVF cannot while keeping positions contiguous
+        index = refill(old_index, vectors)
+        apply_search_params(index, self.index_params)
+        with self._lock.write():
+            store = getattr(self, attr)
+            docstore = InMemoryDocstore({doc_id: store.docstore.search(doc_id) for _, doc_id in keep})
+            positions = {i: doc_id for i, (_, doc_id) in enumerate(keep)}
+            setattr(self, attr, FAISS(self.embeddings, index, docstore, positions))
+            self._forget_purged(name, deleted)
+
+    def _forget_purged(self, name, deleted):
+        """Called with the write lock held, once `deleted` is gone from the index: positions were renumbered."""
+        self._deleted[name] -= deleted
+        self._pinned[name] -= deleted
+        self._generation[name] += 1
+        self._lexical[name].remove(deleted)
+        self._dirty[name] = True
+
+    def _maybe_promote(self, name):
+        """Called with the write lock held: schedule a flat -> approximate rebuild once the store is large."""
+        store = getattr(self, STORES[name][0])
+        if (store is None or self.index_type == "flat" or store.index.ntotal < self.promote_at
+                or index_kind(store.index) != "flat"):
+            return
+        running = self._rebuilds.get(name)
+        if running and running.is_alive():
+            return
+        thread = threading.Thread(target=self.rebuild_index, args=(name,), daemon=True, name=f"kb-rebuild-{name}")
+        self._rebuilds[name] = thread
+        thread.start()
 
-        if os.path.exists(COT_KB_PATH):
+    def rebuild_index(self, name, index_type=None):
+        """Rebuild a store's index as `index_type` (training happens outside the lock), then persist it."""
+        index_type = index_type or self.index_type
+        attr, _ = STORES[name]
+        with self._lock.read():
+            store = getattr(self, attr)
+            if store is None:
+                return None
+            generation = self._generation[name]
+            vectors = extract_vectors(store.index)
+
+        try:
+            index = build_index(index_type, vectors, self.index_params)
+        except Exception as e:
+            print(f"KB index rebuild failed ({name}): {e}")
+            return None
+
+        # The file lock spans swap and publish, so no other process compacts in between
+        with self._files[name]:
+            with self._lock.write():
+                self._catch_up(name)
+                store = getattr(self, attr)
+                if self._generation[name] != generation:
+                    # A purge or reload renumbered the vectors while we were training; the next insert retries
+                    return None
+                # Catch up on documents added while the new index was training
+                if store.index.ntotal > index.ntotal:
+                    index.add(extract_vectors(store.index, start=index.ntotal))
+                store.index = index
+                self._dirty[name] = True
+            # Publish the new index so other processes (and the next start) load it instead of retraining
+            self.compact(name, bump_version=True)
+        return index_kind(index)
+
+    def _start_compaction(self, name):
+        running = self._compactions.get(name)
+        if running and running.is_alive():
+            return
+        thread = threading.Thread(target=self.compact, args=(name,), daemon=True, name=f"kb-compact-{name}")
+        self._compactions[name] = thread
+        thread.start()
+
+    def compact(self, name, bump_version=False):
+        """
+        Fold logged deltas into a fresh base index, then trim the log. `bump_version` publishes
+        a snapshot whose index changed without a log entry (a rebuild) so other processes reload it.
+        """
+        attr, path = STORES[name]
+        with self._files[name]:
+            with self._lock.write():
+                # The snapshot must cover every process's entries before the log is trimmed
+                self._catch_up(name)
+            self._purge(name)
+            with self._lock.write():
+                store = getattr(self, attr)
+                if store is None:
+                    return
+                if bump_version:
+                    self._seq[name] = max(self._seq[name], read_version(self._versions[name])) + 1
+                seq = self._seq[name]
+                pending = self._pending[name]
+                if not bump_version and not self._dirty[name] and read_snapshot_seq(path) >= seq:
+                    # Another process already wrote a snapshot covering everything we hold
+                    self._pending[name] -= pending
+                    return
+                # In-memory copy so the slow disk write does not block searches
+                blob = store.serialize_to_bytes()
+                self._dirty[name] = False
+
+            snapshot = FAISS.deserialize_from_bytes(blob, self.embeddings, allow_dangerous_deserialization=True)
             try:
-                self.cot_store = FAISS.load_local(COT_KB_PATH, self.embeddings, allow_dangerous_deserialization=True)
-            except:
-                self.cot_store = None
+                write_snapshot(snapshot, path, seq)
+                self._logs[name].drop_through(seq)
+                if bump_version:
+                    write_version(self._versions[name], seq)
+            except Exception as e:
+                print(f"KB compaction failed ({name}): {e}")
+                with self._lock.write():
+                    self._dirty[name] = True
+                return
+
+        with self._lock.write():
+            self._pending[name] -= pending
+
+    def _submit(self, name, docs) -> Future:
+        """Queue `docs` for `name`; the returned future resolves once they are written (or the write failed)."""
+        future = Future()
+        if not self.async_writes:
+            self._add_documents(name, docs)
+            future.set_result(None)
+            return future
+        with self._init_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._queue = queue.Queue()
+                self._writer = threading.Thread(target=self._write_loop, daemon=True, name="kb-writer")
+                self._writer.start()
+                atexit.register(self.flush)
+        self._queue.put((name, docs, future))
+        return future
+
+    def _write_loop(self):
+        """Single writer: drains whatever is queued and saves it with one embedding call per store."""
+        while True:
+            batches = [self._queue.get()]
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            by_store = {}
+            for name, docs, future in batches:
+                store_docs, futures = by_store.setdefault(name, ([], []))
+                store_docs.extend(docs)
+                futures.append(future)
+            for name, (docs, futures) in by_store.items():
+                try:
+                    self._add_documents(name, docs)
+                except Exception as e:
+                    self._write_failures += 1
+                    print(f"KB write failed ({name}, {len(docs)} docs): {e}")
+                    for future in futures:
+                        future.set_exception(e)
+                else:
+                    for future in futures:
+                        future.set_result(None)
+            for _ in batches:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait for queued saves, then synchronously compact every store with pending deltas (e.g. before shutdown)."""
+        if self._queue is not None:
+            self._queue.join()
+        for name in STORES:
+            running = self._compactions.get(name)
+            if running and running.is_alive():
+                running.join()
+            if self._pending[name]:
+                self.compact(name)
 
-    def save_correct_experience(self, record: dict):
+    @staticmethod
+    def _correct_doc(record: dict, roles=None) -> Document:
+        text_content = json.dumps(record, ensure_ascii=False, indent=2)
+        meta = {"type": "correct_kb", "case_snippet": record.get("Question", "")[:50]}
+        if roles:
+            meta["roles"] = sorted({role_key(r) for r in roles})
+        return Document(page_content=text_content, metadata=meta)
+
+    @staticmethod
+    def _reflection_doc(record: dict, roles=None) -> Document:
+        text_content = json.dumps(record, ensure_ascii=False, indent=2)
+        meta = {"type": "chain_kb", "case_snippet": record.get("Question", "")[:50]}
+        if roles:
+            meta["roles"] = sorted({role_key(r) for r in roles})
+        return Document(page_content=text_content, metadata=meta)
+
+    def save_correct_experience(self, record: dict, roles=None):
         """
         Stores into CorrectKB:
         {
@@ -55,19 +655,12 @@ class DualKnowledgeBase:
             "Answer": <...>,
             "Summary of S4_final": <...>
         }
+        `roles` are the specialists of the consultation; they tag the record for role-filtered retrieval.
+        Returns a future that resolves once the record is written (see `write_status`).
         """
-        text_content = json.dumps(record, ensure_ascii=False, indent=2)
-        meta = {"type": "correct_kb", "case_snippet": record.get("Question", "")[:50]}
-
-        doc = Document(page_content=text_content, metadata=meta)
-
-        if self.correct_store:
-            self.correct_store.add_documents([doc])
-        else:
-            self.correct_store = FAISS.from_documents([doc], self.embeddings)
-        self.correct_store.save_local(CORRECT_KB_PATH)
+        return self._submit("correct", [self._correct_doc(record, roles)])
 
-    def save_reflection_experience(self, record: dict):
+    def save_reflection_experience(self, record: dict, roles=None):
         """
         Stores into ChainKB:
         {
@@ -78,50 +671,242 @@ class DualKnowledgeBase:
             "Final Conclusion": <...>,
             "Error Reflection": <...>
         }
+        Returns a future that resolves once the record is written (see `write_status`).
         """
-        text_content = json.dumps(record, ensure_ascii=False, indent=2)
-        meta = {"type": "chain_kb", "case_snippet": record.get("Question", "")[:50]}
+        return self._submit("cot", [self._reflection_doc(record, roles)])
+
+    def save_experiences(self, correct_records=(), reflection_records=(), correct_roles=None, reflection_roles=None):
+        """
+        Batched variant of the two savers: one embedding request and one log append per store.
+        `*_roles` are optional lists parallel to the records. Returns one future per submitted store.
+        """
+        futures = []
+        if correct_records:
+            roles = correct_roles or [None] * len(correct_records)
+            futures.append(self._submit("correct", [self._correct_doc(r, rl) for r, rl in zip(correct_records, roles)]))
+        if reflection_records:
+            roles = reflection_roles or [None] * len(reflection_records)
+            futures.append(self._submit("cot", [self._reflection_doc(r, rl) for r, rl in zip(reflection_records, roles)]))
+        return futures
+
+    def bulk_ingest(self, path, store="correct", batch_size=64, workers=4, progress_every=1000,
+                    compact_every=4096):
+        """
+        Seed a store from a JSONL file of KB records (same fields as the save_* methods).
+        Records are streamed, embedded in concurrent batches and logged batch by batch in input
+        order, like regular saves, so neither a crash nor another process writing the store
+        loses them; the log is compacted every `compact_every` records and at the end. Seeded
+        documents skip the near-duplicate check and are pinned, i.e. exempt from the size cap.
+        """
+        to_doc = self._correct_doc if store == "correct" else self._reflection_doc
+
+        def batches():
+            batch = []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        doc = to_doc(json.loads(line))
+                        # Seeded reference material is never evicted by the size cap
+                        doc.metadata.update(pinned=True, created=time.time())
+                        batch.append(doc)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+
+        def embed(docs):
+            return docs, self.embeddings.embed_documents([d.page_content for d in docs])
 
-        doc = Document(page_content=text_content, metadata=meta)
+        started = time.perf_counter()
+        count = 0
+        next_report = progress_every
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight = []
+            for docs in batches():
+                in_flight.append(pool.submit(embed, docs))
+                # Keep a bounded window of requests so memory does not grow with the file
+                if len(in_flight) < workers * 2:
+                    continue
+                count += self._ingest_batch(store, *in_flight.pop(0).result())
+                if count >= next_report:
+                    print(f"Ingested {count} records ({count / (time.perf_counter() - started):.1f} docs/sec)")
+                    next_report += progress_every
+                if self._pending[store] >= compact_every:
+                    self.compact(store)
+            for future in in_flight:
+                count += self._ingest_batch(store, *future.result())
 
-        if self.cot_store:
-            self.cot_store.add_documents([doc])
+        if count:
+            self.compact(store)
+        elapsed = time.perf_counter() - started
+        return {
+            "store": store,
+            "records": count,
+            "seconds": round(elapsed, 2),
+            "docs_per_sec": round(count / elapsed, 1) if elapsed else 0.0
+        }
+
+    def _ingest_batch(self, name, docs, vectors):
+        entries = [{"id": uuid.uuid4().hex, "text": d.page_content, "metadata": d.metadata, "vector": encode_vector(v)}
+                   for d, v in zip(docs, vectors)]
+        with self._files[name], self._lock.write():
+            self._catch_up(name)
+            self._seq[name] = max(self._seq[name], read_version(self._versions[name]))
+            self._log(name, entries)
+            self._maybe_promote(name)
+        return len(docs)
+
+    def _embed_query(self, query):
+        """Query vector, or None (lexical retrieval) when embeddings are down or slower than `embed_timeout`."""
+        if self.embeddings is None or self.retrieval_mode == "lexical" or not self._embed_breaker.allow():
+            return None
+        future = self._embed_pool.submit(contextvars.copy_context().run, self.embeddings.embed_query, query)
+        try:
+            query_vec = future.result(timeout=self.embed_timeout)
+        except FutureTimeout:
+            # The call keeps running and fills the embedding cache for the next retrieval
+            print(f"Query embedding exceeded {self.embed_timeout}s, using lexical retrieval.")
+        except Exception as e:
+            print(f"Query embedding failed, using lexical retrieval: {e}")
         else:
-            self.cot_store = FAISS.from_documents([doc], self.embeddings)
-        self.cot_store.save_local(COT_KB_PATH)
+            self._embed_breaker.record_success()
+            return query_vec
+        self._embed_breaker.record_failure()
+        return None
+
+    def _search(self, name, query, query_vec, k):
+        """
+        Top-k live documents; called with the read lock held. Vector and BM25 candidates
+        (4k each) are merged by reciprocal rank fusion; without a query vector only BM25 ranks.
+        """
+        store = getattr(self, STORES[name][0])
+        if store is None:
+            return []
+        deleted = self._deleted[name]
+        fetch = k if self.retrieval_mode == "vector" else 4 * k
+        rankings = []
+        if query_vec is not None:
+            _, found = store.index.search(np.asarray([query_vec], dtype=np.float32),
+                                          min(fetch + len(deleted), store.index.ntotal))
+            ids = (store.index_to_docstore_id.get(int(p)) for p in found[0] if p >= 0)
+            rankings.append([doc_id for doc_id in ids if doc_id is not None and doc_id not in deleted][:fetch])
+        if self.retrieval_mode != "vector" or query_vec is None:
+            rankings.append([doc_id for doc_id, _ in self._lexical[name].search(query, fetch, exclude=deleted)])
+        return [store.docstore.search(doc_id) for doc_id in reciprocal_rank_fusion(rankings)[:k]]
+
+    def stats(self) -> dict:
+        """Live documents, pending tombstones and index type per store."""
+        stats = {}
+        with self._lock.read():
+            for name, (attr, _) in STORES.items():
+                store = getattr(self, attr)
+                total = store.index.ntotal if store is not None else 0
+                stats[name] = {
+                    "documents": total - len(self._deleted[name]),
+                    "tombstones": len(self._deleted[name]),
+                    "index": index_kind(store.index) if store is not None else None,
+                    "roles": self._partitions[name].counts(),
+                    "lexical_terms": self._lexical[name].terms
+                }
+        return stats
+
+    def writer_stats(self) -> dict:
+        """Saves waiting for the writer thread, and writes that failed since start."""
+        return {"queued": self._queue.qsize() if self._queue is not None else 0, "failures": self._write_failures}
+
+    def retrieve_for_roles(self, query: str, roles, k=1, fallback=(), query_vec=None):
+        """
+        Role-filtered retrieval: for each role, the `k` closest documents per store among those
+        tagged with that role, topped up to `k` per store from `fallback` (e.g. the case-level
+        hits) when a role has few tagged experiences. The query is scored once per store against
+        the role-tagged rows and the hits are split by role tag. Pass `query_vec` (from
+        `retrieve_context_details`) to skip embedding the query again. Returns {role: [Document, ...]}.
+        """
+        roles = list(roles)
+        if not self.initialized or not roles:
+            return {role: list(fallback)[:k * len(STORES)] for role in roles}
+
+        self.refresh()
+        if query_vec is None:
+            query_vec = self._embed_query(query)
+        if query_vec is None:
+            return {role: list(fallback)[:k * len(STORES)] for role in roles}
+
+        found = {role: [] for role in roles}
+        hit_ids = {}
+        with self._lock.read():
+            for name, (attr, _) in STORES.items():
+                store = getattr(self, attr)
+                if store is None:
+                    continue
+                partitions = self._partitions[name]
+                partitions.sync(store, self._generation[name])
+                hits = partitions.search(query_vec, roles, k, exclude=self._deleted[name])
+                for role, role_hits in zip(roles, hits):
+                    docs = [store.docstore.search(doc_id) for doc_id, _ in role_hits]
+                    for doc in docs:
+                        doc.metadata["source_kb"] = "CorrectKB" if name == "correct" else "ChainKB"
+                    found[role].extend(docs)
+                hit_ids[name] = [doc_id for role_hits in hits for doc_id, _ in role_hits]
+        for name, ids in hit_ids.items():
+            self.usage.record_hits(name, ids)
+
+        limit = k * len(STORES)
+        for role, docs in found.items():
+            seen = {d.id for d in docs}
+            for doc in fallback:
+                if len(docs) >= limit:
+                    break
+                if doc.id not in seen:
+                    docs.append(doc)
+        return found
 
     def retrieve_context_details(self, query: str, k=2):
+        """Case-level context from both stores; `query_vec` is returned for reuse by `retrieve_for_roles`."""
         if not self.initialized:
-            return {"text": "Knowledge Base not initialized.", "docs": []}
+            return {"text": "Knowledge Base not initialized.", "docs": [], "query_vec": None}
+
+        # Pick up experiences saved by other processes since the last case
+        self.refresh()
 
         context_text_parts = []
         all_docs = []
 
+        # Embed the query once and search both stores with the same vector
+        query_vec = self._embed_query(query) if (self.correct_store or self.cot_store) else None
+
+        # Concurrent searches run together; only inserts / index swaps wait for them
+        with self._lock.read():
+            correct_docs = self._search("correct", query, query_vec, k)
+            cot_docs = self._search("cot", query, query_vec, k)
+
+        # Retrieval hits are what keeps a document from being evicted
+        self.usage.record_hits("correct", [d.id for d in correct_docs if d.id])
+        self.usage.record_hits("cot", [d.id for d in cot_docs if d.id])
+
         # 1. Correct Patterns
-        if self.correct_store:
-            docs = self.correct_store.similarity_search(query, k=k)
-            if docs:
-                context_text_parts.append("--- [CorrectKB] SUCCESSFUL EXPERIENCES ---")
-                for d in docs:
-                    d.metadata["source_kb"] = "CorrectKB"
-                    context_text_parts.append(d.page_content)
-                    all_docs.append(d)
+        if correct_docs:
+            context_text_parts.append("--- [CorrectKB] SUCCESSFUL EXPERIENCES ---")
+            for d in correct_docs:
+                d.metadata["source_kb"] = "CorrectKB"
+                context_text_parts.append(d.page_content)
+                all_docs.append(d)
 
         # 2. Reflection Patterns
-        if self.cot_store:
-            docs = self.cot_store.similarity_search(query, k=k)
-            if docs:
-                context_text_parts.append("\n--- [ChainKB] ERROR REFLECTIONS ---")
-                for d in docs:
-                    d.metadata["source_kb"] = "ChainKB"
-                    context_text_parts.append(d.page_content)
-                    all_docs.append(d)
+        if cot_docs:
+            context_text_parts.append("\n--- [ChainKB] ERROR REFLECTIONS ---")
+            for d in cot_docs:
+                d.metadata["source_kb"] = "ChainKB"
+                context_text_parts.append(d.page_content)
+                all_docs.append(d)
 
         final_text = "\n".join(context_text_parts) if context_text_parts else "No specific prior experience found."
 
         return {
             "text": final_text,
-            "docs": all_docs
+            "docs": all_docs,
+            "query_vec": query_vec
         }
 
 
@@ -0,0 +1,209 @@
+"""
+Central scheduler for LLM calls: per-model token buckets (requests/min, tokens/min),
+a priority-ordered concurrency cap and jittered exponential backoff on retryable errors.
+Calls first wait for rate-limit capacity, then for a concurrency slot, both in priority
+order, so a throttled background call never sits on a slot a critical-path call needs.
+
+One `LLMScheduler` exists per (base_url, model) in the process, so concurrent
+consultations (batch workers, Streamlit sessions) share the provider's limits.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import openai
+
+# Lower runs first when calls queue for a concurrency slot
+PRIORITY_CRITICAL = 0    # on the critical path of every round: triage, lead physician, safety review
+PRIORITY_NORMAL = 1      # specialists
+PRIORITY_BACKGROUND = 2  # query planning, research fallback, grading
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class TokenBucket:
+    """`per_minute` units per minute with a burst of one minute's worth; 0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount) -> float:
+        """Seconds until `amount` is available (requests above the burst wait for a full bucket)."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill()
+            return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """Give back (positive) or take more (negative) once the real usage is known."""
+        if not self.rate:
+            return
+        with self._lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _PrioritySlots:
+    """Counting semaphore that hands free slots to the lowest priority value first (FIFO within a level)."""
+
+    def __init__(self, slots):
+        self.free = slots
+        self._waiters = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority):
+        with self._cond:
+            entry = (priority, next(self._order))
+            heapq.heappush(self._waiters, entry)
+            while self.free <= 0 or self._waiters[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiters)
+            self.free -= 1
+            # The next waiter may also be able to go
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.free += 1
+            self._cond.notify_all()
+
+
+class LLMScheduler:
+    def __init__(self, rpm=0, tpm=0, max_concurrency=8, max_retries=4, base_delay=1.0, max_delay=30.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.slots = _PrioritySlots(max_concurrency)
+        # Calls waiting for bucket capacity (or a 429 pause), lowest priority value first
+        self._waiters = []
+        self._order = itertools.count()
+        self._admission = threading.Condition()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Set after a 429 so every caller of this model backs off, not just the one that hit it
+        self.paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failed": 0, "queued_s": 0.0}
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt, error) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter: spreads out callers that failed together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _admit(self, priority, est_tokens):
+        """Block until this call is the most urgent waiter and the buckets can cover it, then take its share."""
+        with self._admission:
+            entry = (priority, next(self._order))
+            heapq.heappush(self._waiters, entry)
+            while True:
+                timeout = None
+                if self._waiters[0] == entry:
+                    timeout = max(self.requests.wait_time(1), self.tokens.wait_time(est_tokens),
+                                  self.paused_until - time.monotonic())
+                    if timeout <= 0:
+                        break
+                # Non-head waiters sleep until the head leaves; the head until capacity refills
+                self._admission.wait(timeout)
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(est_tokens)
+            self._admission.notify_all()
+
+    def run(self, fn, priority=PRIORITY_NORMAL, est_tokens=1000, telemetry=None, can_retry=None):
+        """
+        Call `fn()` under the model's limits. Retryable errors are retried with backoff while
+        `can_retry()` allows it (e.g. nothing has been streamed to the UI yet); the last error is raised.
+        """
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            self._admit(priority, est_tokens)
+            self.slots.acquire(priority)
+            try:
+                waited = time.monotonic() - queued
+                with self._lock:
+                    self.stats["calls"] += 1
+                    self.stats["queued_s"] += waited
+                if telemetry is not None and waited >= 0.01:
+                    telemetry.record("llm.queue", waited, priority=priority)
+
+                try:
+                    result = fn()
+                except RETRYABLE_ERRORS as e:
+                    error = e
+                else:
+                    usage = getattr(result, "usage_metadata", None)
+                    if usage and usage.get("total_tokens"):
+                        self.tokens.adjust(est_tokens - usage["total_tokens"])
+                        with self._admission:
+                            self._admission.notify_all()
+                    return result
+            finally:
+                self.slots.release()
+
+            # Retryable failure: back off outside the slot so others keep going
+            limited = isinstance(error, openai.RateLimitError)
+            retry = attempt < self.max_retries and (can_retry is None or can_retry())
+            with self._lock:
+                if limited:
+                    self.stats["rate_limited"] += 1
+                if retry:
+                    self.stats["retries"] += 1
+                else:
+                    self.stats["failed"] += 1
+            delay = self._backoff(attempt, error)
+            if limited:
+                # Even when this caller gives up, the others should not hit the limit again right away
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            if not retry:
+                raise error
+
+            if telemetry is not None:
+                telemetry.record("llm.retry", delay, attempt=attempt + 1, error=type(error).__name__)
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_scheduler(base_url, model, **limits) -> LLMScheduler:
+    """The shared scheduler for (base_url, model); `limits` only apply when it is first created."""
+    key = (base_url, model)
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = LLMScheduler(**limits)
+        return _registry[key]
+
+
+def scheduler_stats() -> dict:
+    with _registry_lock:
+        return {f"{model}@{base_url}": dict(s.stats) for (base_url, model), s in _registry.items()}
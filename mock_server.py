@@ -0,0 +1,308 @@
+"""
+Local OpenAI-compatible stand-in server for offline load and latency benchmarking.
+
+Serves chat completions (plain and streaming, text and vision payloads), embeddings
+and a model list, with configurable latency, streaming speed and error rate. Chat
+responses are canned but shaped like what each MDTAgents prompt expects, so the
+whole workflow runs end to end.
+
+Usage:
+    python mock_server.py --port 8000 --latency 0.3 --tps 80 --error-rate 0.02
+    # then set "base_url": "http://127.0.0.1:8000/v1" (any api_key) in config.json
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from agents import SPECIALIST_POOL
+
+SPECIALIST_TEXT = (
+    "**1. Context Summary**: Prior knowledge and the residual context were reviewed; no contradictions "
+    "with the current presentation were found.\n\n"
+    "**2. Clinical Reasoning**: The presentation is most consistent with the leading hypothesis. "
+    "Key findings support it, alternative diagnoses are less likely given the timeline and examination, "
+    "and the available evidence favors standard first-line management.{image}\n\n"
+    "**3. Conclusion**: The most likely diagnosis is the leading hypothesis; recommend confirmatory "
+    "testing and guideline-directed treatment."
+)
+
+
+class MockSettings:
+    def __init__(self, latency=0.2, jitter=0.1, tps=60.0, error_rate=0.0, converge_rate=0.7,
+                 correct_rate=0.6, dim=1024, specialist_repeat=3, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tps = tps
+        self.error_rate = error_rate
+        self.converge_rate = converge_rate
+        self.correct_rate = correct_rate
+        self.dim = dim
+        self.specialist_repeat = specialist_repeat
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"chat": 0, "stream": 0, "embeddings": 0, "errors": 0, "vision": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def roll(self, p):
+        with self.lock:
+            return self.rng.random() < p
+
+
+def _message_text(messages):
+    parts = []
+    has_image = False
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            for block in content:
+                if block.get("type") == "text":
+                    parts.append(block.get("text", ""))
+                elif block.get("type") == "image_url":
+                    has_image = True
+        elif content:
+            parts.append(content)
+    return "\n".join(parts), has_image
+
+
+def canned_reply(text, has_image, settings: MockSettings):
+    """Pick a response shaped like what the calling agent parses."""
+    if "Primary Care Doctor at the Triage Desk" in text:
+        digest = int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16)
+        start = digest % len(SPECIALIST_POOL)
+        roles = [SPECIALIST_POOL[(start + i) % len(SPECIALIST_POOL)] for i in range(3 + digest % 2)]
+        return json.dumps({"reasoning": "Mock triage based on the presenting complaint.", "selected_roles": roles})
+
+    if "For each specialist below" in text:
+        match = re.search(r"Specialists:\s*(.+)", text)
+        roles = [r.strip() for r in match.group(1).split(",")] if match else []
+        return json.dumps({r: f"{r.lower()} management guideline" for r in roles})
+
+    if "Extract 1 specific medical query" in text:
+        return "first-line management guideline"
+
+    if "You are the Lead Physician" in text:
+        return json.dumps({
+            "Consistency": "All specialists favor the leading hypothesis.",
+            "Conflict": "" if settings.roll(settings.converge_rate) else "Disagreement on confirmatory testing.",
+            "Independence": "Pharmacology input on dosing; imaging input on modality.",
+            "Integration": "The team converges on the leading hypothesis with guideline-directed treatment.",
+            "Tools_Usage": "PubMed and web search for guidelines.",
+            "Long_Term_Experience": "No specific prior experience referenced."
+        })
+
+    if "Safety and Ethics Reviewer" in text:
+        if settings.roll(settings.converge_rate):
+            return "STATUS: CONVERGED\nREASON: Consistent conclusion without major conflicts.\n" \
+                   "FINAL_ANSWER: The leading hypothesis."
+        return "STATUS: DIVERGED\nREASON: Open conflicts remain.\nFINAL_ANSWER: Continuing discussion"
+
+    if "Chain-of-Thought Reviewer" in text:
+        if settings.roll(settings.correct_rate):
+            return json.dumps({"is_correct": True, "summary_s4": "Systematic reasoning reached the right answer."})
+        return json.dumps({
+            "is_correct": False,
+            "initial_hypothesis": "The leading hypothesis.",
+            "analysis_process": "Anchored early on the first plausible diagnosis.",
+            "final_conclusion": "The leading hypothesis.",
+            "error_reflection": "Weigh discriminating findings before converging."
+        })
+
+    image_note = " The provided image shows findings compatible with this interpretation." if has_image else ""
+    return "\n\n".join([SPECIALIST_TEXT.format(image=image_note)] * settings.specialist_repeat)
+
+
+def _tokens(text):
+    return re.findall(r"\S+\s*", text)
+
+
+def mock_embedding(text, dim):
+    """Deterministic bag-of-words vector: texts sharing words get similar embeddings."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        h = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+        vec[h % dim] += 1.0 if (h >> 64) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    settings: MockSettings = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _maybe_fail(self):
+        if self.settings.roll(self.settings.error_rate):
+            self.settings.count("errors")
+            status = 429 if self.settings.roll(0.5) else 500
+            self._send_json(status, {"error": {"message": "Mock injected error", "type": "mock_error",
+                                               "code": status}})
+            return True
+        return False
+
+    def _wait_first_token(self):
+        s = self.settings
+        time.sleep(max(0.0, s.latency + s.rng.uniform(-s.jitter, s.jitter)))
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.settings.counters)
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        payload = self._read_json()
+        if path.endswith("/chat/completions"):
+            self._chat(payload)
+        elif path.endswith("/embeddings"):
+            self._embeddings(payload)
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def _chat(self, payload):
+        s = self.settings
+        s.count("chat")
+        if self._maybe_fail():
+            return
+
+        text, has_image = _message_text(payload.get("messages", []))
+        if has_image:
+            s.count("vision")
+        reply = canned_reply(text, has_image, s)
+        usage = {"prompt_tokens": len(text) // 4, "completion_tokens": len(_tokens(reply))}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = payload.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        self._wait_first_token()
+
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+
+        s.count("stream")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(chunk):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def chunk(delta, finish=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        delay = 1.0 / s.tps if s.tps else 0.0
+        send(chunk({"role": "assistant", "content": ""}))
+        for token in _tokens(reply):
+            send(chunk({"content": token}))
+            if delay:
+                time.sleep(delay)
+        send(chunk({}, "stop"))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                  "model": model, "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _embeddings(self, payload):
+        s = self.settings
+        s.count("embeddings")
+        if self._maybe_fail():
+            return
+
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = payload.get("dimensions") or s.dim
+        self._wait_first_token()
+
+        data = []
+        for i, text in enumerate(inputs):
+            vec = mock_embedding(text if isinstance(text, str) else " ".join(map(str, text)), dim)
+            # The openai client asks for base64 by default
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(len(str(t)) // 4 for t in inputs)
+        self._send_json(200, {"object": "list", "data": data, "model": payload.get("model", "mock"),
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+def serve(host="127.0.0.1", port=8000, settings=None):
+    """Start the server in a background thread and return it (call `.shutdown()` to stop)."""
+    handler = type("BoundMockHandler", (MockHandler,), {"settings": settings or MockSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-openai").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server for MDTeamGPT.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token / response")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform +/- jitter on the latency")
+    parser.add_argument("--tps", type=float, default=60.0, help="Streaming tokens per second (0 = unthrottled)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 429/500")
+    parser.add_argument("--converge-rate", type=float, default=0.7, help="Chance the reviewer reports CONVERGED")
+    parser.add_argument("--correct-rate", type=float, default=0.6, help="Chance the CoT reviewer grades correct")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension")
+    parser.add_argument("--specialist-repeat", type=int, default=3, help="Length multiplier of specialist answers")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockSettings(latency=args.latency, jitter=args.jitter, tps=args.tps, error_rate=args.error_rate,
+                            converge_rate=args.converge_rate, correct_rate=args.correct_rate, dim=args.dim,
+                            specialist_repeat=args.specialist_repeat, seed=args.seed)
+    server = serve(args.host, args.port, settings)
+    print(f"Mock OpenAI server on http://{args.host}:{args.port}/v1 (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Headless consultation service (asyncio, plain HTTP, no extra dependencies).
+
+    POST /consult   {"case": "...", "image": "<base64>", "ground_truth": "...", "max_rounds": 6}
+                    -> newline-delimited JSON events, streamed as the consultation runs:
+                       queued, started, token, tool, triage, consultation_layer, safety_layer,
+                       review (training only; "kb_write" is saved / queued / failed: ...),
+                       result | error
+    POST /resume    {"thread_id": "..."}
+                    -> the same event stream, continuing a failed consultation from its last
+                       completed round (its id is in the "started" event and in GET /runs)
+    GET  /runs      -> unfinished consultations that can be resumed
+    GET  /health    -> {"status": "ok"}
+    GET  /stats     -> running / queued consultations, runtime pool and scheduler stats
+
+At most `--concurrency` consultations run at once; up to `--queue` more wait for a slot
+and anything beyond that is rejected with 503. All of them share the process-wide
+knowledge base, runtime pool and per-model LLM schedulers.
+
+Usage:
+    python service.py --port 8080 --concurrency 8 --queue 64
+    curl -N -X POST localhost:8080/consult -d '{"case": "45M with crushing chest pain..."}'
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from langchain_core.documents import Document
+
+import checkpoints
+import client_pool
+from knowledge_base import kb_system, write_status
+from llm_scheduler import scheduler_stats
+from utils import load_config
+
+MAX_BODY = 32 * 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 409: "Conflict", 413: "Payload Too Large",
+           503: "Service Unavailable"}
+
+
+def _json_default(obj):
+    if isinstance(obj, Document):
+        return {"page_content": obj.page_content, "metadata": obj.metadata}
+    return str(obj)
+
+
+def _line(event, **data) -> bytes:
+    return (json.dumps({"event": event, **data}, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8")
+
+
+class ConsultationService:
+    def __init__(self, cfg, concurrency=8, max_queue=64, train=True):
+        self.cfg = cfg
+        self.train = train
+        self.max_queue = max_queue
+        self.slots = asyncio.Semaphore(concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+
+    async def start(self):
+        kb_system.configure_index(self.cfg.get("kb_index_type", "hnsw"), self.cfg.get("kb_promote_at", 20000))
+        kb_system.configure_retention(self.cfg.get("kb_max_docs", 50000), self.cfg.get("kb_dedup_similarity", 0.97),
+                                      self.cfg.get("kb_dedup_policy", "skip"))
+        kb_system.configure_retrieval(self.cfg.get("kb_retrieval_mode", "hybrid"),
+                                      self.cfg.get("kb_embed_timeout", 5.0))
+        await asyncio.to_thread(kb_system.init_embeddings, api_key=self.cfg["api_key"],
+                                base_url=self.cfg["base_url"], http_client=client_pool.get_http_client())
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.waiting,
+            "completed": self.completed,
+            "pool": client_pool.pool_stats(),
+            "kb": kb_system.stats(),
+            "kb_writer": kb_system.writer_stats(),
+            "scheduler": scheduler_stats()
+        }
+
+    # HTTP plumbing
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                return await self._respond(writer, 413, {"error": "Request body too large"})
+            body = await reader.readexactly(length) if length else b""
+
+            if method == "GET" and path == "/health":
+                await self._respond(writer, 200, {"status": "ok"})
+            elif method == "GET" and path == "/stats":
+                await self._respond(writer, 200, self.stats())
+            elif method == "GET" and path == "/runs":
+                await self._respond(writer, 200, {"runs": checkpoints.get_runs().unfinished()})
+            elif method == "POST" and path == "/consult":
+                await self._consult(writer, body)
+            elif method == "POST" and path == "/resume":
+                await self._consult(writer, body, resume=True)
+            else:
+                await self._respond(writer, 404, {"error": "Not found"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError:
+            await self._respond(writer, 400, {"error": "Malformed request"})
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _consult(self, writer, body, resume=False):
+        field = "thread_id" if resume else "case"
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or field not in request:
+            return await self._respond(writer, 400, {"error": f"Expected JSON with a '{field}' field"})
+        if resume:
+            runs = checkpoints.get_runs()
+            run = runs.get(request["thread_id"])
+            if not run:
+                return await self._respond(writer, 404, {"error": "Unknown consultation"})
+
+        if self.waiting >= self.max_queue:
+            return await self._respond(writer, 503, {"error": "Too many queued consultations"})
+        # Claimed before queueing, so a second /resume of the same run is refused right away
+        if resume and not runs.start(run["thread_id"]):
+            return await self._respond(writer, 409, {"error": "Consultation is still running"})
+
+        task = None
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            events = asyncio.Queue()
+            self.waiting += 1
+            writer.write(_line("queued", position=self.waiting))
+            await writer.drain()
+
+            async with self.slots:
+                self.waiting -= 1
+                self.running += 1
+                try:
+                    task = asyncio.create_task(self._run(request, events, resume))
+                    while True:
+                        item = await events.get()
+                        if item is None:
+                            break
+                        writer.write(item)
+                        await writer.drain()
+                    await task
+                except ConnectionError:
+                    # Client went away: let the consultation finish so its runtime returns to the pool
+                    await task
+                finally:
+                    self.running -= 1
+                    self.completed += 1
+        finally:
+            if resume and task is None:
+                # Client left while queued: hand the claimed run back so it can be resumed again
+                runs.finish(run["thread_id"], run["error"], resumable=True)
+
+    # Consultation
+    async def _run(self, request, events, resume=False):
+        loop = asyncio.get_running_loop()
+
+        def emit(event, **data):
+            # Called from graph worker threads as well as the loop
+            loop.call_soon_threadsafe(events.put_nowait, _line(event, **data))
+
+        checkout = client_pool.checkout(self.cfg)
+        started = time.perf_counter()
+        try:
+            runtime = await asyncio.to_thread(checkout.__enter__)
+        except Exception as e:
+            if resume:
+                # Nothing ran: hand the claimed run back
+                checkpoints.get_runs().finish(request["thread_id"], str(e), resumable=True)
+            events.put_nowait(_line("error", error=str(e)))
+            events.put_nowait(None)
+            return
+
+        agents, app = runtime.agents, runtime.app
+        error = None
+        if resume:
+            thread_id, state = request["thread_id"], None
+            saved = await asyncio.to_thread(checkpoints.saved_state, app, thread_id)
+        else:
+            thread_id, saved = checkpoints.new_thread_id(), {}
+            state = {
+                "case_info": request["case"], "image_base64": request.get("image"),
+                "ground_truth": request.get("ground_truth", ""),
+                "selected_roles": [], "triage_reason": "", "current_round": 1,
+                "max_rounds": int(request.get("max_rounds", 6)),
+                "context_bullets": [], "final_answer": "", "is_converged": False,
+                "kb_context_text": "", "kb_context_docs": [], "role_kb_docs": {}, "timings": {},
+                "telemetry": []
+            }
+        case = (state or saved).get("case_info", "")
+        ground_truth = (state or saved).get("ground_truth", "")
+        max_rounds = (state or saved).get("max_rounds", 6)
+        try:
+            graph_input = await asyncio.to_thread(checkpoints.begin, app, thread_id, state)
+            emit("started", thread_id=thread_id, resumed=graph_input is None)
+            agents.set_stream_callback(lambda role, token: emit("token", role=role, token=token))
+            agents.set_tool_callback(lambda role, query, result: emit("tool", role=role, query=query, result=result))
+
+            final_answer, rounds = "", len(saved.get("context_bullets", []))
+            roles = saved.get("selected_roles", [])
+            async for event in app.astream(graph_input, checkpoints.run_config(thread_id, max_rounds)):
+                for node, update in event.items():
+                    emit(node, data=update)
+                    if node == "triage":
+                        roles = update.get("selected_roles", [])
+                    if node == "consultation_layer":
+                        rounds += 1
+                    if node == "safety_layer" and update.get("is_converged"):
+                        final_answer = update.get("final_answer", "")
+
+            if self.train and ground_truth and final_answer:
+                review = await asyncio.to_thread(self._review, agents, case, final_answer, ground_truth, roles)
+                emit("review", data=review)
+
+            emit("result", thread_id=thread_id, final_answer=final_answer, rounds=rounds,
+                 latency_s=round(time.perf_counter() - started, 3), **agents.telemetry.totals())
+        except Exception as e:
+            error = str(e)
+            emit("error", thread_id=thread_id, error=error)
+        finally:
+            try:
+                await asyncio.to_thread(checkpoints.end, app, thread_id, error)
+            finally:
+                checkout.__exit__(None, None, None)
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+    @staticmethod
+    def _review(agents, case, final_answer, ground_truth, roles):
+        """CoT grading plus the KB write; runs off the event loop (the KB write lock may wait for searches)."""
+        result = agents.cot_reviewer(case, final_answer, ground_truth)
+        if result.get("is_correct"):
+            saved = kb_system.save_correct_experience({
+                "Question": case,
+                "Answer": final_answer,
+                "Summary of S4_final": result.get("summary_s4", "No summary provided.")
+            }, roles)
+        else:
+            saved = kb_system.save_reflection_experience({
+                "Question": case,
+                "Correct Answer": ground_truth,
+                "Initial Hypothesis": result.get("initial_hypothesis", "-"),
+                "Analysis Process": result.get("analysis_process", "-"),
+                "Final Conclusion": result.get("final_conclusion", "-"),
+                "Error Reflection": result.get("error_reflection", "-")
+            }, roles)
+        # "queued" when the writer is still busy; a failure is reported instead of claiming it was saved
+        result["kb_write"] = write_status(saved)
+        return result
+
+
+async def serve(cfg, host="127.0.0.1", port=8080, concurrency=8, max_queue=64, train=True):
+    service = ConsultationService(cfg, concurrency=concurrency, max_queue=max_queue, train=train)
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"MDTeamGPT service on http://{host}:{port} (concurrency {concurrency}, queue {max_queue})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await asyncio.to_thread(kb_system.flush)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless MDTeamGPT consultation service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=8, help="Consultations run at once")
+    parser.add_argument("--queue", type=int, default=64, help="Consultations allowed to wait for a slot")
+    parser.add_argument("--no-train", action="store_true", help="Never grade or write to the knowledge base")
+    args = parser.parse_args()
+
+    cfg = load_config()
+    if not cfg.get("api_key"):
+        raise SystemExit("Set api_key in config.json first.")
+    try:
+        asyncio.run(serve(cfg, args.host, args.port, args.concurrency, args.queue, train=not args.no_train))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
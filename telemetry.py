@@ -0,0 +1,205 @@
+"""
+Lightweight latency / token instrumentation.
+
+`Telemetry.span(...)` times a block of code; `TelemetryCallbackHandler` turns every
+LLM call into a span (wall time, time-to-first-token, prompt/completion tokens,
+retries) tagged with the enclosing span's name and attributes. Spans are plain
+dicts so they can be put on `MDTState` and exported as JSON lines or in
+Prometheus text format.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Name and attributes (role, round, ...) of the innermost open span in this context
+_current = contextvars.ContextVar("mdt_telemetry_span", default=None)
+
+
+class Telemetry:
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self.handler = TelemetryCallbackHandler(self)
+
+    def record(self, name, wall_s, **attrs):
+        span = {"name": name, "start": round(time.time() - wall_s, 3), "wall_s": round(wall_s, 4)}
+        parent = _current.get()
+        if parent:
+            span["parent"] = parent["name"]
+            for key, value in parent["attrs"].items():
+                attrs.setdefault(key, value)
+        span.update({k: v for k, v in attrs.items() if v is not None})
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attrs):
+        attrs = {k: v for k, v in attrs.items() if v is not None}
+        parent = _current.get()
+        inherited = {**(parent["attrs"] if parent else {}), **attrs}
+        token = _current.set({"name": name, "attrs": inherited})
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            _current.reset(token)
+            self.record(name, time.perf_counter() - started, error=error, **attrs)
+
+    def mark(self) -> int:
+        with self._lock:
+            return len(self.spans)
+
+    def since(self, mark: int):
+        with self._lock:
+            return list(self.spans[mark:])
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+
+    def totals(self) -> dict:
+        with self._lock:
+            llm = [s for s in self.spans if s["name"] == "llm"]
+            scheduled_retries = sum(1 for s in self.spans if s["name"] == "llm.retry")
+        return {
+            "llm_calls": len(llm),
+            "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in llm),
+            "completion_tokens": sum(s.get("completion_tokens", 0) for s in llm),
+            "retries": sum(s.get("retries", 0) for s in llm) + scheduled_retries
+        }
+
+    def to_jsonl(self, spans=None) -> str:
+        spans = self.since(0) if spans is None else spans
+        return "".join(json.dumps(s, ensure_ascii=False) + "\n" for s in spans)
+
+    def to_prometheus(self, spans=None) -> str:
+        return prometheus_text(self.since(0) if spans is None else spans)
+
+
+def traced(span_name):
+    """Run an agent method inside `self.telemetry.span`, tagged with its `role` / `round_num` arguments."""
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            arguments = signature.bind_partial(self, *args, **kwargs).arguments
+            with self.telemetry.span(span_name, role=arguments.get("role"), round=arguments.get("round_num")):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _label(span):
+    # LLM spans are aggregated under the span that issued them
+    return span.get("parent", "none") if span["name"] == "llm" else span["name"]
+
+
+def prometheus_text(spans) -> str:
+    seconds, errors, ttft, tokens = {}, {}, {}, {}
+    for s in spans:
+        key = (s["name"], _label(s))
+        total, count = seconds.get(key, (0.0, 0))
+        seconds[key] = (total + s["wall_s"], count + 1)
+        if s.get("error"):
+            errors[key] = errors.get(key, 0) + 1
+        if "ttft_s" in s:
+            total, count = ttft.get(key, (0.0, 0))
+            ttft[key] = (total + s["ttft_s"], count + 1)
+        for kind in ("prompt", "completion"):
+            if s.get(f"{kind}_tokens"):
+                tokens[key + (kind,)] = tokens.get(key + (kind,), 0) + s[f"{kind}_tokens"]
+
+    lines = ["# HELP mdt_span_seconds Wall time of instrumented spans.", "# TYPE mdt_span_seconds summary"]
+    for (name, label), (total, count) in sorted(seconds.items()):
+        lines.append(f'mdt_span_seconds_sum{{span="{name}",scope="{label}"}} {total:.6f}')
+        lines.append(f'mdt_span_seconds_count{{span="{name}",scope="{label}"}} {count}')
+    lines += ["# HELP mdt_llm_ttft_seconds Time to first streamed token.", "# TYPE mdt_llm_ttft_seconds summary"]
+    for (name, label), (total, count) in sorted(ttft.items()):
+        lines.append(f'mdt_llm_ttft_seconds_sum{{span="{name}",scope="{label}"}} {total:.6f}')
+        lines.append(f'mdt_llm_ttft_seconds_count{{span="{name}",scope="{label}"}} {count}')
+    lines += ["# HELP mdt_llm_tokens_total LLM tokens by kind.", "# TYPE mdt_llm_tokens_total counter"]
+    for (name, label, kind), value in sorted(tokens.items()):
+        lines.append(f'mdt_llm_tokens_total{{span="{name}",scope="{label}",kind="{kind}"}} {value}')
+    lines += ["# HELP mdt_span_errors_total Spans that ended with an error.", "# TYPE mdt_span_errors_total counter"]
+    for (name, label), value in sorted(errors.items()):
+        lines.append(f'mdt_span_errors_total{{span="{name}",scope="{label}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """Records one "llm" span per chat model call."""
+
+    def __init__(self, telemetry: Telemetry):
+        self.telemetry = telemetry
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, kwargs)
+
+    def _start(self, run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        with self._lock:
+            self._runs[run_id] = {
+                "started": time.perf_counter(),
+                "first_token": None,
+                "retries": 0,
+                "model": params.get("model") or params.get("model_name"),
+                # Callbacks run on the calling thread, so this is the issuing span
+                "context": contextvars.copy_context()
+            }
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run and run["first_token"] is None and token:
+                run["first_token"] = time.perf_counter()
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run:
+                run["retries"] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt, completion = 0, 0
+        for generations in response.generations:
+            for gen in generations:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt += usage.get("input_tokens", 0)
+                    completion += usage.get("output_tokens", 0)
+        if not (prompt or completion):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt = usage.get("prompt_tokens", 0)
+            completion = usage.get("completion_tokens", 0)
+        self._finish(run_id, prompt_tokens=prompt, completion_tokens=completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=str(error))
+
+    def _finish(self, run_id, **attrs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        now = time.perf_counter()
+        if run["first_token"] is not None:
+            attrs["ttft_s"] = round(run["first_token"] - run["started"], 4)
+        run["context"].run(self.telemetry.record, "llm", now - run["started"], model=run["model"],
+                           retries=run["retries"], **attrs)
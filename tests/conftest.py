@@ -0,0 +1,62 @@
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules create their data folders (knowledge_bases/, cache/) relative to the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="mdteam-tests-"))
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors, so KB tests need no embedding endpoint."""
+
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1
+        return (vector / (np.linalg.norm(vector) + 1e-9)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture
+def make_kb(tmp_path, monkeypatch):
+    """Factory for DualKnowledgeBase instances sharing one folder under tmp_path (as processes would)."""
+    from knowledge_base import DualKnowledgeBase
+
+    monkeypatch.chdir(tmp_path)
+    made = []
+
+    def make(**kwargs):
+        kwargs.setdefault("async_writes", False)
+        kb = DualKnowledgeBase(**kwargs)
+        kb.embeddings = HashEmbeddings()
+        kb._load_stores()
+        kb.initialized = True
+        made.append(kb)
+        return kb
+
+    yield make
+    # Store paths are relative: background rebuilds and compactions must finish before the next
+    # test moves to another folder, or they would write into it
+    for kb in made:
+        for thread in list(kb._rebuilds.values()):
+            thread.join()
+        kb.flush()
+
+
+def record(i):
+    return {"Question": f"case {i} " + " ".join(f"w{i}_{j}" for j in range(6)), "Answer": f"answer {i}",
+            "Summary of S4_final": f"summary {i}"}
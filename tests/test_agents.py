@@ -0,0 +1,59 @@
+import pytest
+
+from agents import MDTAgents
+
+CASE = "67M sudden left-sided weakness, onset 90 minutes ago"
+
+
+@pytest.fixture
+def agents(monkeypatch):
+    agents = MDTAgents("key", "http://127.0.0.1:9/v1", "text-model", "vl-model", enable_tools=True)
+    searches = []
+
+    def run_tools(query):
+        searches.append(query)
+        return f"results for {query}"
+
+    monkeypatch.setattr(agents.tools, "run_tools", run_tools)
+    agents.searches = searches
+    return agents
+
+
+def _plan(agents, role, query):
+    agents._remember(agents._planned_queries, (agents._case_key(CASE), role), query)
+
+
+def test_research_is_reused_within_a_consultation(agents):
+    _plan(agents, "Neurologist", "thrombolysis window")
+    shown = []
+    on_tool = lambda role, query, result: shown.append((role, query))
+
+    assert agents._research("Neurologist", CASE, on_tool) == "results for thrombolysis window"
+    assert agents._research("Neurologist", CASE, on_tool) == "results for thrombolysis window"
+    assert agents.searches == ["thrombolysis window"]
+    assert shown == [("Neurologist", "thrombolysis window")]
+
+
+def test_new_consultation_searches_again(agents):
+    _plan(agents, "Neurologist", "thrombolysis window")
+    agents._research("Neurologist", CASE)
+
+    agents.reset_consultation()
+    _plan(agents, "Neurologist", "tenecteplase dosing")
+    shown = []
+    result = agents._research("Neurologist", CASE, lambda role, query, res: shown.append(query))
+    assert result == "results for tenecteplase dosing"
+    assert agents.searches == ["thrombolysis window", "tenecteplase dosing"]
+    assert shown == ["tenecteplase dosing"]
+
+
+def test_memo_hit_replays_unshown_result(agents):
+    _plan(agents, "Neurologist", "thrombolysis window")
+    agents._research("Neurologist", CASE)          # no listener yet
+
+    shown = []
+    on_tool = lambda role, query, result: shown.append(query)
+    agents._research("Neurologist", CASE, on_tool)
+    agents._research("Neurologist", CASE, on_tool)
+    assert shown == ["thrombolysis window"]
+    assert agents.searches == ["thrombolysis window"]
@@ -0,0 +1,82 @@
+import json
+
+import batch_runner
+from batch_runner import BatchRunner, load_done_ids, load_unsaved_experiences, summarize
+
+
+class FakeFuture:
+    def __init__(self, error=None):
+        self.error = error
+
+    def result(self, timeout=None):
+        if self.error:
+            raise self.error
+
+
+class FakeKB:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.saved = []
+
+    def save_experiences(self, correct, reflection, correct_roles=None, reflection_roles=None):
+        if self.fail:
+            return [FakeFuture(RuntimeError("embeddings down"))]
+        self.saved.extend(r["Question"] for r in correct + reflection)
+        return [FakeFuture()]
+
+    def flush(self):
+        pass
+
+
+def _experience(i):
+    return {"store": "correct" if i % 2 else "cot", "roles": ["Neurologist"], "record": {"Question": f"case {i}"}}
+
+
+def _run(runner, tmp_path, monkeypatch, kb, results):
+    """Run `runner` over cases whose results are given, with the KB faked out."""
+    monkeypatch.setattr(batch_runner, "kb_system", kb)
+    for name in ("configure_index", "configure_retention", "configure_retrieval", "init_embeddings"):
+        monkeypatch.setattr(kb, name, lambda *a, **kw: None, raising=False)
+    by_id = {r["id"]: r for r in results}
+    monkeypatch.setattr(runner, "run_case", lambda item: dict(by_id[item["id"]]))
+    output = str(tmp_path / "results.jsonl")
+    runner.run([{"id": r["id"]} for r in results], output)
+    return output
+
+
+def _result(i):
+    return {"id": f"q{i}", "final_answer": "a", "rounds": 1, "latency_s": 1.0, "is_correct": bool(i % 2),
+            "experience": _experience(i)}
+
+
+def test_experiences_are_marked_saved_after_the_batch_lands(tmp_path, monkeypatch):
+    kb = FakeKB()
+    runner = BatchRunner({"api_key": "k", "base_url": "x"}, kb_batch_size=2)
+    output = _run(runner, tmp_path, monkeypatch, kb, [_result(i) for i in range(5)])
+
+    assert sorted(kb.saved) == [f"case {i}" for i in range(5)]
+    assert load_unsaved_experiences(output) == []
+    assert load_done_ids(output) == {f"q{i}" for i in range(5)}
+    assert summarize(output)["cases"] == 5
+
+
+def test_unsaved_experiences_are_saved_by_the_next_run(tmp_path, monkeypatch):
+    output = tmp_path / "results.jsonl"
+    # An earlier run crashed after writing two results but before their KB batch
+    with open(output, "w", encoding="utf-8") as f:
+        for i in range(2):
+            f.write(json.dumps(_result(i)) + "\n")
+        f.write(json.dumps({"kb_saved": ["q0"]}) + "\n")
+    assert [case_id for case_id, _ in load_unsaved_experiences(str(output))] == ["q1"]
+
+    kb = FakeKB()
+    runner = BatchRunner({"api_key": "k", "base_url": "x"}, kb_batch_size=16)
+    _run(runner, tmp_path, monkeypatch, kb, [_result(i) for i in range(3)])
+    assert sorted(kb.saved) == ["case 1", "case 2"]
+    assert load_unsaved_experiences(str(output)) == []
+
+
+def test_failed_kb_write_leaves_experiences_unsaved(tmp_path, monkeypatch):
+    runner = BatchRunner({"api_key": "k", "base_url": "x"}, kb_batch_size=2)
+    output = _run(runner, tmp_path, monkeypatch, FakeKB(fail=True), [_result(i) for i in range(2)])
+    assert len(load_unsaved_experiences(output)) == 2
@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import checkpoints
+from checkpoints import ConsultationRuns
+
+
+@pytest.fixture
+def runs(tmp_path):
+    return ConsultationRuns(str(tmp_path / "runs.sqlite"))
+
+
+def _set_owner(runs, thread_id, owner, heartbeat):
+    runs._conn.execute("UPDATE consultation_runs SET owner = ?, heartbeat = ? WHERE thread_id = ?",
+                       (owner, heartbeat, thread_id))
+    runs._conn.commit()
+    runs._active.discard(thread_id)
+
+
+def test_own_running_consultation_is_not_offered(runs):
+    runs.start("t1", "case one", 6)
+    assert runs.unfinished() == []
+    runs.finish("t1", "boom", resumable=True)
+    assert [r["thread_id"] for r in runs.unfinished()] == ["t1"]
+
+
+def test_run_of_a_dead_process_is_offered(runs):
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    runs.start("t1", "case one", 6)
+    _set_owner(runs, "t1", f"{checkpoints.socket.gethostname()}:{child.pid}", time.time())
+    assert [r["thread_id"] for r in runs.unfinished()] == ["t1"]
+
+
+def test_run_of_a_live_process_is_not_offered(runs):
+    runs.start("t1", "case one", 6)
+    _set_owner(runs, "t1", f"{checkpoints.socket.gethostname()}:{os.getppid()}", time.time())
+    assert runs.unfinished() == []
+
+
+def test_silent_owner_goes_stale(runs):
+    runs.start("t1", "case one", 6)
+    _set_owner(runs, "t1", "other-host:1234", time.time())
+    assert runs.unfinished() == []
+    _set_owner(runs, "t1", "other-host:1234", time.time() - runs.stale_after_s - 1)
+    assert [r["thread_id"] for r in runs.unfinished()] == ["t1"]
+
+
+def test_heartbeat_keeps_run_fresh(tmp_path):
+    runs = ConsultationRuns(str(tmp_path / "runs.sqlite"), heartbeat_s=0.05)
+    runs.start("t1", "case one", 6)
+    first = runs.get("t1")["heartbeat"]
+    time.sleep(0.3)
+    assert runs.get("t1")["heartbeat"] > first
+
+
+
+def test_resume_claim_is_exclusive(tmp_path):
+    path = str(tmp_path / "runs.sqlite")
+    runs = ConsultationRuns(path)
+    runs.start("t1", "case one", 6)
+    assert not runs.start("t1")
+    runs.finish("t1", "boom", resumable=True)
+    assert runs.start("t1")
+    assert not runs.start("t1")
+    # Another process sharing the database sees the live claim too
+    assert not ConsultationRuns(path).start("t1")
+    assert not runs.start("unknown")
+
+
+def test_concurrent_claims_have_one_winner(tmp_path):
+    path = str(tmp_path / "runs.sqlite")
+    runs = ConsultationRuns(path)
+    runs.start("t1", "case one", 6)
+    runs.finish("t1", "boom", resumable=True)
+    claimants = [ConsultationRuns(path) for _ in range(8)]
+    barrier = threading.Barrier(len(claimants))
+    won = []
+
+    def claim(r):
+        barrier.wait()
+        won.append(r.start("t1"))
+
+    threads = [threading.Thread(target=claim, args=(r,)) for r in claimants]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(won) == [False] * 7 + [True]
+
+
+def test_stale_run_can_be_claimed(runs):
+    runs.start("t1", "case one", 6)
+    _set_owner(runs, "t1", "other-host:1234", time.time())
+    assert not runs.start("t1")
+    _set_owner(runs, "t1", "other-host:1234", time.time() - runs.stale_after_s - 1)
+    assert runs.start("t1")
@@ -0,0 +1,60 @@
+import json
+
+from convergence import ConvergenceDetector, CONVERGED, REVIEW, STALLED
+from conftest import HashEmbeddings
+
+
+def _bullet(integration, conflict=""):
+    return json.dumps({"Consistency": "", "Conflict": conflict, "Independence": "", "Integration": integration})
+
+
+SAME = "ischemic stroke in the left middle cerebral artery territory"
+DIVERGED = "STATUS: DIVERGED\nREASON: Open conflicts remain.\nFINAL_ANSWER: Continuing discussion"
+
+
+def test_first_round_goes_to_reviewer():
+    check = ConvergenceDetector().assess([_bullet(SAME)], HashEmbeddings())
+    assert check["decision"] == REVIEW
+
+
+def test_stable_summary_without_conflict_converges():
+    check = ConvergenceDetector().assess([_bullet(SAME), _bullet(SAME, "None")], HashEmbeddings())
+    assert check["decision"] == CONVERGED
+    assert check["conflict_empty"] is True
+
+
+def test_stable_summary_with_conflict_stalls():
+    bullets = [_bullet(SAME), _bullet(SAME, "Neurology favours thrombolysis, Cardiology does not")]
+    check = ConvergenceDetector().assess(bullets, HashEmbeddings())
+    assert check["decision"] == STALLED
+    assert check["conflict_empty"] is False
+
+
+def test_changed_summary_goes_to_reviewer():
+    bullets = [_bullet(SAME), _bullet("hemorrhagic transformation after anticoagulation")]
+    assert ConvergenceDetector().assess(bullets, HashEmbeddings())["decision"] == REVIEW
+
+
+def test_no_embeddings_goes_to_reviewer():
+    assert ConvergenceDetector().assess([_bullet(SAME), _bullet(SAME)], None)["decision"] == REVIEW
+
+
+def test_stalled_never_overrides_diverged():
+    detector = ConvergenceDetector()
+    bullet = _bullet(SAME, "Dose of alteplase disputed")
+    check = {"decision": STALLED, "similarity": 0.99, "conflict_empty": False}
+    assert detector.resolve(check, DIVERGED, bullet) == (False, "Continuing discussion")
+
+
+def test_stalled_settles_inconclusive_review():
+    detector = ConvergenceDetector()
+    check = {"decision": STALLED, "similarity": 0.99, "conflict_empty": False}
+    assert detector.resolve(check, "REASON: unsure", _bullet(SAME, "minor")) == (True, SAME)
+
+
+def test_reviewer_verdict_stands_without_stall():
+    detector = ConvergenceDetector()
+    check = {"decision": REVIEW, "similarity": 0.5, "conflict_empty": True}
+    assert detector.resolve(check, DIVERGED, _bullet(SAME)) == (False, "Continuing discussion")
+    review = "STATUS: CONVERGED\nREASON: ok\nFINAL_ANSWER: stroke"
+    assert detector.resolve(check, review, _bullet(SAME)) == (True, "stroke")
@@ -0,0 +1,42 @@
+import base64
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from image_pipeline import EXIF_ORIENTATION, ImagePipeline
+
+
+def _jpeg(size, orientation=None):
+    img = Image.new("RGB", size, (200, 30, 30))
+    exif = Image.Exif()
+    if orientation:
+        exif[EXIF_ORIENTATION] = orientation
+    out = io.BytesIO()
+    img.save(out, format="JPEG", exif=exif.tobytes())
+    return base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def _decoded(prepared):
+    return Image.open(io.BytesIO(base64.b64decode(prepared.data_b64)))
+
+
+def test_exif_rotation_is_applied_before_resizing():
+    # Stored landscape, displayed portrait (rotate 90 degrees clockwise)
+    prepared = ImagePipeline(max_side=200).prepare(_jpeg((400, 300), orientation=6))
+    assert prepared.dimensions == (150, 200)
+    img = _decoded(prepared)
+    assert img.size == (150, 200)
+    assert img.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+
+def test_small_rotated_image_is_still_reencoded():
+    prepared = ImagePipeline(max_side=1024).prepare(_jpeg((40, 30), orientation=6))
+    assert _decoded(prepared).size == (30, 40)
+
+
+def test_upright_image_is_only_downsized():
+    prepared = ImagePipeline(max_side=200).prepare(_jpeg((400, 300)))
+    assert prepared.dimensions == (200, 150)
+    assert prepared.mime == "image/jpeg"
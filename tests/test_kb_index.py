@@ -0,0 +1,37 @@
+import faiss
+import numpy as np
+import pytest
+
+from kb_index import build_index, extract_vectors, index_kind, refill
+
+
+def _vectors(n=800, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+@pytest.mark.parametrize("kind", ["hnsw", "ivf", "ivfpq"])
+def test_refill_keeps_kind_and_contents(kind):
+    vectors = _vectors()
+    index = build_index(kind, vectors)
+    survivors = extract_vectors(index)[::2]
+    refilled = refill(index, survivors)
+    assert index_kind(refilled) == kind
+    assert refilled.ntotal == len(survivors)
+    assert index.ntotal == len(vectors)          # the original is left untouched for searches
+
+
+def test_repeated_refills_do_not_degrade_ivfpq():
+    vectors = _vectors()
+    index = build_index("ivfpq", vectors)
+    error = lambda ix: float(np.linalg.norm(extract_vectors(ix) - vectors, axis=1).mean())
+    first = error(index)
+    for _ in range(4):
+        index = refill(index, extract_vectors(index))
+    assert error(index) <= first * 1.01
+
+
+def test_refill_reuses_the_trained_quantizer():
+    index = build_index("ivf", _vectors())
+    refilled = refill(index, extract_vectors(index)[:100])
+    centroids = lambda ix: faiss.downcast_index(ix.quantizer).reconstruct_n(0, ix.nlist)
+    assert np.array_equal(centroids(index), centroids(refilled))
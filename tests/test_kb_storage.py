@@ -0,0 +1,56 @@
+import json
+
+from kb_storage import SegmentLog, read_snapshot_seq
+from conftest import record
+
+
+def _entry(seq):
+    return {"op": "add", "seq": seq, "id": f"doc{seq}"}
+
+
+def test_append_after_torn_line_keeps_new_entries(tmp_path):
+    log = SegmentLog(str(tmp_path / "store.wal"))
+    log.append([_entry(1), _entry(2)])
+    # Crash halfway through writing entry 3: no trailing newline
+    with open(log.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(_entry(3))[:20])
+
+    assert [e["seq"] for e in log.read()] == [1, 2]
+    log.append([_entry(3), _entry(4)])
+    assert [e["seq"] for e in log.read()] == [1, 2, 3, 4]
+    assert [e["seq"] for e in log.read(after_seq=2)] == [3, 4]
+
+
+def test_append_after_torn_only_line(tmp_path):
+    log = SegmentLog(str(tmp_path / "store.wal"))
+    with open(log.path, "w", encoding="utf-8") as f:
+        f.write('{"op": "ad')
+    log.append([_entry(1)])
+    assert [e["seq"] for e in log.read()] == [1]
+
+
+def test_drop_through_skips_torn_line(tmp_path):
+    log = SegmentLog(str(tmp_path / "store.wal"))
+    log.append([_entry(1), _entry(2), _entry(3)])
+    with open(log.path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 4, "op"')
+    log.drop_through(2)
+    assert [e["seq"] for e in log.read()] == [3]
+
+
+def test_store_recovers_after_crash_mid_append(make_kb):
+    kb = make_kb(compact_every=1000)
+    for i in range(3):
+        kb.save_correct_experience(record(i))
+    with open(kb._logs["correct"].path, "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "seq": 4, "vec')
+
+    # A fresh process replays the complete entries and keeps writing after them
+    restarted = make_kb(compact_every=1000)
+    assert restarted.correct_store.index.ntotal == 3
+    restarted.save_correct_experience(record(3))
+    assert make_kb().correct_store.index.ntotal == 4
+
+    restarted.compact("correct")
+    assert read_snapshot_seq("knowledge_bases/correct_kb") == restarted._seq["correct"]
+    assert make_kb().correct_store.index.ntotal == 4
@@ -0,0 +1,300 @@
+import time
+
+from kb_index import index_kind
+from conftest import record
+
+
+def test_rebuilt_index_survives_reload(make_kb):
+    kb = make_kb(index_type="flat", compact_every=4)
+    for i in range(10):
+        kb.save_correct_experience(record(i))
+    kb.compact("correct")
+
+    assert kb.rebuild_index("correct", "hnsw") == "hnsw"
+
+    reloaded = make_kb(index_type="flat")
+    assert index_kind(reloaded.correct_store.index) == "hnsw"
+    assert reloaded.correct_store.index.ntotal == 10
+
+
+def test_rebuild_reaches_other_processes(make_kb):
+    writer = make_kb(index_type="flat", compact_every=4)
+    reader = make_kb(index_type="flat")
+    for i in range(6):
+        writer.save_correct_experience(record(i))
+    writer.compact("correct")
+    reader.refresh()
+    assert index_kind(reader.correct_store.index) == "flat"
+
+    writer.rebuild_index("correct", "hnsw")
+    reader.refresh()
+    assert index_kind(reader.correct_store.index) == "hnsw"
+    assert reader.correct_store.index.ntotal == 6
+
+
+def test_compaction_keeps_logged_inserts(make_kb):
+    kb = make_kb(index_type="flat", compact_every=1000)
+    for i in range(5):
+        kb.save_correct_experience(record(i))
+    # Nothing compacted yet: a second instance replays the log
+    assert make_kb().correct_store.index.ntotal == 5
+    kb.compact("correct")
+    assert kb._logs["correct"].read() == []
+    assert make_kb().correct_store.index.ntotal == 5
+
+
+def test_async_save_reports_written(make_kb):
+    from knowledge_base import write_status
+
+    kb = make_kb(async_writes=True)
+    assert write_status(kb.save_correct_experience(record(0))) == "saved"
+    assert kb.correct_store.index.ntotal == 1
+    assert kb.writer_stats() == {"queued": 0, "failures": 0}
+    kb.flush()
+
+
+def test_async_save_failure_is_reported(make_kb):
+    from knowledge_base import write_status
+
+    kb = make_kb(async_writes=True)
+
+    def broken(texts):
+        raise RuntimeError("embedding endpoint down")
+
+    kb.embeddings.embed_documents = broken
+    assert write_status(kb.save_reflection_experience(record(0))) == "failed: embedding endpoint down"
+    assert kb.writer_stats()["failures"] == 1
+    kb.flush()
+
+
+WRITER = """
+import os
+import sys
+sys.path[:0] = [{repo!r}, {tests!r}]
+from conftest import HashEmbeddings, record
+os.chdir({cwd!r})     # conftest moved us into a scratch folder
+from knowledge_base import DualKnowledgeBase
+
+kb = DualKnowledgeBase(async_writes=False, compact_every=5)
+kb.embeddings = HashEmbeddings()
+kb._load_stores()
+kb.initialized = True
+for i in range({start}, {start} + {count}):
+    kb.save_correct_experience(record(i))
+kb.flush()
+"""
+
+
+def test_concurrent_writer_processes_lose_nothing(make_kb, tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    tests = os.path.dirname(os.path.abspath(__file__))
+    procs = [subprocess.Popen([sys.executable, "-c", WRITER.format(repo=os.path.dirname(tests), tests=tests,
+                                                                   cwd=str(tmp_path), start=w * 100, count=12)])
+             for w in range(3)]
+    assert [p.wait(timeout=120) for p in procs] == [0, 0, 0]
+
+    kb = make_kb()
+    assert kb.correct_store.index.ntotal == 36
+    snippets = {kb.correct_store.docstore.search(i).metadata["case_snippet"]
+                for i in kb.correct_store.index_to_docstore_id.values()}
+    assert len(snippets) == 36
+
+
+def _write_corpus(path, count, offset=1000):
+    import json
+
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(offset, offset + count):
+            f.write(json.dumps(record(i)) + "\n")
+    return str(path)
+
+
+def test_bulk_ingest_survives_a_concurrent_writer(make_kb, tmp_path):
+    ingester = make_kb(index_type="flat")
+    other = make_kb(index_type="flat")
+    corpus = _write_corpus(tmp_path / "corpus.jsonl", 50)
+
+    ingest_batch = ingester._ingest_batch
+    batches = []
+
+    def ingest_and_interleave(name, docs, vectors):
+        added = ingest_batch(name, docs, vectors)
+        batches.append(added)
+        if len(batches) == 1:
+            # Another process saves and compacts while the ingest is still running
+            other.save_correct_experience(record(0))
+            other.compact("correct")
+        return added
+
+    ingester._ingest_batch = ingest_and_interleave
+    result = ingester.bulk_ingest(corpus, batch_size=10, workers=1)
+
+    assert result["records"] == 50 and len(batches) == 5
+    assert ingester.correct_store.index.ntotal == 51
+    assert make_kb().correct_store.index.ntotal == 51
+
+
+def test_bulk_ingest_is_logged_before_compaction(make_kb, tmp_path):
+    kb = make_kb(index_type="flat")
+    corpus = _write_corpus(tmp_path / "corpus.jsonl", 30)
+    kb.bulk_ingest(corpus, batch_size=10, workers=2, compact_every=10)
+    reloaded = make_kb()
+    assert reloaded.correct_store.index.ntotal == 30
+    pinned = [reloaded.correct_store.docstore.search(i).metadata.get("pinned")
+              for i in reloaded.correct_store.index_to_docstore_id.values()]
+    assert all(pinned)
+
+
+def _snippets(kb, name="correct"):
+    store = getattr(kb, f"{name}_store")
+    deleted = kb._deleted[name]
+    return {store.docstore.search(i).metadata["case_snippet"]
+            for i in store.index_to_docstore_id.values() if i not in deleted}
+
+
+def test_pinned_corpus_does_not_count_against_the_cap(make_kb, tmp_path):
+    kb = make_kb(index_type="flat", max_docs=20)
+    kb.bulk_ingest(_write_corpus(tmp_path / "corpus.jsonl", 30), batch_size=10)
+    for i in range(3):
+        kb.save_correct_experience(record(i))
+
+    learned = {record(i)["Question"][:50] for i in range(3)}
+    assert learned <= _snippets(kb)
+    assert len(_snippets(kb)) == 33
+
+
+def test_eviction_keeps_the_most_used_learned_documents(make_kb, tmp_path):
+    kb = make_kb(index_type="flat", max_docs=20, compact_every=1000)
+    kb.bulk_ingest(_write_corpus(tmp_path / "corpus.jsonl", 5), batch_size=5)
+    for i in range(20):
+        kb.save_correct_experience(record(i))
+    popular = record(3)["Question"]
+    for _ in range(3):
+        kb.retrieve_context_details(popular, k=1)
+    for i in range(20, 25):
+        kb.save_correct_experience(record(i))
+
+    live = _snippets(kb)
+    assert popular[:50] in live
+    assert record(24)["Question"][:50] in live
+    assert {record(i)["Question"][:50] for i in range(1000, 1005)} <= live
+    assert len(live) - 5 <= 20
+
+
+def test_purge_keeps_approximate_index_searchable(make_kb):
+    kb = make_kb(index_type="hnsw", max_docs=10, compact_every=1000)
+    for i in range(10):
+        kb.save_correct_experience(record(i))
+    kb.rebuild_index("correct", "hnsw")
+    for i in range(10, 14):
+        kb.save_correct_experience(record(i))     # over the cap: the least useful are tombstoned
+    assert kb._deleted["correct"]
+    kb.compact("correct")
+
+    assert not kb._deleted["correct"]
+    assert index_kind(kb.correct_store.index) == "hnsw"
+    live = kb.correct_store.index.ntotal
+    assert live == len(kb.correct_store.index_to_docstore_id) <= 10
+    latest = record(13)["Question"]
+    assert kb.retrieve_context_details(latest, k=1)["docs"][0].metadata["case_snippet"] == latest[:50]
+    assert make_kb().correct_store.index.ntotal == live
+
+
+def test_dead_embedding_endpoint_is_waited_for_once(make_kb):
+    kb = make_kb(index_type="flat")
+    for i in range(4):
+        kb.save_correct_experience(record(i), ["Cardiologist"])
+    kb.configure_retrieval("hybrid", embed_timeout=0.2)
+    calls = []
+
+    def hanging(text):
+        calls.append(text)
+        time.sleep(1)
+        return kb.embeddings.embed_documents([text])[0]
+
+    kb.embeddings.embed_query = hanging
+    case = record(2)["Question"]
+    details = kb.retrieve_context_details(case, k=1)
+    # Lexical retrieval still finds the case
+    assert details["query_vec"] is None
+    assert details["docs"][0].metadata["case_snippet"] == case[:50]
+
+    started = time.perf_counter()
+    kb.retrieve_for_roles(case, ["Cardiologist"], fallback=details["docs"], query_vec=details["query_vec"])
+    kb.retrieve_context_details(case, k=1)
+    assert time.perf_counter() - started < 0.1
+    assert len(calls) == 1
+
+
+def test_role_retrieval_searches_each_roles_experiences(make_kb):
+    kb = make_kb(index_type="flat")
+    for i in range(8):
+        kb.save_correct_experience(record(i), ["Cardiologist"] if i < 4 else ["Neurologist"])
+    kb.save_correct_experience(record(8))       # untagged: only reachable through the fallback
+    neuro_case = record(5)["Question"]
+    fallback = kb.retrieve_context_details(record(8)["Question"], k=1)["docs"]
+
+    found = kb.retrieve_for_roles(neuro_case, ["Neurologist", "Cardiologist", "Radiologist"], k=1,
+                                  fallback=fallback)
+
+    assert found["Neurologist"][0].metadata["case_snippet"] == neuro_case[:50]
+    assert found["Cardiologist"][0].metadata["roles"] == ["cardiologist"]
+    # A role without tagged experiences gets the case-level hits
+    assert [d.id for d in found["Radiologist"]] == [d.id for d in fallback]
+    assert kb.stats()["correct"]["roles"] == {"cardiologist": 4, "neurologist": 4}
+
+
+def test_near_duplicate_is_skipped(make_kb):
+    kb = make_kb(index_type="flat")
+    kb.save_correct_experience(record(0))
+    kb.save_correct_experience(record(0))
+    kb.save_correct_experience(record(1))
+
+    assert kb.stats()["correct"]["documents"] == 2
+    assert sorted(d for _, d, _ in kb.usage.all("correct").values()) == [1]
+
+
+def test_near_duplicate_merge_keeps_usage(make_kb):
+    kb = make_kb(index_type="flat", dedup_similarity=0.8, dedup_policy="merge")
+    kb.save_correct_experience(record(0))
+    kb.save_correct_experience(record(1))
+    case = record(0)["Question"]
+    old_id = kb.retrieve_context_details(case, k=1)["docs"][0].id
+
+    kb.save_correct_experience({**record(0), "Answer": "answer 0 revised"})
+
+    assert kb.stats()["correct"]["documents"] == 2
+    merged = kb.retrieve_context_details(case, k=1)["docs"][0]
+    assert merged.id != old_id and "revised" in merged.page_content
+    usage = kb.usage.all("correct")
+    assert old_id not in usage
+    hits, duplicates, _ = usage[merged.id]
+    assert (hits, duplicates) == (2, 1)     # the hit before the merge, the one above, and the merge itself
+
+
+def test_hybrid_retrieval_fuses_vector_and_bm25(make_kb):
+    kb = make_kb(index_type="flat")
+    for i in range(6):
+        kb.save_correct_experience(record(i))
+    vector_target = kb._correct_doc(record(1)).page_content
+    # The query's words match record 4, while its embedding points at record 1
+    kb.embeddings.embed_query = lambda text: kb.embeddings.embed_documents([vector_target])[0]
+    query = " ".join(f"w4_{j}" for j in range(6))
+
+    def top(mode, k):
+        kb.configure_retrieval(mode)
+        return [d.metadata["case_snippet"][:6] for d in kb.retrieve_context_details(query, k=k)["docs"]]
+
+    assert top("vector", 1) == ["case 1"]
+    assert top("lexical", 1) == ["case 4"]
+    assert sorted(top("hybrid", 2)) == ["case 1", "case 4"]
+
+    def down(text):
+        raise RuntimeError("embedding endpoint down")
+
+    kb.embeddings.embed_query = down
+    # Without a query vector hybrid retrieval falls back to BM25 alone
+    assert top("hybrid", 1) == ["case 4"]
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from llm_scheduler import (LLMScheduler, TokenBucket, _PrioritySlots, PRIORITY_BACKGROUND, PRIORITY_CRITICAL,
+                           PRIORITY_NORMAL)
+
+
+def _rate_limited(retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://llm.test/v1"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    for _ in range(100):
+        bucket.take(10_000)
+    assert bucket.wait_time(10_000) == 0.0
+
+
+def test_bucket_waits_once_the_burst_is_spent():
+    bucket = TokenBucket(60)          # one per second, burst of 60
+    for _ in range(60):
+        assert bucket.wait_time(1) == 0.0
+        bucket.take(1)
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.wait_time(2) == pytest.approx(2.0, abs=0.05)
+
+
+def test_bucket_refund_shortens_the_wait():
+    bucket = TokenBucket(600)
+    bucket.take(600)
+    assert bucket.wait_time(100) == pytest.approx(10.0, abs=0.1)
+    bucket.adjust(100)
+    assert bucket.wait_time(100) == pytest.approx(0.0, abs=0.05)
+
+
+def _run_in_order(scheduler, priorities, fn):
+    """Start one scheduled call per priority, in the given order, and return the order they ran in."""
+    ran = []
+    threads = []
+    for priority in priorities:
+        threads.append(threading.Thread(target=scheduler.run, args=(lambda p=priority: ran.append(p) or fn(),),
+                                        kwargs={"priority": priority}))
+        threads[-1].start()
+        time.sleep(0.05)              # queue them in a known order
+    for t in threads:
+        t.join(timeout=10)
+    return ran
+
+
+def test_rate_limited_calls_are_admitted_by_priority():
+    scheduler = LLMScheduler(rpm=120)         # one call per 0.5 s once the burst is spent
+    scheduler.requests.take(120)
+    order = _run_in_order(scheduler, [PRIORITY_BACKGROUND, PRIORITY_NORMAL, PRIORITY_CRITICAL], lambda: None)
+    assert order == [PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BACKGROUND]
+
+
+def test_throttled_call_does_not_hold_a_slot():
+    scheduler = LLMScheduler(tpm=600, max_concurrency=1)
+    scheduler.tokens.take(600)
+    waiting = threading.Thread(target=scheduler.run, args=(lambda: None,),
+                               kwargs={"priority": PRIORITY_BACKGROUND, "est_tokens": 30})
+    waiting.start()
+    time.sleep(0.5)                           # needs 3 s worth of tokens
+    assert waiting.is_alive()
+    assert scheduler.slots.free == 1
+    waiting.join(timeout=10)
+
+
+def test_free_slot_goes_to_the_most_urgent_waiter():
+    slots = _PrioritySlots(1)
+    slots.acquire(PRIORITY_NORMAL)
+    order = []
+
+    def waiter(priority):
+        slots.acquire(priority)
+        order.append(priority)
+        slots.release()
+
+    threads = []
+    for priority in (PRIORITY_BACKGROUND, PRIORITY_NORMAL, PRIORITY_CRITICAL):
+        threads.append(threading.Thread(target=waiter, args=(priority,)))
+        threads[-1].start()
+        time.sleep(0.05)              # queue them in a known order
+    slots.release()
+    for t in threads:
+        t.join(timeout=5)
+    assert order == [PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BACKGROUND]
+
+
+def test_rate_limit_is_retried_after_retry_after():
+    scheduler = LLMScheduler(max_retries=3)
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise _rate_limited(retry_after=0.1)
+        return "ok"
+
+    assert scheduler.run(fn) == "ok"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.1
+    assert scheduler.stats["rate_limited"] == 2 and scheduler.stats["retries"] == 2
+    assert scheduler.stats["failed"] == 0
+
+
+def test_rate_limit_pauses_other_callers():
+    scheduler = LLMScheduler(max_retries=1)
+    hit = threading.Event()
+
+    def limited():
+        hit.set()
+        raise _rate_limited(retry_after=0.3)
+
+    worker = threading.Thread(target=lambda: pytest.raises(openai.RateLimitError, scheduler.run, limited,
+                                                           can_retry=lambda: False))
+    worker.start()
+    hit.wait(timeout=5)
+    worker.join(timeout=5)
+    started = time.monotonic()
+    assert scheduler.run(lambda: "ok") == "ok"
+    assert time.monotonic() - started >= 0.2
+
+
+def test_retries_stop_when_caller_cannot_retry():
+    scheduler = LLMScheduler(max_retries=5)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise _rate_limited(retry_after=0)
+
+    with pytest.raises(openai.RateLimitError):
+        scheduler.run(fn, can_retry=lambda: False)
+    assert len(calls) == 1
+    assert scheduler.stats["failed"] == 1
+
+
+def test_non_retryable_errors_propagate_at_once():
+    scheduler = LLMScheduler(max_retries=5)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        scheduler.run(fn)
+    assert len(calls) == 1
@@ -0,0 +1,68 @@
+import threading
+
+import tools
+from tools import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def _open_breaker(monkeypatch, threshold=3, cooldown=60):
+    clock = Clock()
+    monkeypatch.setattr(tools.time, "time", clock.time)
+    breaker = CircuitBreaker(threshold, cooldown)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+    return breaker, clock
+
+
+def test_opens_after_threshold(monkeypatch):
+    breaker, clock = _open_breaker(monkeypatch)
+    assert not breaker.allow()
+    clock.now += 59
+    assert not breaker.allow()
+
+
+def test_half_open_lets_one_concurrent_probe_through(monkeypatch):
+    breaker, clock = _open_breaker(monkeypatch)
+    clock.now += 60
+    allowed = []
+    barrier = threading.Barrier(8)
+
+    def call():
+        barrier.wait()
+        allowed.append(breaker.allow())
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert allowed.count(True) == 1
+
+
+def test_successful_probe_closes(monkeypatch):
+    breaker, clock = _open_breaker(monkeypatch)
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_for_a_full_cooldown(monkeypatch):
+    breaker, clock = _open_breaker(monkeypatch)
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert not breaker.allow()
@@ -0,0 +1,103 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = "cache"
+TOOL_CACHE_PATH = os.path.join(CACHE_DIR, "tool_cache.sqlite")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation/quotes and collapse whitespace so near-identical queries share a key."""
+    query = re.sub(r"[^\w\s\-+/]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class ToolCache:
+    """
+    On-disk (SQLite) cache for external tool results, keyed by (tool name, normalized query).
+    Entries older than `ttl` seconds are treated as misses; above `max_entries` the least
+    recently used rows are evicted.
+    """
+
+    def __init__(self, path=TOOL_CACHE_PATH, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS tool_results (
+                   tool TEXT NOT NULL,
+                   query TEXT NOT NULL,
+                   result TEXT NOT NULL,
+                   created REAL NOT NULL,
+                   accessed REAL NOT NULL,
+                   PRIMARY KEY (tool, query)
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tool_results_accessed ON tool_results(accessed)")
+        self._conn.commit()
+
+    def get(self, tool_name: str, query: str):
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created FROM tool_results WHERE tool = ? AND query = ?", (tool_name, key)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                if row is not None:
+                    self._conn.execute("DELETE FROM tool_results WHERE tool = ? AND query = ?", (tool_name, key))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE tool_results SET accessed = ? WHERE tool = ? AND query = ?", (now, tool_name, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, tool_name: str, query: str, result: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tool_results (tool, query, result, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (tool_name, normalize_query(query), result, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM tool_results").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                """DELETE FROM tool_results WHERE rowid IN (
+                       SELECT rowid FROM tool_results ORDER BY accessed ASC LIMIT ?
+                   )""",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM tool_results")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM tool_results").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries
+        }
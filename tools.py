@@ -1,5 +1,9 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_core.tools import Tool
+from tool_cache import ToolCache
 
 try:
     from langchain_community.tools import PubMedQueryRun
@@ -9,14 +13,73 @@ except ImportError:
     PubMedAPIWrapper = None
 
 
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls until `cooldown` seconds pass.
+    Then exactly one trial call goes through (half-open): its success closes the breaker, its
+    failure re-opens it for another cool-down.
+    """
+
+    def __init__(self, threshold=3, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.time() - self.opened_at < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.time()
+                self.probing = False
+
+
+def _timed_run(tool, query):
+    """(result, error, seconds) so failures are timed too."""
+    started = time.perf_counter()
+    try:
+        return tool.run(query), None, time.perf_counter() - started
+    except Exception as e:
+        return None, e, time.perf_counter() - started
+
+
 class MedicalTools:
-    def __init__(self, enable=True):
+    def __init__(self, enable=True, cache_only=False, cache_ttl_hours=168, cache_max_entries=5000,
+                 timeout=8.0, breaker_threshold=3, breaker_cooldown=60):
         self.enable = enable
+        self.cache_only = cache_only
+        self.timeout = timeout
         self.tools = []
+        self.cache = None
+        self.breakers = {}
+        self._executor = None
+        self.telemetry = None
 
         if not enable:
             return
 
+        try:
+            self.cache = ToolCache(ttl=cache_ttl_hours * 3600, max_entries=cache_max_entries)
+        except Exception as e:
+            print(f"Tool cache init failed: {e}")
+
         # 1. Web Search
         try:
             self.search = DuckDuckGoSearchRun()
@@ -44,16 +107,62 @@ class MedicalTools:
             except Exception as e:
                 print(f"PubMed init failed: {e}")
 
+        self.breakers = {t.name: CircuitBreaker(breaker_threshold, breaker_cooldown) for t in self.tools}
+        # Sized for a full round of specialists querying every tool at once
+        self._executor = ThreadPoolExecutor(max_workers=max(4, len(self.tools) * 6), thread_name_prefix="tool")
+
     def run_tools(self, query: str):
-        """Execute tools and return combined string result"""
+        """Execute tools concurrently and return combined string result.
+
+        Each tool gets `self.timeout` seconds; slow or failing tools are reported and
+        skipped so the caller is bounded by the deadline, not by the slowest service.
+        """
         if not self.enable or not self.tools:
             return ""
 
-        results = []
+        results = {}
+        pending = {}
         for tool in self.tools:
-            try:
-                res = tool.run(query)
-                results.append(f"--- {tool.name} Result ---\n{res[:600]}...")
-            except Exception as e:
-                results.append(f"Error running {tool.name}: {e}")
-        return "\n".join(results)
\ No newline at end of file
+            res = self.cache.get(tool.name, query) if self.cache else None
+            if res is not None:
+                results[tool.name] = f"--- {tool.name} Result ---\n{res[:600]}..."
+                self._record(tool.name, 0.0, "cached")
+            # Cache-only mode (benchmarks / offline runs) never touches the network
+            elif self.cache_only:
+                continue
+            elif not self.breakers[tool.name].allow():
+                results[tool.name] = f"Skipped {tool.name}: temporarily disabled after repeated failures."
+                self._record(tool.name, 0.0, "skipped")
+            else:
+                pending[self._executor.submit(_timed_run, tool, query)] = tool
+
+        done, not_done = wait(pending, timeout=self.timeout)
+        for future in done:
+            tool = pending[future]
+            res, error, elapsed = future.result()
+            if error is not None:
+                self.breakers[tool.name].record_failure()
+                results[tool.name] = f"Error running {tool.name}: {error}"
+                self._record(tool.name, elapsed, "error", error=str(error))
+                continue
+            self.breakers[tool.name].record_success()
+            if self.cache:
+                self.cache.put(tool.name, query, res)
+            results[tool.name] = f"--- {tool.name} Result ---\n{res[:600]}..."
+            self._record(tool.name, elapsed, "ok")
+        for future in not_done:
+            # The worker keeps running in the background; its result is dropped
+            tool = pending[future]
+            future.cancel()
+            self.breakers[tool.name].record_failure()
+            results[tool.name] = f"Timeout running {tool.name} (>{self.timeout}s)."
+            self._record(tool.name, self.timeout, "timeout", error="timeout")
+
+        return "\n".join(results[t.name] for t in self.tools if t.name in results)
+
+    def _record(self, tool_name, wall_s, status, error=None):
+        if self.telemetry:
+            self.telemetry.record("tool", wall_s, tool=tool_name, status=status, error=error)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache else {}
\ No newline at end of file
@@ -8,7 +8,35 @@ DEFAULT_CONFIG = {
     "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
     "text_model": "qwen-plus",
     "vl_model": "qwen-vl-plus",
-    "enable_tools": True
+    "enable_tools": True,
+    "parallel_specialists": True,
+    "tool_cache_only": False,
+    "tool_cache_ttl_hours": 168,
+    "tool_timeout": 8.0,
+    "kb_index_type": "hnsw",
+    "kb_promote_at": 20000,
+    "kb_max_docs": 50000,
+    "kb_dedup_similarity": 0.97,
+    "kb_dedup_policy": "skip",
+    "kb_retrieval_mode": "hybrid",
+    "kb_embed_timeout": 5.0,
+    "llm_cache_mode": "deterministic",
+    "context_kb_tokens": 600,
+    "context_round_tokens": 350,
+    "context_role_kb_tokens": 300,
+    "kb_role_k": 1,
+    "convergence_skip_similarity": 0.95,
+    "convergence_stall_similarity": 0.985,
+    "image_max_side": 1024,
+    "image_quality": 85,
+    "shared_image_findings": False,
+    "ui_fps": 8,
+    "ui_flush_chars": 400,
+    "llm_rpm": 0,
+    "llm_tpm": 0,
+    "llm_max_concurrency": 8,
+    "llm_max_retries": 4,
+    "checkpointing": True
 }
 
 def load_config():
@@ -1,7 +1,12 @@
-from typing import TypedDict, List, Annotated, Any
+from typing import TypedDict, List, Dict, Annotated, Any
+import contextvars
 import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langgraph.graph import StateGraph, END
 from knowledge_base import kb_system
+from context_builder import ContextBuilder, count_tokens
+from convergence import ConvergenceDetector, CONVERGED
 
 
 class MDTState(TypedDict):
@@ -21,17 +26,67 @@ class MDTState(TypedDict):
 
     kb_context_text: str
     kb_context_docs: Any
+    role_kb_docs: Dict[str, Any]
 
+    timings: Dict[str, float]
+    telemetry: Annotated[List[dict], operator.add]
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
 
-def create_workflow(agents_instance):
-    def node_triage(state: MDTState):
-        kb_system.init_embeddings(
-            api_key=agents_instance.llm.openai_api_key,
-            base_url=agents_instance.llm.openai_api_base
-        )
 
-        retrieval_result = kb_system.retrieve_context_details(state["case_info"])
-        triage_result = agents_instance.primary_care_doctor(state["case_info"])
+def create_workflow(agents_instance, context_builder=None, convergence=None, checkpointer=None, role_kb_k=1):
+    telemetry = agents_instance.telemetry
+    context_builder = context_builder or ContextBuilder()
+    convergence = convergence or ConvergenceDetector()
+
+    def instrumented(span_name):
+        """Time a node and attach the spans recorded while it ran to the state."""
+        def decorator(node):
+            def wrapper(state: MDTState):
+                mark = telemetry.mark()
+                with telemetry.span(span_name, round=state.get("current_round")):
+                    update = node(state)
+                return {**update, "telemetry": telemetry.since(mark)}
+            wrapper.__name__ = node.__name__
+            return wrapper
+        return decorator
+
+    @instrumented("node.triage")
+    def node_triage(state: MDTState):
+        def retrieve():
+            with telemetry.span("kb.retrieve"):
+                kb_system.init_embeddings(
+                    api_key=agents_instance.llm.openai_api_key,
+                    base_url=agents_instance.llm.openai_api_base,
+                    http_client=agents_instance.http_client
+                )
+                return kb_system.retrieve_context_details(state["case_info"])
+
+        def triage():
+            triage_result = agents_instance.primary_care_doctor(state["case_info"])
+            # One batched call plans every specialist's search query for the whole consultation
+            agents_instance.plan_tool_queries(state["case_info"], triage_result["selected_roles"])
+            return triage_result
+
+        # Retrieval and triage are independent: run both branches at once and join
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            retrieval_future = pool.submit(contextvars.copy_context().run, _timed, retrieve)
+            triage_future = pool.submit(contextvars.copy_context().run, _timed, triage)
+            retrieval_result, retrieval_s = retrieval_future.result()
+            triage_result, triage_s = triage_future.result()
+
+        # Round-1 prior knowledge per specialist: experiences tagged with that role, all roles in one search
+        role_kb_docs = {}
+        if role_kb_k:
+            with telemetry.span("kb.retrieve_roles", roles=len(triage_result["selected_roles"])):
+                role_kb_docs = kb_system.retrieve_for_roles(state["case_info"], triage_result["selected_roles"],
+                                                            k=role_kb_k, fallback=retrieval_result["docs"],
+                                                            query_vec=retrieval_result.get("query_vec"))
 
         return {
             "selected_roles": triage_result["selected_roles"],
@@ -39,9 +94,16 @@ def create_workflow(agents_instance):
             "current_round": 1,
             "kb_context_text": retrieval_result["text"],
             "kb_context_docs": retrieval_result["docs"],
-            "context_bullets": []
+            "role_kb_docs": role_kb_docs,
+            "context_bullets": [],
+            "timings": {
+                "triage.retrieval_s": round(retrieval_s, 3),
+                "triage.primary_care_s": round(triage_s, 3),
+                "triage.total_s": round(time.perf_counter() - started, 3)
+            }
         }
 
+    @instrumented("node.consultation")
     def node_consultation_and_synthesis(state: MDTState):
         roles = state["selected_roles"]
         rnd = state["current_round"]
@@ -51,26 +113,29 @@ def create_workflow(agents_instance):
         # 1. This is calculated BEFORE the agent loop.
         # 2. It only contains info from PREVIOUS rounds (bullets).
         # 3. Therefore, agents in this round CANNOT see each other's current output.
-        residual_context = ""
-        if rnd == 1:
-            residual_context = f"PRIOR KNOWLEDGE FROM DB:\n{state['kb_context_text']}"
-        else:
-            recent_bullets = bullets[-2:]
-            for i, b in enumerate(recent_bullets):
-                bullet_rnd = rnd - len(recent_bullets) + i
-                residual_context += f"--- Round {bullet_rnd} Summary ---\n{b}\n"
-
-        dialogues = []
-        for role in roles:
-            img = state["image_base64"] if rnd == 1 else None
-
-            # Logic Check: Independence & Blindness
-            # 1. 'residual_context' is static for all agents in this loop.
-            # 2. 'ground_truth' is NOT passed to the agent.
-            res = agents_instance.specialist_consult(
-                role, state["case_info"], residual_context, img, rnd
+        # 4. Every specialist pays for it, so it is compacted to a token budget.
+        with telemetry.span("context.build"):
+            residual_context = context_builder.build(
+                rnd, bullets, state.get("kb_context_docs"), state["kb_context_text"]
             )
-            dialogues.append(f"**{role}**: {res}")
+            role_contexts = None
+            if rnd == 1 and state.get("role_kb_docs"):
+                role_contexts = {
+                    role: context_builder.role_prior_knowledge(docs, state["kb_context_text"])
+                    for role, docs in state["role_kb_docs"].items()
+                }
+        # Tokens of prior context each specialist receives
+        contexts = list(role_contexts.values()) if role_contexts else [residual_context]
+        telemetry.record("context.tokens", 0.0, tokens=sum(map(count_tokens, contexts)) // len(contexts))
+
+        img = state["image_base64"] if rnd == 1 else None
+
+        # Logic Check: Independence & Blindness
+        # 1. 'residual_context' is static for all agents in this round, so they can run concurrently.
+        # 2. 'ground_truth' is NOT passed to the agent.
+        results = agents_instance.consult_round(roles, state["case_info"], residual_context, img, rnd,
+                                                role_contexts=role_contexts)
+        dialogues = [f"**{role}**: {res}" for role, res in zip(roles, results)]
 
         # Lead Physician synthesizes the accumulated dialogues
         summary_json = agents_instance.lead_physician_synthesis(dialogues, rnd)
@@ -80,19 +145,27 @@ def create_workflow(agents_instance):
             "current_round": rnd
         }
 
+    @instrumented("node.safety")
     def node_safety_check(state: MDTState):
-        last_bullet = state["context_bullets"][-1]
+        bullets = state["context_bullets"]
+        last_bullet = bullets[-1]
         rnd = state["current_round"]
 
-        # Safety Reviewer checks convergence based on the summary
-        review = agents_instance.safety_reviewer(last_bullet, rnd)
+        # Local check first: consecutive summaries that no longer move make the reviewer call redundant
+        with telemetry.span("convergence.check"):
+            check = convergence.assess(bullets, kb_system.embeddings)
+        telemetry.record("convergence", 0.0, **check)
 
-        is_converged = "STATUS: CONVERGED" in review
-        final_ans = ""
+        if check["decision"] == CONVERGED:
+            return {
+                "is_converged": True,
+                "final_answer": convergence.integration(last_bullet),
+                "current_round": rnd + 1
+            }
 
-        if "FINAL_ANSWER:" in review:
-            parts = review.split("FINAL_ANSWER:")
-            final_ans = parts[1].strip() if len(parts) > 1 else review
+        # Safety Reviewer checks convergence based on the summary
+        review = agents_instance.safety_reviewer(last_bullet, rnd)
+        is_converged, final_ans = convergence.resolve(check, review, last_bullet)
 
         if rnd >= state["max_rounds"]:
             is_converged = True
@@ -122,4 +195,5 @@ def create_workflow(agents_instance):
 
     workflow.add_conditional_edges("safety_layer", router, {"continue": "consultation_layer", "end": END})
 
-    return workflow.compile()
\ No newline at end of file
+    # With a checkpointer every node's output is saved per thread id, so a failed run can resume
+    return workflow.compile(checkpointer=checkpointer)
\ No newline at end of file